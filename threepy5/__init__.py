@@ -3,7 +3,7 @@
 import wx
 import threepy5
 
-__all__ = ["threepy5", "deck", "canvas", "card", "view", "box", "utilities"]
+__all__ = ["threepy5", "deck", "canvas", "card", "view", "box", "utilities", "layout", "undo"]
 
 if __name__ == "__main__":
     app = wx.App()
@@ -7,8 +7,10 @@ It also has facilities for closer inspection of individual objects (from the mod
 import wx
 import view
 import card
+import undo
+import utilities
 from deck import Deck
-from canvas import Canvas
+from canvas import Canvas, DeckSnapshot
 from card import KindButton as kindb
 import wx.lib.newevent as ne
 
@@ -36,6 +38,8 @@ class Box(wx.Panel):
     ZOOM_CHOICES = ["50%", "100%", "150%", "200%"]
     VIEW_CH_DEF = "View"
     VIEW_CHOICES = ("All", kindb.CONCEPT_LBL_LONG, kindb.ASSUMPTION_LBL_LONG, kindb.RESEARCH_LBL_LONG, kindb.FACT_LBL_LONG)
+    RATING_CHOICES = ["Any rating"] + [str(n) + "+ stars" for n in range(1, card.StarRating.MAX + 1)]
+    TAG_HINT = "Tag"
 
     ViewEvent, EVT_VIEW = ne.NewEvent()
     CancelViewEvent, EVT_CANCEL_VIEW = ne.NewEvent()
@@ -55,6 +59,7 @@ class Box(wx.Panel):
         self.sidebars = []
         self.scale = 1.0
         self.content_size = wx.Size(size[0], size[1])
+        self.undo = undo.UndoStack()
 
         # GUI
         self.ui_ready = False        
@@ -131,6 +136,50 @@ class Box(wx.Panel):
         self.ShowDeck()
         self.view.SetLabel("View")
 
+    def ReadNext(self, step=1):
+        """Read `Content` `Card`s one after another, in the `Deck`'s reading
+        order (see `Deck.GetReadingOrder`). If we are already viewing a `Card`,
+        view the one `step` places after it. Otherwise, start viewing from the
+        current `Card`, or from the first one.
+
+        * `step: ` how many `Card`s to move. Use a negative number to go backwards.
+
+        `returns: ` the `Card` now being viewed, or None.
+        """
+        viewing = self.view_card.GetCards() if self.GetCurrentContent() == view.CardView else []
+        if viewing:
+            nxt = self.deck.GetReadingNext(viewing[-1], step, cls=card.Content)
+        else:
+            sel = self.deck.GetSelection()
+            nxt = sel[-1] if sel else utilities.GetCardAncestor(self.FindFocus())
+            if not isinstance(nxt, card.Content) or nxt.GetParent() != self.deck:
+                order = [c for c in self.deck.GetReadingOrder() if isinstance(c, card.Content)]
+                nxt = order[0] if order else None
+        if not nxt: return None
+
+        if viewing:
+            self.view_card.Restore()
+        self.ViewCards([nxt])
+        return nxt
+
+    def Present(self):
+        """Show the `Content`s in reading order as read-only pages, one at
+        a time, starting from the current `Card`. See `PresentationView`."""
+        sel = self.deck.GetSelection()
+        start = sel[-1] if sel else utilities.GetCardAncestor(self.FindFocus())
+        self.deck.UnselectAll()
+        self.ShowContent(self.presentation)
+        self.presentation.Start(self.deck, start)
+
+    def StopPresentation(self):
+        """Go back to the `Deck`, showing the last `Card` that was presented."""
+        crd = self.presentation.GetCurrentCard()
+        self.presentation.Clear()
+        self.ShowDeck()
+        if crd:
+            self.deck.ScrollToCard(crd)
+            self.deck.SelectCard(crd, True)
+
     def ShowDeck(self):
         """Show the `Deck` in the `content_sizer`."""
         # remember that self.deck is a Deck
@@ -145,6 +194,8 @@ class Box(wx.Panel):
         self.ShowContent(self.canvas)
         view = self.deck.GetViewStart()
         self.canvas.Scroll(view)
+        # Scroll() doesn't raise wx.EVT_SCROLLWIN
+        self.canvas.UpdateOffset()
 
     def ShowMinimap(self):
         """Show the `DeckView`. Note that the minimap is not in `self.contents`, so it
@@ -175,29 +226,6 @@ class Box(wx.Panel):
         """
         return self.buttonbar
 
-    def GetDeckBmp(self):
-        """Get the currently visible part of the `Deck` as a wx.Bitmap.
-
-        `returns: ` a `wx.Bitmap`.
-        """
-        # get the current deck as a bitmap
-        sz = self.deck.GetClientSize()
-        bmp = None
-
-        if sz.width > -1 and sz.height > -1:
-            bmp = wx.EmptyBitmap(sz.width, sz.height)
-            dc = wx.MemoryDC()
-            
-            dc.SelectObject(bmp)
-            dc.Blit(0, 0,                         # pos
-                    sz.x, sz.y,                   # size
-                    wx.ClientDC(self.deck),      # src
-                    0, 0)                         # offset
-            bmp = dc.GetAsBitmap()
-            dc.SelectObject(wx.NullBitmap)
-
-        return bmp
-
     def SetupCanvas(self):
         """Setup the `Canvas` background. Always call before showing the `Canvas`."""
         # set sizes
@@ -206,9 +234,21 @@ class Box(wx.Panel):
         self.canvas.SetVirtualSize(sz)
         self.canvas.content_sz = sz
 
-        # pass the bitmap to canvas
+        # the background is kept up to date by self.snapshot
         self.canvas.SetOffset(self.deck.GetViewStartPixels())
-        self.canvas.SetBackground(self.GetDeckBmp())
+
+    def Undo(self):
+        """Undo the last action on the `Deck` or the `Canvas`."""
+        # text edits are only recorded when the focus leaves a card
+        self.deck.CheckEdits()
+        self.undo.Undo()
+        self.deck.WatchEdits(self.deck.edit_card)
+
+    def Redo(self):
+        """Redo the last undone action."""
+        self.deck.CheckEdits()
+        self.undo.Redo()
+        self.deck.WatchEdits(self.deck.edit_card)
 
     def ShowSidebar(self, show=True):
         """Show/Hide the sidebar.
@@ -273,6 +313,7 @@ class Box(wx.Panel):
         """
         self.deck.Load(di["deck"])
         self.canvas.Load(di["canvas"])
+        self.undo.Clear()
 
     def CleanUpUI(self):
         """Helper function for `InitUI`. Resets all control members.
@@ -302,6 +343,7 @@ class Box(wx.Panel):
         self.InitDeck(sz)
         self.InitCanvas()
         self.InitView()
+        self.InitPresentation()
         self.InitSidebar()
         # execute only the first time
         if not self.ui_ready: self.InitButtonBar()
@@ -352,6 +394,7 @@ class Box(wx.Panel):
         """Initializes `Deck`."""
         # make deck
         dk = Deck(self, size=size)
+        dk.SetUndoStack(self.undo)
         
         # bindings
         dk.Bind(Deck.EVT_REQUEST_VIEW, self.OnRequestView)
@@ -370,6 +413,9 @@ class Box(wx.Panel):
     def InitCanvas(self, size=wx.DefaultSize):
         """Initializes `Canvas`."""
         cv = Canvas(self, size=size)
+        cv.SetUndoStack(self.undo)
+        self.snapshot = DeckSnapshot(self.deck)
+        cv.SetSnapshot(self.snapshot)
         self.canvas = cv
         self.canvas.Hide()
         self.contents.append(cv)
@@ -384,6 +430,16 @@ class Box(wx.Panel):
         # bindings
         vw.Bind(card.Card.EVT_CANCEL_VIEW, self.OnCancelView)
 
+    def InitPresentation(self, size=wx.DefaultSize):
+        """Initializes `PresentationView`."""
+        pr = view.PresentationView(self, size=size)
+        self.presentation = pr
+        self.presentation.Hide()
+        self.contents.append(pr)
+
+        # bindings
+        pr.Bind(view.PresentationView.EVT_CANCEL_PRESENT, self.OnCancelPresent)
+
     def InitSidebar(self, size=wx.DefaultSize):
         """Initializes `TagView`."""
         tg = view.TagView(self, self.deck)
@@ -406,7 +462,18 @@ class Box(wx.Panel):
 
         self.bykind = wx.Choice(self, choices=Box.VIEW_CHOICES)
         self.bykind.SetSelection(0)
-        self.bykind.Bind(wx.EVT_CHOICE, self.OnView)
+        self.bykind.Bind(wx.EVT_CHOICE, self.OnFilter)
+
+        self.byrating = wx.Choice(self, choices=Box.RATING_CHOICES)
+        self.byrating.SetSelection(0)
+        self.byrating.Bind(wx.EVT_CHOICE, self.OnFilter)
+
+        self.bytag = wx.SearchCtrl(self, style=wx.TE_PROCESS_ENTER)
+        self.bytag.SetDescriptiveText(Box.TAG_HINT)
+        self.bytag.ShowCancelButton(True)
+        self.bytag.Bind(wx.EVT_TEXT_ENTER, self.OnFilter)
+        self.bytag.Bind(wx.EVT_SEARCHCTRL_SEARCH_BTN, self.OnFilter)
+        self.bytag.Bind(wx.EVT_SEARCHCTRL_CANCEL_BTN, self.OnTagCancel)
                     
         chs = self.ZOOM_CHOICES
         self.zoom = wx.ComboBox(self, value=chs[1], choices=chs, style=wx.TE_PROCESS_ENTER)
@@ -421,6 +488,8 @@ class Box(wx.Panel):
         box.Add(self.view,   proportion=0, flag=wx.LEFT|wx.EXPAND, border=1)
         box.Add(self.toggle, proportion=0, flag=wx.LEFT|wx.EXPAND, border=1)
         box.Add(self.bykind, proportion=0, flag=wx.LEFT|wx.EXPAND, border=1)
+        box.Add(self.byrating, proportion=0, flag=wx.LEFT|wx.EXPAND, border=1)
+        box.Add(self.bytag,  proportion=0, flag=wx.LEFT|wx.EXPAND, border=1)
         box.Add(zbox,      proportion=1, flag=wx.ALIGN_RIGHT|wx.EXPAND, border=1)        
 
 
@@ -441,11 +510,16 @@ class Box(wx.Panel):
         self.CancelView()
         ev.GetEventObject().SetFocus()
         
+    def OnCancelPresent(self, ev):
+        """Listens to `PresentationView.EVT_CANCEL_PRESENT`."""
+        self.StopPresentation()
+
     def OnDelete(self, ev):
         """Listens to `Deck.EVT_DEL_CARD`."""
         event = self.DeleteEvent(id=wx.ID_ANY, number=ev.number)
         event.SetEventObject(self)
         self.GetEventHandler().ProcessEvent(event)
+        ev.Skip()
 
     def OnView(self, ev):
         """Listens to `wx.EVT_BUTTON` from the view button in the button bar."""
@@ -504,6 +578,10 @@ class Box(wx.Panel):
         scroll_pos = self.deck.GetViewStart()
         self.deck.Scroll(0, 0)
 
+        # set the new scale first: every stretched card updates its model
+        # rect (see Deck.GetModelRect), which must not change when zooming
+        self.deck.scale = new_scale
+
         # scale cards
         for c in self.deck.GetCards():
             c.Stretch(new_scale / self.scale)
@@ -519,8 +597,8 @@ class Box(wx.Panel):
         self.zoom.SetValue(str(int(new_scale * 100)) + "%")
 
         # setup members
-        self.deck.scale = new_scale
-        self.canvas.scale = new_scale
+        self.snapshot.Clear()
+        self.canvas.SetScale(new_scale)
         self.scale = new_scale            
 
     def ZoomIn(self):
@@ -537,18 +615,19 @@ class Box(wx.Panel):
         if new > -1 and new < len(chs):
             self.Zoom(self.GetScaleFromStr(chs[new]))
 
-    def OnView(self, ev):
-        """Listens to `wx.EVT_CHOICE` from the view contents by kind combo box in the button bar."""
-        s = ev.GetString()
-        if s == "All":
-            show = self.deck.GetCards()
-        else:
-            show = self.deck.GetContentsByKind(s)
-            
-        show = list(set(show) | set(self.deck.GetHeaders()))
-        hide = list(set(self.deck.GetCards()) - set(show))
-        for c in show: c.Show()
-        for c in hide: c.Hide()
+    def OnFilter(self, ev):
+        """Listens to `wx.EVT_CHOICE` from the kind and rating choices, and to
+        `wx.EVT_TEXT_ENTER` from the tag search box, in the button bar."""
+        kind = self.bykind.GetStringSelection()
+        kind = None if kind == "All" else kind
+        rating = self.byrating.GetSelection() or None
+        tag = self.bytag.GetValue().strip() or None
+        self.deck.SetFilter(kind, rating, tag)
+
+    def OnTagCancel(self, ev):
+        """Listens to `wx.EVT_SEARCHCTRL_CANCEL_BTN` from the tag search box in the button bar."""
+        self.bytag.SetValue("")
+        self.OnFilter(ev)
 
 
 
@@ -2,7 +2,7 @@
 """
 A window that can be drawn over in a free-hand style, with a custom
 background. In threepy5, every `Box` has a `Canvas`, whose background
-is set as the current view in that `Box`'s `Deck`. The overall result
+is a `DeckSnapshot` of that `Box`'s `Deck`. The overall result
 is that the user can hand-draw "over" the `Card`s of the `Deck`. Some
 code copied from wxPython demo code app doodle.py:
 http://www.wxpython.org/download.php.
@@ -10,32 +10,282 @@ http://www.wxpython.org/download.php.
 
 import wx
 import utilities
+import layout
+import card
+import undo
+from deck import Deck
+from array import array
+from math import ceil
+from collections import OrderedDict
+
+
+######################
+# DeckSnapshot Class
+######################
+
+class DeckSnapshot(object):
+    """A picture of the whole virtual area of a `Deck`, drawn from the data of
+    its `Card`s instead of copied from the screen. It is drawn in tiles of the
+    same size as `CanvasBase`'s, at the current scale of the `Deck`, so that
+    when zoomed out it is also drawn at a reduced resolution. Tiles are only
+    drawn when needed, and forgotten when the `Card`s under them change, or
+    when they are the least recently used ones and there are too many.
+    """
+
+    TILE_SIZE = 256
+    MAX_TILES = 256
+    MAX_IMAGES = 64
+    TEXT_MIN_SCALE = 0.5
+    FONT_SIZE = 9
+    BORDER_CL = (120, 120, 120, 255)
+    TEXT_CL = (0, 0, 0, 255)
+    
+    def __init__(self, deck):
+        """Constructor.
+
+        * `deck: ` the `Deck` to draw.
+        """
+        self.deck = deck
+        self.tiles = OrderedDict()
+        self.images = OrderedDict()
+        self.listeners = []
+
+        deck.Bind(Deck.EVT_NEW_CARD, self.OnNewCard)
+        deck.Bind(Deck.EVT_DEL_CARD, self.OnDeleteCards)
+        deck.Bind(Deck.EVT_CARD_GEOMETRY, self.OnCardGeometry)
+        deck.Bind(Deck.EVT_FILTER, self.OnFilter)
+        deck.Bind(card.Content.EVT_CONT_KIND, self.OnCardChanged)
+        deck.Bind(wx.EVT_TEXT, self.OnCardChanged)
+
+
+    ### Behavior functions
+
+    def AddListener(self, func):
+        """Register a function to be called when part of the snapshot changes.
+
+        * `func: ` a function that takes a `(x, y, w, h)` rect, in absolute coordinates.
+        """
+        self.listeners.append(func)
+
+    def Invalidate(self, rect):
+        """Forget the tiles under `rect`.
+
+        * `rect: ` a `(x, y, w, h)` tuple, in absolute coordinates.
+        """
+        for tile in self.GetTiles(rect):
+            self.tiles.pop(tile, None)
+        for func in self.listeners:
+            func(rect)
+
+    def InvalidateRects(self, rects):
+        """Forget the tiles under each of `rects`, and notify the listeners once.
+
+        * `rects: ` a list of `(x, y, w, h)` tuples, in absolute coordinates.
+        """
+        if not rects: return
+        for rect in rects:
+            for tile in self.GetTiles(rect):
+                self.tiles.pop(tile, None)
+        union = utilities.UnionRects(rects)
+        for func in self.listeners:
+            func(union)
+
+    def Clear(self):
+        """Forget all tiles. Call when the scale of the `Deck` changes."""
+        self.tiles = OrderedDict()
+        self.images = OrderedDict()
+
+    def GetTile(self, tile):
+        """Get a tile, drawing it first if necessary.
+
+        * `tile: ` a `(column, row)` tuple.
+
+        `returns: ` a `wx.Bitmap`.
+        """
+        if tile not in self.tiles:
+            self.tiles[tile] = self.RenderTile(tile)
+        utilities.TouchCache(self.tiles, tile, self.MAX_TILES)
+        return self.tiles[tile]
+
+    def GetTiles(self, rect):
+        """Get the tiles covered by `rect`.
+
+        * `rect: ` a `(x, y, w, h)` tuple, in absolute coordinates.
+
+        `returns: ` a list of `(column, row)` tuples.
+        """
+        x, y, w, h = rect
+        size = self.TILE_SIZE
+        return [(i, j) for i in range(int(x // size), int((x + max(w, 1) - 1) // size) + 1)
+                       for j in range(int(y // size), int((y + max(h, 1) - 1) // size) + 1)]
+
+
+    ### Auxiliary functions
+
+    def RenderTile(self, tile):
+        """Draw all the `Card`s that fall inside a tile.
+
+        * `tile: ` a `(column, row)` tuple.
+
+        `returns: ` a `wx.Bitmap`.
+        """
+        size = self.TILE_SIZE
+        left, top = tile[0] * size, tile[1] * size
+        bmp = wx.EmptyBitmap(size, size)
+
+        dc = wx.MemoryDC(bmp)
+        dc.BeginDrawing()
+        dc.SetBackground(wx.Brush(self.deck.GetBackgroundColour()))
+        dc.Clear()
+        dc.SetDeviceOrigin(-left, -top)
+
+        # hidden cards are those filtered out, see Deck.SetFilter
+        hits = [c for c in self.deck.spatial.Query((left, top, size, size)) if c.IsShown()]
+        # keep the stacking order of the deck
+        for c in sorted(hits, key=self.deck.GetStackingOrder):
+            self.DrawCard(dc, c, self.deck.spatial.GetRect(c))
+
+        dc.EndDrawing()
+        dc.SelectObject(wx.NullBitmap)
+        return bmp
+
+    def DrawCard(self, dc, crd, rect):
+        """Draw a `Card` from its data.
+
+        * `dc: ` a `wx.DC`.
+        * `crd: ` a `Card`.
+        * `rect: ` its rect, in absolute coordinates.
+        """
+        x, y, w, h = rect
+        dc.SetPen(wx.Pen(self.BORDER_CL, 1, wx.SOLID))
+        dc.SetBrush(wx.Brush(crd.GetBackgroundColour()))
+        dc.DrawRectangle(x, y, w, h)
+
+        if isinstance(crd, card.Image):
+            bmp = self.GetImage(crd.GetImageKey(), w - 2, h - 2)
+            if bmp: dc.DrawBitmap(bmp, x + 1, y + 1)
+            return
+
+        # text is unreadable when zoomed out too much
+        scale = self.deck.scale
+        if scale < self.TEXT_MIN_SCALE: return
+
+        if isinstance(crd, card.Content):
+            text = crd.GetTitle() + "\n" + crd.GetContent()
+        elif isinstance(crd, card.Header):
+            text = crd.GetHeader()
+        else:
+            return
+
+        pad = int(5 * scale)
+        dc.SetFont(wx.Font(max(1, int(self.FONT_SIZE * scale)), wx.SWISS, wx.NORMAL, wx.NORMAL))
+        dc.SetTextForeground(self.TEXT_CL)
+        dc.SetClippingRegion(x + pad, y + pad, max(1, w - 2 * pad), max(1, h - 2 * pad))
+        dc.DrawText(text, x + pad, y + pad)
+        dc.DestroyClippingRegion()
+
+    def GetImage(self, key, w, h):
+        """Get an image from `card.Image.store`, scaled to the given size.
+
+        * `key: ` the image key. See `ImageStore`.
+        * `w: ` the width.
+        * `h: ` the height.
+
+        `returns: ` a `wx.Bitmap`, or `None`.
+        """
+        if not key or w < 1 or h < 1: return None
+        if (key, w, h) not in self.images:
+            bmp = card.Image.store.GetBitmap(key)
+            if not bmp: return None
+            img = bmp.ConvertToImage().Scale(w, h, wx.IMAGE_QUALITY_NORMAL)
+            self.images[(key, w, h)] = wx.BitmapFromImage(img)
+        utilities.TouchCache(self.images, (key, w, h), self.MAX_IMAGES)
+        return self.images[(key, w, h)]
+
+
+    ### Callbacks
+
+    def OnNewCard(self, ev):
+        """Listens to `Deck.EVT_NEW_CARD`."""
+        self.InvalidateRects([self.deck.GetAbsoluteRect(c) for c in ev.cards])
+        ev.Skip()
+
+    def OnCardGeometry(self, ev):
+        """Listens to `Deck.EVT_CARD_GEOMETRY`."""
+        self.Invalidate(ev.old)
+        self.Invalidate(ev.rect)
+        ev.Skip()
+
+    def OnDeleteCards(self, ev):
+        """Listens to `Deck.EVT_DEL_CARD`."""
+        self.InvalidateRects(ev.rects)
+        ev.Skip()
+
+    def OnFilter(self, ev):
+        """Listens to `Deck.EVT_FILTER`."""
+        self.InvalidateRects([self.deck.spatial.GetRect(c) for c in ev.cards
+                              if self.deck.spatial.Contains(c)])
+        ev.Skip()
+
+    def OnCardChanged(self, ev):
+        """Listens to `wx.EVT_TEXT` and `Content.EVT_CONT_KIND`, which
+        propagate from the `Card`s to the `Deck`."""
+        crd = utilities.GetCardAncestor(ev.GetEventObject())
+        if crd and self.deck.spatial.Contains(crd):
+            self.Invalidate(self.deck.spatial.GetRect(crd))
+        ev.Skip()
+
 
 
 ######################
 # CanvasBase Class
 ######################
 
-class CanvasBase(wx.StaticBitmap):
-    """`CanvasBase` is a `wx.StaticBitmap` over which the user can draw by free-hand."""
+class CanvasBase(wx.Window):
+    """`CanvasBase` is a `wx.Window` over which the user can draw by free-hand.
+    What is drawn is cached in square tiles of `TILE_SIZE` pixels, and every
+    stroke is indexed by its bounding box, so that painting only renders the
+    visible tiles that changed since they were last rendered. Only the
+    `MAX_TILES` most recently used tiles are kept.
+
+    Strokes are stored in model coordinates: the coordinates of the `Deck`
+    at a scale of 1.0, multiplied by `SUBPIXEL` so that strokes drawn while
+    zoomed in keep their sub-pixel detail. They are transformed to the current
+    scale and offset every time they are drawn, so they stay over the same
+    `Card`s at every zoom level.
+    """
+
+    SIMPLIFY_TOLERANCE = 1.0    # in screen pixels
+    SUBPIXEL = 16
+    TILE_SIZE = DeckSnapshot.TILE_SIZE
+    MAX_TILES = DeckSnapshot.MAX_TILES
     
-    def __init__(self, parent, bitmap=wx.NullBitmap):
+    def __init__(self, parent):
         """Constructor.
 
         * `parent: ` the parent `wx.Window`.
-        * `bitmap: ` the wx.Bitmap to set as background. By default is `wx.NullBitmap`.
         """
-        super(CanvasBase, self).__init__(parent, bitmap=bitmap, style=wx.BORDER_NONE)
+        super(CanvasBase, self).__init__(parent, style=wx.BORDER_NONE)
         self.thickness = 1
         self.colour = "BLACK"
         self.pen = wx.Pen(self.colour, self.thickness, wx.SOLID)
-        self.lines = []
+        self.styles = []
+        self.style_ids = {}
+        self.pens = []
+        self.strokes = []
+        self.cur_stroke = array("i")
+        self.cur_screen = []
         self.pos = wx.Point(0,0)
-        self.buffer = wx.EmptyBitmap(1, 1)
         self.offset = wx.Point(0, 0)
-        
-        self.InitBuffer()
-
+        self.scale = 1.0
+        self.snapshot = None
+        self.index = layout.SpatialIndex(self.TILE_SIZE * self.SUBPIXEL)
+        self.tiles = OrderedDict()
+        self.dirty = set()
+        self.undo = undo.UndoStack()
+
+        self.Bind(wx.EVT_PAINT, self.OnPaint)
+        self.Bind(wx.EVT_ERASE_BACKGROUND, self.OnEraseBackground)
         self.Bind(wx.EVT_LEFT_DOWN, self.OnLeftDown)
         self.Bind(wx.EVT_LEFT_UP, self.OnLeftUp)
         self.Bind(wx.EVT_MOTION, self.OnMotion)
@@ -44,11 +294,14 @@ class CanvasBase(wx.StaticBitmap):
     ### Behavior functions
     
     def SetOffset(self, pt):
-        """Set the offset.
+        """Set the offset: the absolute coordinates, at the current scale, of the point shown at `(0, 0)`.
 
         * `pt: ` a (x, y) point.
         """
-        self.offset = pt
+        if pt != self.offset:
+            self.offset = wx.Point(*pt)
+            # tiles are in absolute coordinates: they are all still valid
+            self.Refresh(eraseBackground=False)
 
     def GetOffset(self):
         """Get the current offset.
@@ -57,75 +310,302 @@ class CanvasBase(wx.StaticBitmap):
         """
         return self.offset
 
-    def DrawLines(self):
-        """Redraws all the lines that have been drawn already."""
-        dc = wx.MemoryDC(self.GetBitmap())
-        dc.BeginDrawing()
+    def SetScale(self, scale):
+        """Set the scale at which strokes are drawn. See `Box.Zoom`.
 
-        for colour, thickness, line in self.lines:
-            pen = wx.Pen(colour, thickness, wx.SOLID)
-            dc.SetPen(pen)
-            for coords in line:
-                x1, y1, x2, y2 = coords
-                # draw the lines relative to the current offset
-                dc.DrawLine(x1 - self.offset.x, y1 - self.offset.y,
-                            x2 - self.offset.x, y2 - self.offset.y)
-        
-        dc.EndDrawing()
-        self.SetBitmap(dc.GetAsBitmap())
+        * `scale: ` a `float`.
+        """
+        if scale != self.scale:
+            self.scale = scale
+            self.pen = self.MakePen(self.colour, self.thickness)
+            self.pens = [self.MakePen(c, t) for c, t in self.styles]
+            self.InvalidateAll()
+
+    def GetScale(self):
+        """Get the scale at which strokes are drawn.
+
+        `returns: ` a `float`.
+        """
+        return self.scale
+
+    def SetSnapshot(self, snapshot):
+        """Set the background over which to draw.
+
+        * `snapshot: ` a `DeckSnapshot`. Its tiles are the same size as ours.
+        """
+        self.snapshot = snapshot
+        snapshot.AddListener(self.InvalidateAbsolute)
+        self.InvalidateAll()
+
+    def Clear(self):
+        """Delete all strokes."""
+        self.styles = []
+        self.style_ids = {}
+        self.pens = []
+        self.strokes = []
+        self.index = layout.SpatialIndex(self.TILE_SIZE * self.SUBPIXEL)
+        self.InvalidateAll()
+
+    def GetStyle(self, colour, thickness):
+        """Get the index of a style in the style table, adding it if necessary.
+        All the strokes drawn with the same pen share the same entry.
+
+        * `colour: ` a colour name or tuple.
+        * `thickness: ` the pen width.
+
+        `returns: ` an index into `self.styles`.
+        """
+        style = (colour, thickness)
+        if style not in self.style_ids:
+            self.style_ids[style] = len(self.styles)
+            self.styles.append(style)
+            self.pens.append(self.MakePen(colour, thickness))
+        return self.style_ids[style]
+
+    def AddStroke(self, colour, thickness, points):
+        """Store a new stroke.
+
+        * `colour: ` a colour name or tuple.
+        * `thickness: ` the pen width.
+        * `points: ` an `array("i")` of the form [x1, y1, x2, y2, ...], in model coordinates times `SUBPIXEL`.
+        """
+        if len(points) >= 4:
+            key = len(self.strokes)
+            self.strokes.append((self.GetStyle(colour, thickness), points))
+            rect = self.GetStrokeRect(key)
+            self.index.Insert(key, rect)
+            self.InvalidateRect(rect)
+
+    def PopStroke(self):
+        """Delete the last stroke.
+
+        `returns: ` a `(style, points)` tuple.
+        """
+        key = len(self.strokes) - 1
+        rect = self.GetStrokeRect(key)
+        self.index.Remove(key)
+        stroke = self.strokes.pop()
+        self.InvalidateRect(rect)
+        return stroke
+
+    def SetUndoStack(self, stack):
+        """Set the `UndoStack` where new strokes are recorded. See `Box`.
+
+        * `stack: ` an `UndoStack`.
+        """
+        self.undo = stack
+
+    def GetStrokeRect(self, key):
+        """Get the bounding box of a stroke, including the pen width.
+
+        * `key: ` an index into `self.strokes`.
+
+        `returns: ` a `(x, y, w, h)` tuple, in model coordinates.
+        """
+        style, points = self.strokes[key]
+        pad = self.styles[style][1] * self.SUBPIXEL
+        xs, ys = points[0::2], points[1::2]
+        left, top = min(xs) - pad, min(ys) - pad
+        return (left, top, max(xs) + pad - left + self.SUBPIXEL, max(ys) + pad - top + self.SUBPIXEL)
+
+    def InvalidateRect(self, rect):
+        """Mark the tiles under `rect` to be rendered again.
+
+        * `rect: ` a `(x, y, w, h)` tuple, in model coordinates.
+        """
+        self.InvalidateAbsolute(self.ModelToAbsolute(rect))
+
+    def InvalidateAbsolute(self, rect):
+        """Mark the tiles under `rect` to be rendered again.
+
+        * `rect: ` a `(x, y, w, h)` tuple, in absolute coordinates.
+        """
+        x, y, w, h = rect
+        # tiles that are not cached will be rendered anyway
+        self.dirty.update([t for t in self.GetTiles(rect) if t in self.tiles])
+        self.RefreshRect(wx.Rect(x - self.offset.x, y - self.offset.y, w, h), eraseBackground=False)
+
+    def InvalidateAll(self):
+        """Forget all rendered tiles."""
+        self.tiles = OrderedDict()
+        self.dirty = set()
+        self.Refresh(eraseBackground=False)
+
+    def DrawLines(self, dc, keys, origin):
+        """Draw some of the strokes.
+
+        * `dc: ` a `wx.DC`.
+        * `keys: ` indices into `self.strokes`.
+        * `origin: ` the absolute coordinates of the `(0, 0)` point of `dc`.
+        """
+        for style, points in [self.strokes[k] for k in sorted(keys)]:
+            dc.SetPen(self.pens[style])
+            # one polyline per stroke
+            dc.DrawLines(self.ModelToScreen(points, origin))
 
         
     ### Auxiliary functions
-    
-    def InitBuffer(self):
-        """Initialize the bitmap used for buffering the display."""
-        size = self.GetClientSize()
-        buf = wx.EmptyBitmap(max(1, size.width), max(1, size.height))
-        dc = wx.BufferedDC(None, buf)
-
-        # clear everything by painting over with bg colour        
-        dc.SetBackground(wx.Brush(self.GetBackgroundColour()))
-        dc.Clear()
 
-        self.DrawLines()
-        self.buffer = buf
+    def MakePen(self, colour, thickness):
+        """Make a pen whose width follows the current scale.
+
+        * `colour: ` a colour name or tuple.
+        * `thickness: ` the pen width at a scale of 1.0.
+
+        `returns: ` a `wx.Pen`.
+        """
+        return wx.Pen(colour, max(1, int(round(thickness * self.scale))), wx.SOLID)
+
+    def ModelToScreen(self, points, origin):
+        """Transform a stroke's points to be drawn on a `wx.DC`.
+
+        * `points: ` a flat sequence of the form [x1, y1, x2, y2, ...], in model coordinates.
+        * `origin: ` the absolute coordinates of the `(0, 0)` point of the `wx.DC`.
+
+        `returns: ` a `list` of `(x, y)` tuples.
+        """
+        sc = self.scale / self.SUBPIXEL
+        ox, oy = origin
+        return [(int(x * sc) - ox, int(y * sc) - oy) for x, y in zip(points[0::2], points[1::2])]
+
+    def ModelToAbsolute(self, rect):
+        """Transform a rect from model coordinates to absolute coordinates at the current scale.
+
+        * `rect: ` a `(x, y, w, h)` tuple.
+
+        `returns: ` a `(x, y, w, h)` tuple.
+        """
+        sc = self.scale / self.SUBPIXEL
+        x, y, w, h = rect
+        return (int(x * sc), int(y * sc), int(ceil(w * sc)) + 1, int(ceil(h * sc)) + 1)
+
+    def AbsoluteToModel(self, rect):
+        """Transform a rect from absolute coordinates at the current scale to model coordinates.
+
+        * `rect: ` a `(x, y, w, h)` tuple.
+
+        `returns: ` a `(x, y, w, h)` tuple.
+        """
+        sc = self.scale / self.SUBPIXEL
+        x, y, w, h = rect
+        return (int(x / sc), int(y / sc), int(ceil(w / sc)) + self.SUBPIXEL, int(ceil(h / sc)) + self.SUBPIXEL)
+
+    def ScreenToModel(self, pt):
+        """Transform a point on this window to model coordinates.
+
+        * `pt: ` a `(x, y)` point.
+
+        `returns: ` a `(x, y)` tuple of `int`s, in units of 1 / `SUBPIXEL`.
+        """
+        sc = self.scale / self.SUBPIXEL
+        return (int(round((pt[0] + self.offset.x) / sc)), int(round((pt[1] + self.offset.y) / sc)))
+
+    def GetTiles(self, rect):
+        """Get the tiles covered by `rect`.
+
+        * `rect: ` a `(x, y, w, h)` tuple, in absolute coordinates.
+
+        `returns: ` a list of `(column, row)` tuples.
+        """
+        x, y, w, h = rect
+        size = self.TILE_SIZE
+        return [(i, j) for i in range(int(x // size), int((x + max(w, 1) - 1) // size) + 1)
+                       for j in range(int(y // size), int((y + max(h, 1) - 1) // size) + 1)]
+
+    def GetTile(self, tile):
+        """Get a tile, rendering it first if it's missing or dirty.
+
+        * `tile: ` a `(column, row)` tuple.
+
+        `returns: ` a `wx.Bitmap`.
+        """
+        if tile in self.dirty or tile not in self.tiles:
+            self.RenderTile(tile)
+        for t in utilities.TouchCache(self.tiles, tile, self.MAX_TILES):
+            self.dirty.discard(t)
+        return self.tiles[tile]
+
+    def RenderTile(self, tile):
+        """Render the background and the strokes that fall inside a tile.
+
+        * `tile: ` a `(column, row)` tuple.
+        """
+        size = self.TILE_SIZE
+        bmp = self.tiles.get(tile) or wx.EmptyBitmap(size, size)
+        left, top = tile[0] * size, tile[1] * size
+
+        dc = wx.MemoryDC(bmp)
+        dc.BeginDrawing()
+        if self.snapshot:
+            dc.DrawBitmap(self.snapshot.GetTile(tile), 0, 0)
+        else:
+            dc.SetBackground(wx.Brush(self.GetBackgroundColour()))
+            dc.Clear()
+        keys = self.index.Query(self.AbsoluteToModel((left, top, size, size)))
+        self.DrawLines(dc, keys, (left, top))
+        dc.EndDrawing()
+        dc.SelectObject(wx.NullBitmap)
+
+        self.tiles[tile] = bmp
+        self.dirty.discard(tile)
 
         
     ### Callbacks
 
+    def OnPaint(self, ev):
+        """Listens to `wx.EVT_PAINT` events. Copies only the tiles under the updated region."""
+        dc = wx.PaintDC(self)
+        rect = self.GetUpdateRegion().GetBox()
+        ox, oy = self.offset
+        size = self.TILE_SIZE
+
+        for tile in self.GetTiles((rect.x + ox, rect.y + oy, rect.width, rect.height)):
+            dc.DrawBitmap(self.GetTile(tile), tile[0] * size - ox, tile[1] * size - oy)
+
+        # the stroke being drawn is not in the tiles yet
+        if len(self.cur_screen) >= 2:
+            dc.SetPen(self.pen)
+            dc.DrawLines([(x - ox, y - oy) for x, y in self.cur_screen])
+
+    def OnEraseBackground(self, ev):
+        """Listens to `wx.EVT_ERASE_BACKGROUND`. The tiles cover everything."""
+        pass
+
     def OnLeftDown(self, ev):
         """Listens to `wx.EVT_LEFT_DOWN` events."""
-        self.curLine = []
         self.pos = ev.GetPosition()
+        # store in model coordinates
+        self.cur_stroke = array("i", self.ScreenToModel(self.pos))
+        # and in absolute coordinates, to paint it again while it's drawn
+        self.cur_screen = [(self.pos.x + self.offset.x, self.pos.y + self.offset.y)]
 
     def OnLeftUp(self, ev):
         """Listens to `wx.EVT_LEFT_UP` events."""
-        self.lines.append((self.colour, self.thickness, self.curLine))
-        self.curLine = []
+        # drop the points that make no visible difference at the current scale
+        tolerance = self.SIMPLIFY_TOLERANCE * self.SUBPIXEL / self.scale
+        points = utilities.SimplifyPolyline(self.cur_stroke, tolerance)
+        number = len(self.strokes)
+        self.AddStroke(self.colour, self.thickness, array("i", points))
+        self.cur_stroke = array("i")
+        self.cur_screen = []
+        if len(self.strokes) > number:
+            self.undo.Push(undo.AddStroke(self))
             
     def OnMotion(self, ev):
         """Listens to `wx.EVT_MOTION` events."""
-        if ev.Dragging() and ev.LeftIsDown():
-            # BufferedDC will paint first over self.GetBitmap()
-            # and then copy everything to ClientDC(self)
-            dc = wx.BufferedDC(wx.ClientDC(self), self.GetBitmap())
-            dc.BeginDrawing()
-            
-            dc.SetPen(self.pen)
+        if ev.Dragging() and ev.LeftIsDown() and self.cur_stroke:
             new_pos = ev.GetPosition()
 
-            # draw the lines with relative coordinates to the current view
-            coords = (self.pos.x, self.pos.y, new_pos.x, new_pos.y)
-            dc.DrawLine(*coords)
+            # store the points in model coordinates
+            self.cur_stroke.extend(self.ScreenToModel(new_pos))
+            self.cur_screen.append((new_pos.x + self.offset.x, new_pos.y + self.offset.y))
 
-            # but store them in absolute coordinates
-            coords = (self.pos.x + self.offset.x, self.pos.y + self.offset.y,
-                      new_pos.x  + self.offset.x,  new_pos.y + self.offset.y)
-            self.curLine.append(coords)
+            # and draw only the new segment over what's on screen: the
+            # tiles are rendered again only when the stroke is finished
+            dc = wx.ClientDC(self)
+            dc.SetPen(self.pen)
+            dc.DrawLine(self.pos.x, self.pos.y, new_pos.x, new_pos.y)
             self.pos = new_pos
-            
-            dc.EndDrawing()
-            self.SetBitmap(dc.GetAsBitmap())
 
         
         
@@ -134,7 +614,10 @@ class CanvasBase(wx.StaticBitmap):
 ######################
 
 class Canvas(utilities.AutoSize):
-    """An `AutoSize` object which holds a `Canvas` as its only child."""
+    """An `AutoSize` object which holds a `CanvasBase` as its only child. The
+    child always covers the visible area, and is told the new offset when the
+    `Canvas` scrolls.
+    """
     
     def __init__(self, parent, size=wx.DefaultSize, pos=wx.DefaultPosition):
         """Constructor.
@@ -146,15 +629,12 @@ class Canvas(utilities.AutoSize):
         super(Canvas, self).__init__(parent)
 
         # controls        
-        ctrl = CanvasBase(self, bitmap=wx.NullBitmap)
-
-        # boxes
-        box = wx.BoxSizer(wx.VERTICAL)
-        self.SetSizer(box)
-        box.Add(ctrl, proportion=1)
+        ctrl = CanvasBase(self)
 
         # bindings
         self.Bind(wx.EVT_SHOW, self.OnShow)
+        self.Bind(wx.EVT_SIZE, self.OnSize)
+        self.Bind(wx.EVT_SCROLLWIN, self.OnScroll)
 
         # finish up        
         self.ctrl = ctrl
@@ -176,28 +656,76 @@ class Canvas(utilities.AutoSize):
         """
         return self.ctrl.GetOffset()
 
-    def SetBackground(self, bmp):
+    def SetSnapshot(self, snapshot):
         """Set the background over which to draw.
 
-        * `bmp: ` a `wx.Bitmap` to serve as background.
+        * `snapshot: ` a `DeckSnapshot`.
+        """
+        self.ctrl.SetSnapshot(snapshot)
+
+    def SetScale(self, scale):
+        """Set the scale at which strokes are drawn.
+
+        * `scale: ` a `float`.
         """
-        if bmp:
-            self.ctrl.SetBitmap(bmp)
-            self.FitToChildren()
+        self.ctrl.SetScale(scale)
+
+    def SetUndoStack(self, stack):
+        """Set the `UndoStack` where new strokes are recorded.
+
+        * `stack: ` an `UndoStack`.
+        """
+        self.ctrl.SetUndoStack(stack)
+
+    def UpdateOffset(self):
+        """Keep the `CanvasBase` over the visible area, and tell it where the view starts."""
+        if not self: return
+        self.ctrl.SetRect(wx.Rect(0, 0, *self.GetClientSize()))
+        self.ctrl.SetOffset(self.GetViewStartPixels())
 
             
     ### Auxiliary functions
 
     def Dump(self):
-        """Returns a `list` with all the info contained in this `Canvas`.
+        """Returns a `dict` with all the info contained in this `Canvas`. Every
+        stroke's points are dumped as the raw bytes of an `array("i")`.
 
-        `returns: ` a `list` of the form [(colour1, thickness1, [pt11, pt12, ...]), (colour2, thickness2, [pt21, pt22, ...]), ...].
+        `returns: ` a `dict` of the form {"styles": [(colour1, thickness1), ...], "strokes": [(style1, points1), ...], "subpixel": n}.
+        Points are in model coordinates multiplied by `n`, see `CanvasBase`.
         """
-        return self.ctrl.lines
-
-    def Load(self, li):
-        """Load from a `list` returned by `Canvas.Dump`."""
-        self.ctrl.lines = li
+        ctrl = self.ctrl
+        return {"styles": list(ctrl.styles),
+                "strokes": [(style, points.tostring()) for style, points in ctrl.strokes],
+                "subpixel": ctrl.SUBPIXEL}
+
+    def Load(self, di):
+        """Load from a `dict` returned by `Canvas.Dump`. Also accepts the old
+        format, a `list` of the form [(colour1, thickness1, [(x1, y1, x2, y2), ...]), ...].
+        """
+        ctrl = self.ctrl
+        ctrl.Clear()
+
+        if isinstance(di, dict):
+            # files saved before sub-pixel points have no "subpixel"
+            factor = di.get("subpixel", 1)
+            for style, raw in di["strokes"]:
+                points = array("i")
+                points.fromstring(raw)
+                if factor != ctrl.SUBPIXEL:
+                    points = array("i", [int(round(p * ctrl.SUBPIXEL / float(factor))) for p in points])
+                colour, thickness = di["styles"][style]
+                ctrl.AddStroke(colour, thickness, points)
+        else:
+            sub = ctrl.SUBPIXEL
+            for colour, thickness, line in di:
+                # join consecutive segments into one polyline
+                points = array("i")
+                for x1, y1, x2, y2 in line:
+                    if not points or (points[-2], points[-1]) != (x1 * sub, y1 * sub):
+                        ctrl.AddStroke(colour, thickness, points)
+                        points = array("i", (x1 * sub, y1 * sub))
+                    points.extend((x2 * sub, y2 * sub))
+                ctrl.AddStroke(colour, thickness, points)
 
 
     ### Callbacks
@@ -205,7 +733,18 @@ class Canvas(utilities.AutoSize):
     def OnShow(self, ev):
         """Listens to `wx.EVT_SHOW` events."""
         if ev.IsShown():
-            self.ctrl.DrawLines()
+            self.UpdateOffset()
+
+    def OnSize(self, ev):
+        """Listens to `wx.EVT_SIZE` events."""
+        self.UpdateOffset()
+        ev.Skip()
+
+    def OnScroll(self, ev):
+        """Listens to `wx.EVT_SCROLLWIN` events."""
+        # we haven't scrolled yet: wait for it
+        wx.CallAfter(self.UpdateOffset)
+        ev.Skip()
 
 
 ###########################
@@ -221,7 +760,7 @@ __pdoc__["field"] = None
 # Since we only want to generate documentation for our own
 # mehods, and not the ones coming from the base classes,
 # we first set to None every method in the base class.
-for field in dir(wx.StaticBitmap):
+for field in dir(wx.Window):
     __pdoc__['CanvasBase.%s' % field] = None
 for field in dir(Canvas):
     __pdoc__['Canvas.%s' % field] = None
@@ -5,6 +5,10 @@ A `Card` is the "virutal index card"; it is a window that goes on the
 """
 import wx
 import os
+import re
+import hashlib
+import cStringIO
+from collections import OrderedDict
 import utilities
 import deck
 import wx.richtext as rt
@@ -172,14 +176,15 @@ class Card(wx.Panel):
         super(Card, self).Move(pt)
         self.ResetFRect()
 
-    def MoveBy(self, dx, dy):
+    def MoveBy(self, dx, dy, start=None):
         """Moves the card by the offsets `dx`, `dy`. Unlike `SetPosition` and `Move`,
         this method preserves `frect`.
 
         * `dx: ` pixels to move in the X direction.
         * `dy: ` pixels to move in the Y direction.
+        * `start: ` the parent's view start, in pixels. Pass it when moving many
+        `Card`s at once, to avoid asking the parent for it every time.
         """
-        bd = self.GetParent()
         if not self.frect:
             self.ResetFRect()
 
@@ -188,7 +193,8 @@ class Card(wx.Panel):
         abs_top  = self.frect[1] + dy
 
         # but Move() is expecting coordinates relative to the start of the view port
-        start = self.GetParent().GetViewStartPixels()
+        if start is None:
+            start = self.GetParent().GetViewStartPixels()
         rel_left = abs_left - start[0]
         rel_top  = abs_top  - start[1]
 
@@ -869,6 +875,8 @@ class Content(Card):
     # FACT_CNT_CL       = (68, 54, 244, 255)
 
     # Content events
+    TAGS_REGEX = "^(\w+):(.*)$"
+
     KindEvent, EVT_CONT_KIND = ne.NewCommandEvent()
 
     def __init__(self, parent, label, pos=wx.DefaultPosition, size=DEFAULT_SZ,
@@ -1043,6 +1051,13 @@ class Content(Card):
         """
         return self.content.GetValue()
 
+    def GetTags(self):
+        """Get the tags written in the content text, one per line, in the form "tag: value".
+
+        `returns: ` a list of `(tag, value)` tuples.
+        """
+        return re.findall(self.TAGS_REGEX, self.GetContent(), re.MULTILINE)
+
     def SetContent(self, txt):
         """Sets the content text.
 
@@ -1160,6 +1175,7 @@ class Content(Card):
             self.SetPosition(dic["pos"])
         if "collapsed" in dic.keys():
             if dic["collapsed"]: self.Collapse()
+            else:                self.Uncollapse()
 
     def SetColours(self, kind):
         """Set all controls' colours according to the `kind`.
@@ -1194,16 +1210,143 @@ class Content(Card):
 
 
 
+######################
+# Class ImageStore
+######################
+
+class ImageStore(object):
+    """Holds the raw data of every image used by `Image` `Card`s, keyed by the
+    hash of its contents. The same image pasted in many `Card`s is stored only
+    once, and decoded into a `wx.Bitmap` only once, no matter how many `Card`s
+    display it. The data is saved inside the notebook file (see `Deck.Dump`),
+    so that notebooks don't depend on the original image files.
+
+    Every `Image` holds a reference to the image it displays (see `Acquire`).
+    A decoded bitmap is released as soon as no `Image` displays it, while the
+    raw data is kept until `Prune`, so that deleting an `Image` can be undone.
+    """
+
+    def __init__(self):
+        """Constructor."""
+        self.data = {}
+        self.bitmaps = {}
+        self.refs = {}
+
+    def Add(self, data):
+        """Store the image `data`, unless it's already stored.
+
+        * `data: ` a string holding the raw contents of an image file.
+
+        `returns: ` the key under which `data` is stored.
+        """
+        key = hashlib.sha1(data).hexdigest()
+        if key not in self.data:
+            self.data[key] = data
+        return key
+
+    def AddFile(self, path):
+        """Read an image file from disk and store it.
+
+        * `path: ` the path to the image file.
+
+        `returns: ` the key under which the image is stored, or `None` if
+        the file can't be read (eg, it was moved or deleted).
+        """
+        try:
+            with open(path, "rb") as f:
+                return self.Add(f.read())
+        except IOError:
+            return None
+
+    def Acquire(self, key):
+        """Count one more `Image` displaying the image stored under `key`.
+
+        * `key: ` a key returned by `Add`.
+        """
+        self.refs[key] = self.refs.get(key, 0) + 1
+
+    def Release(self, key):
+        """Count one less `Image` displaying the image stored under `key`.
+        When none is left, forget its decoded bitmap.
+
+        * `key: ` a key passed to `Acquire`.
+        """
+        count = self.refs.get(key, 0) - 1
+        if count > 0:
+            self.refs[key] = count
+        else:
+            self.refs.pop(key, None)
+            self.bitmaps.pop(key, None)
+
+    def Prune(self):
+        """Forget all the images that no `Image` displays. Call when a new
+        notebook is loaded: the undo history of the old one is gone by then.
+        """
+        for key in [k for k in self.data if k not in self.refs]:
+            del self.data[key]
+            self.bitmaps.pop(key, None)
+
+    def Contains(self, key):
+        """Check if there's an image stored under `key`.
+
+        `returns: ` `True` if `key` is in the store.
+        """
+        return key in self.data
+
+    def GetBitmap(self, key):
+        """Get the image stored under `key`, decoding it only the first time
+        while some `Image` displays it. The returned `wx.Bitmap` is shared,
+        so never draw over it.
+
+        * `key: ` a key returned by `Add`.
+
+        `returns: ` a `wx.Bitmap`.
+        """
+        if key in self.bitmaps:
+            return self.bitmaps[key]
+        stream = cStringIO.StringIO(self.data[key])
+        bmp = wx.BitmapFromImage(wx.ImageFromStream(stream))
+        # unreferenced bitmaps would never be released
+        if key in self.refs:
+            self.bitmaps[key] = bmp
+        return bmp
+
+    def Dump(self, keys):
+        """Return the data of the images stored under `keys`.
+
+        * `keys: ` an iterable of keys.
+
+        `returns: ` a `dict` of the form `{key1: data1, key2: data2, ...}`.
+        """
+        return dict([(k, self.data[k]) for k in set(keys) if k in self.data])
+
+    def Load(self, d):
+        """Read a `dict` and store all its images.
+
+        * `d: ` a `dict` in the format returned by `Dump`.
+        """
+        for key, data in d.iteritems():
+            if key not in self.data:
+                self.data[key] = data
+
+
+
 ######################
 # Class Image
 ######################
 
 class Image(Card):
-    """A `Card` that holds a single image."""
+    """A `Card` that holds a single image. The image data itself lives in
+    `Image.store`, shared by all `Image`s."""
     
     DEFAULT_SZ = (50, 50)
     DEFAULT_PATH = ""
 
+    store = ImageStore()
+
+    ResizeEvent, EVT_IMAGE_RESIZE = ne.NewEvent()
+    LoadEvent, EVT_IMAGE_LOAD = ne.NewEvent()
+
     def __init__(self, parent, label, path=None, pos=wx.DefaultPosition, size=DEFAULT_SZ):
         """Constructor.
 
@@ -1217,6 +1360,7 @@ class Image(Card):
         self.btn = None
         self.img = None
         self.path = path
+        self.key = None
         self.orig = None
         self.resizing = False
         self.resize_w = False
@@ -1226,18 +1370,42 @@ class Image(Card):
         # bindings
         self.Bind(wx.EVT_ENTER_WINDOW, self.OnMouseOverBorder)
         self.Bind(wx.EVT_LEAVE_WINDOW, self.OnMouseLeaveBorder)
+        self.Bind(wx.EVT_WINDOW_DESTROY, self.OnDestroy)
         self.main.Bind(wx.EVT_LEFT_DOWN, self.OnBorderLeftDown)
 
         
     ### Behavior funtions
 
     def LoadImage(self, path):
-        """Load an image from disk and display it.
+        """Load an image from disk, add it to `Image.store` and display it.
 
         * `path: ` the path tothe image.
+
+        `returns: ` `True` if the image was loaded, or `False` if the file
+        can't be read. In that case the "load image" button stays, and `path`
+        is still remembered, so that the user can pick the file again.
+        """
+        # remember the path even if it's broken, so that it's saved
+        self.path = path
+        key = self.store.AddFile(path)
+        if key is None:
+            return False
+        self.LoadStoredImage(key)
+        return True
+
+    def LoadStoredImage(self, key):
+        """Display an image already in `Image.store`.
+
+        * `key: ` the key of the image in `Image.store`.
         """
-        # load the image
-        bmp = wx.Bitmap(path)
+        # hold a reference first, so that the bitmap is kept
+        if key != self.key:
+            self.store.Acquire(key)
+            if self.key: self.store.Release(self.key)
+
+        # the bitmap is shared: we never draw on it, and
+        # Stretch always makes a new one when resizing
+        bmp = self.store.GetBitmap(key)
         self.SetImage(bmp)
         self.SetScale(self.GetScale())
 
@@ -1247,10 +1415,32 @@ class Image(Card):
             self.btn = None
 
         # set members
-        self.path = path
+        self.key = key
         self.orig = bmp
         self.GetParent().SetFocus()
 
+    def ClearImage(self):
+        """Stop displaying the image, and show the "load image" button again."""
+        if not self.img: return
+
+        if self.key: self.store.Release(self.key)
+        self.key = None
+        self.orig = None
+        self.GetCardSizer().Clear()
+        self.img.Destroy()
+        self.img = None
+
+        self.InitButton()
+        self.SetSize([int(i * self.GetScale()) for i in self.DEFAULT_SZ])
+        self.Layout()
+
+    def GetImageKey(self):
+        """Get the key of the displayed image in `Image.store`.
+
+        `returns: ` a string, or `None` if there's no image yet.
+        """
+        return self.key
+
     def SetImage(self, bmp):
         """Display the `bmp`.
 
@@ -1309,27 +1499,36 @@ class Image(Card):
         vbox = wx.BoxSizer(wx.VERTICAL)
         self.SetCardSizer(vbox)
 
-        if not path:
-            btn = wx.BitmapButton(self.main, bitmap=wx.ArtProvider.GetBitmap(wx.ART_MISSING_IMAGE), size=self.DEFAULT_SZ)
-            vbox.Add(btn, proportion=1, flag=wx.ALL|wx.EXPAND, border=self.BORDER_THICK)
-            self.btn = btn
-            btn.Bind(wx.EVT_BUTTON, self.OnButton)
-        else:
+        # LoadImage hides the button, unless the image can't be read
+        self.InitButton()
+        if path:
             self.LoadImage(path)
 
+    def InitButton(self):
+        """Show the "load image" button, used when there's no image to display."""
+        btn = wx.BitmapButton(self.main, bitmap=wx.ArtProvider.GetBitmap(wx.ART_MISSING_IMAGE), size=self.DEFAULT_SZ)
+        self.GetCardSizer().Add(btn, proportion=1, flag=wx.ALL|wx.EXPAND, border=self.BORDER_THICK)
+        self.btn = btn
+        btn.Bind(wx.EVT_BUTTON, self.OnButton)
+
     def Dump(self):
         """Return a `dict` holding all this `Image`'s data.
         
-        `returns: ` a `dict` of the form {{"class": "Image", "label": lbl, "pos": (x, y), "path": str}}
+        `returns: ` a `dict` of the form {{"class": "Image", "label": lbl, "pos": (x, y), "path": str, "image": key}},
+        where `key` identifies the image data in `Image.store`.
         """
         pos = self.GetPosition()
         return {"class": "Image",
                 "label": self.label,
                 "pos": (pos.x, pos.y),
-                "path": self.path}
+                "path": self.path,
+                "image": self.key}
 
     def Load(self, dic):
         """Read data from an object and load it into this `Image` for displaying.
+        Images are taken from `Image.store` when possible, and only read from
+        `path` when the data is not stored (eg, with older files). An empty
+        "image" clears the current one (eg, when undoing a load).
 
         * `dic: ` a `dict` returned by `Dump`.
         """
@@ -1338,7 +1537,14 @@ class Image(Card):
         if "pos" in dic.keys():
             self.SetPosition(dic["pos"])
         if "path" in dic.keys():
-            self.LoadImage(dic["path"])
+            self.path = dic["path"]
+        if dic.get("image") and self.store.Contains(dic["image"]):
+            self.LoadStoredImage(dic["image"])
+        else:
+            if "image" in dic.keys():
+                self.ClearImage()
+            if dic.get("path"):
+                self.LoadImage(dic["path"])
 
 
     ### Callbacks
@@ -1348,8 +1554,23 @@ class Image(Card):
         fd = wx.FileDialog(self, "Open", os.getcwd(), "", "All files (*.*)|*.*",
                            wx.FD_OPEN | wx.FD_FILE_MUST_EXIST)
         if fd.ShowModal() == wx.ID_CANCEL: return # user changed her mind
+
+        old = {"path": self.path, "image": self.key}
         self.LoadImage(fd.GetPath())
 
+        # raise the event
+        event = self.LoadEvent(id=wx.ID_ANY, old=old, new={"path": self.path, "image": self.key})
+        event.SetEventObject(self)
+        self.GetEventHandler().ProcessEvent(event)
+
+    def OnDestroy(self, ev):
+        """Listens to `wx.EVT_WINDOW_DESTROY`. Releases the displayed image."""
+        # the event also comes from our children
+        if ev.GetEventObject() is self and self.key:
+            self.store.Release(self.key)
+            self.key = None
+        ev.Skip()
+
     def OnImageLeftDown(self, ev):
         """Listens to all mouse events from the underlying `wx.StaticBitmap`, which
         are redirected as coming from this `Image`.
@@ -1419,8 +1640,15 @@ class Image(Card):
                 new_w = ev_w
             self.SetSize(wx.Size(new_w, new_h))
             
+            self.resizing = False
             self.resize_w = False
             self.resize_h = False
+
+            # raise the event
+            if (new_w, new_h) != (cur_w, cur_h):
+                event = self.ResizeEvent(id=wx.ID_ANY, old=(cur_w, cur_h), new=(new_w, new_h))
+                event.SetEventObject(self)
+                self.GetEventHandler().ProcessEvent(event)
         
         self.Unbind(wx.EVT_MOTION)
         self.Unbind(wx.EVT_LEFT_UP)
@@ -1438,7 +1666,12 @@ class Image(Card):
 ######################
 
 class CardGroup(object):
-    """Basically, a list of Cards, used throughout the application."""
+    """Basically, a set of Cards, used throughout the application. Members
+    are kept in the order they were added, but checking if a `Card` is a
+    member doesn't need to look at all of them. `CardGroup`s can be nested:
+    every group has at most one parent and any number of children, and the
+    members of a group's whole subtree are cached until it changes.
+    """
     
     def __init__(self, members=[], label=-1):
         """Constructor.
@@ -1447,15 +1680,25 @@ class CardGroup(object):
         * `label: ` unique identifier for.
         """
         # save references to cards, not to the list
-        self.members = members[:]
+        self.members = OrderedDict.fromkeys(members)
         self.label = label
+        self.parent = None
+        self.children = []
+        self.subtree = None
 
     def GetMembers(self):
-        """Get the members of this `CardGroup`.
+        """Get the direct members of this `CardGroup`, not counting its children's.
 
         `returns: ` a `list` of `Card`s.
         """
-        return self.members
+        return self.members.keys()
+
+    def GetAllMembers(self):
+        """Get the members of this `CardGroup` and of all its descendants.
+
+        `returns: ` a `list` of `Card`s, each appearing only once.
+        """
+        return self.GetSubtree().keys()
 
     def GetLabel(self):
         """Get the identifier of this `CardGroup`.
@@ -1464,26 +1707,124 @@ class CardGroup(object):
         """
         return self.label
 
+    def GetParent(self):
+        """Get the `CardGroup` this one is nested in.
+
+        `returns: ` a `CardGroup`, or None.
+        """
+        return self.parent
+
+    def GetChildren(self):
+        """Get the `CardGroup`s nested directly in this one.
+
+        `returns: ` a `list` of `CardGroup`s.
+        """
+        return self.children
+
+    def GetAncestors(self):
+        """Get the parent of this `CardGroup`, its parent, and so on.
+
+        `returns: ` a `list` of `CardGroup`s, the closest one first.
+        """
+        anc = []
+        g = self.parent
+        while g:
+            anc.append(g)
+            g = g.parent
+        return anc
+
+    def GetDepth(self):
+        """Get how deeply nested this `CardGroup` is.
+
+        `returns: ` an `int`, 0 if this `CardGroup` has no parent.
+        """
+        return len(self.GetAncestors())
+
+    def Contains(self, card):
+        """Check if `card` is a direct member of this `CardGroup`.
+
+        * `card: ` a `Card`.
+
+        `returns: ` `True` or `False`.
+        """
+        return card in self.members
+
+    def ContainsDeep(self, card):
+        """Check if `card` is a member of this `CardGroup` or of any of its descendants.
+
+        * `card: ` a `Card`.
+
+        `returns: ` `True` or `False`.
+        """
+        return card in self.GetSubtree()
+
     def Add(self, card):
-        """Add a new `Card` to the `CardGroup`.
+        """Add a new `Card` to the `CardGroup`. Does nothing if it's already a member.
 
         * `card: ` a `Card`.
         """
-        self.members.append(card)
+        if card not in self.members:
+            self.members[card] = None
+            self.Invalidate()
 
     def Remove(self, card):
-        """Remove a `Card` from the `CardGroup`.
+        """Remove a `Card` from the `CardGroup`. Does nothing if it's not a member.
 
         * `card: ` a `Card`.
         """
-        self.members.remove(card)
+        if card in self.members:
+            del self.members[card]
+            self.Invalidate()
+
+    def SetParent(self, parent):
+        """Nest this `CardGroup` inside another one.
+
+        * `parent: ` a `CardGroup`, or None to make this one a top level group.
+
+        `returns: ` `False` if `parent` is this `CardGroup` or one of its
+        descendants, in which case nothing changes. `True` otherwise.
+        """
+        if parent is self or (parent and self in parent.GetAncestors()):
+            return False
+
+        if self.parent:
+            self.parent.children.remove(self)
+            self.parent.Invalidate()
+        self.parent = parent
+        if parent:
+            parent.children.append(self)
+            parent.Invalidate()
+        return True
 
     def Dump(self):
-        """Return a `list` holding all this `CardGroup`'s data.
+        """Return a `dict` holding all this `CardGroup`'s data.
         
-        `returns: ` a `list` of the form `[lbl1, lbl2, ... ], where lbl* is the label of one of the members.`
+        `returns: ` a `dict` of the form `{"members": [lbl1, lbl2, ... ], "parent": label}`,
+        where lbl* is the label of one of the direct members, and label is the parent's label, or None.
         """
-        return [c.label for c in self.members]
+        return {"members": [c.label for c in self.members],
+                "parent": self.parent.GetLabel() if self.parent else None}
+
+
+    ### Auxiliary functions
+
+    def GetSubtree(self):
+        """Get the cached members of the whole subtree, computing them if needed.
+
+        `returns: ` an `OrderedDict` with the `Card`s as keys.
+        """
+        if self.subtree is None:
+            self.subtree = OrderedDict(self.members)
+            for ch in self.children:
+                self.subtree.update(ch.GetSubtree())
+        return self.subtree
+
+    def Invalidate(self):
+        """Forget the cached subtree of this `CardGroup` and of its ancestors."""
+        g = self
+        while g and g.subtree is not None:
+            g.subtree = None
+            g = g.parent
 
 
 
@@ -1518,7 +1859,7 @@ for field in dir(utilities.EditText):
     __pdoc__['TitleEditText.%s' % field] = None
 for field in dir(wx.Button):
     __pdoc__['StarRating.%s' % field] = None
-# CardGroup has no ancestors!    
+# CardGroup and ImageStore have no ancestors!    
 # for field in dir():
 #     __pdoc__['CardGroup.%s' % field] = None
 
@@ -7,8 +7,12 @@ This module holds the `Deck` and its helper class `SelectionManager`.
 
 import wx
 import json
-import ast
+import zlib
+import base64
+from collections import OrderedDict
 import card
+import layout
+import undo
 import wx.lib.newevent as ne
 import utilities
 
@@ -25,19 +29,31 @@ class Deck(utilities.AutoSize):
     """
                 
     MOVING_RECT_THICKNESS = 1
+    LINK_THICKNESS = 1
+    LINK_ARROW = 8
+    LINK_CL = "#555555"
+    DRAG_REFRESH_MS = 16
     BACKGROUND_CL = "#CCCCCC"
     CARD_PADDING = 15
     HORIZONTAL = 2
     VERTICAL   = 4
+    GRID       = 8
+    SHELF      = 16
+    GROUPED    = 32
 
     LEFT   = 2
     RIGHT  = 4
     DOWN   = 8
     UP     = 16
 
+    EDIT_FIELDS = ["title", "content", "kind", "rating", "header", "collapsed"]
+    CLIPBOARD_FORMAT = "threepy5.CardList.z"
+
     NewCardEvent, EVT_NEW_CARD = ne.NewEvent()
     DeleteEvent,  EVT_DEL_CARD = ne.NewEvent()
     ReqViewEvent, EVT_REQUEST_VIEW = ne.NewEvent()
+    GeometryEvent, EVT_CARD_GEOMETRY = ne.NewEvent()
+    FilterEvent,  EVT_FILTER = ne.NewEvent()
 
     def __init__(self, parent, pos=wx.DefaultPosition, size=wx.DefaultSize, style=wx.BORDER_NONE):
         """Constructor.
@@ -49,8 +65,36 @@ class Deck(utilities.AutoSize):
 
         # members
         self.cards = []
+        # ordered sets of cards, one per class, see IterContents
+        self.classes = {card.Content: OrderedDict(), card.Header: OrderedDict(), card.Image: OrderedDict()}
+        self.labels = {}
+        self.next_label = 0
+        # stacking order of the cards, see RaiseCard
+        self.stacking = {}
+        self.next_stack = 0
         self.groups = []
+        self.group_labels = {}
+        self.card_groups = {}
+        self.next_group = 0
+        self.links = {}
+        self.backlinks = {}
+        self.link_segs = {}
+        self.link_index = layout.SpatialIndex()
+        self.link_pen = wx.Pen(self.LINK_CL, self.LINK_THICKNESS, wx.SOLID)
+        self.link_brush = wx.Brush(self.LINK_CL)
+        self.undo = undo.UndoStack()
+        self.edit_card = None
+        self.edit_data = {}
+        self.spatial = layout.SpatialIndex()
+        self.reading = layout.ReadingOrder()
+        self.kinds = {}
+        self.card_kinds = {}
+        self.filter = (None, None, None)
         self.moving_cards_pos = []
+        self.moving_pen = wx.Pen("BLACK", self.MOVING_RECT_THICKNESS, wx.SOLID)
+        self.overlay = wx.Overlay()
+        self.drag_pos = None
+        self.drag_pending = False
         self.drag_select = False
         self.menu_position = (0, 0)
         self.scale = 1.0
@@ -64,10 +108,13 @@ class Deck(utilities.AutoSize):
         self.Bind(wx.EVT_LEFT_DCLICK, self.OnLeftDClick)
         self.Bind(wx.EVT_MOUSE_CAPTURE_LOST, self.OnMouseCaptureLost)
         self.Bind(wx.EVT_CHILD_FOCUS, self.OnChildFocus)
+        self.Bind(wx.EVT_PAINT, self.OnPaint)
         self.Bind(self.selec.EVT_MGR_DELETE, self.OnMgrDelete)
         
         # other gui setup
         self.SetBackgroundColour(Deck.BACKGROUND_CL)        
+        # OnPaint clears the background itself
+        self.SetBackgroundStyle(wx.BG_STYLE_CUSTOM)
 
 
     ### Behavior functions
@@ -84,14 +131,45 @@ class Deck(utilities.AutoSize):
         
         `returns: ` a list of `Header`.
         """
-        return [h for h in self.cards if isinstance(h, Header)]
+        return self.classes[card.Header].keys()
 
     def GetContents(self):
         """Returns a list of all `Content` `Card`s.
 
         `returns: ` a list of `Content`.
         """
-        return [h for h in self.cards if isinstance(h, Content)]
+        return self.classes[card.Content].keys()
+
+    def GetImages(self):
+        """Returns a list of all `Image` `Card`s.
+
+        `returns: ` a list of `Image`.
+        """
+        return self.classes[card.Image].keys()
+
+    def IterHeaders(self):
+        """Iterate over all `Header` `Card`s, without copying them to a list.
+        Don't create or delete `Card`s while iterating.
+
+        `returns: ` an iterator of `Header`s.
+        """
+        return self.classes[card.Header].iterkeys()
+
+    def IterContents(self):
+        """Iterate over all `Content` `Card`s, without copying them to a list.
+        Don't create or delete `Card`s while iterating.
+
+        `returns: ` an iterator of `Content`s.
+        """
+        return self.classes[card.Content].iterkeys()
+
+    def IterImages(self):
+        """Iterate over all `Image` `Card`s, without copying them to a list.
+        Don't create or delete `Card`s while iterating.
+
+        `returns: ` an iterator of `Image`s.
+        """
+        return self.classes[card.Image].iterkeys()
 
     def GetCard(self, label):
         """Returns the specified `Card`.
@@ -100,18 +178,93 @@ class Deck(utilities.AutoSize):
 
         `returns: ` the requested `Card`, or None.
         """
-        li = [c for c in self.cards if c.label == label]
-        if li: return li[0]
-        else: return None
+        return self.labels.get(label)
+
+    def SetUndoStack(self, stack):
+        """Set the `UndoStack` where our actions are recorded. See `Box`.
+
+        * `stack: ` an `UndoStack`.
+        """
+        self.undo = stack
 
     def GetContentsByKind(self, kind):
         """Returns a list of all Content cards of the `kind`.
 
-        * `kind `: must be a `Content.*_LBL` constant.
+        * `kind `: must be a `Content.*_LBL` or `Content.*_LBL_LONG` constant.
         
         `returns: ` a list of `Content`s, all of the same `kind`.
         """
-        return [c for c in self.GetContents() if c.GetKind() == kind or c.GetKind(long=True) == kind]
+        return list(self.kinds.get(self.GetShortKind(kind), ()))
+
+    def SetFilter(self, kind=None, rating=None, tag=None):
+        """Show only the `Content`s that match all the given conditions, and
+        hide the rest. `Header`s are always shown. All `Card`s are shown and
+        hidden in one go, and only those whose state changes are touched.
+        Call with no arguments to show every `Card`.
+
+        * `kind: ` a `Content.*_LBL` or `Content.*_LBL_LONG` constant, or None for any kind.
+        * `rating: ` the minimum rating, or None for any rating.
+        * `tag: ` a tag that must appear in the content text (see `Content.GetTags`), or None.
+        """
+        self.filter = (kind, rating, tag)
+        if kind is None and rating is None and tag is None:
+            show = set(self.cards)
+        else:
+            # start from the smallest candidate set, and check the rest only on those
+            if kind is not None:
+                show = set(self.kinds.get(self.GetShortKind(kind), ()))
+            else:
+                show = set(self.IterContents())
+            if rating is not None:
+                show = set([c for c in show if c.rating.GetRating() >= rating])
+            if tag is not None:
+                show = set([c for c in show if tag in [t for t, v in c.GetTags()]])
+            show.update(self.IterHeaders())
+
+        changed = []
+        self.Freeze()
+        for c in self.cards:
+            visible = c in show
+            if c.IsShown() != visible:
+                c.Show(visible)
+                changed.append(c)
+        self.Thaw()
+
+        if changed:
+            event = self.FilterEvent(id=wx.ID_ANY, cards=changed)
+            event.SetEventObject(self)
+            self.GetEventHandler().ProcessEvent(event)
+
+    def RaiseCard(self, crd):
+        """Bring a `Card` to the front, over all the others. Raises
+        `Deck.EVT_CARD_GEOMETRY`, since it now covers its neighbours.
+
+        * `crd: ` a `Card`.
+        """
+        crd.Raise()
+        self.stacking[crd] = self.next_stack
+        self.next_stack += 1
+        if self.spatial.Contains(crd):
+            rect = self.spatial.GetRect(crd)
+            event = self.GeometryEvent(id=wx.ID_ANY, old=rect, rect=rect)
+            event.SetEventObject(crd)
+            self.GetEventHandler().ProcessEvent(event)
+
+    def GetStackingOrder(self, crd):
+        """Get the position of a `Card` in the stacking order.
+
+        * `crd: ` a `Card`.
+
+        `returns: ` an `int`. `Card`s with higher values are drawn over the others.
+        """
+        return self.stacking.get(crd, -1)
+
+    def GetFilter(self):
+        """Get the conditions last passed to `SetFilter`.
+
+        `returns: ` a `(kind, rating, tag)` tuple.
+        """
+        return self.filter
 
     def GetNextCard(self, card, direc):
         """
@@ -162,6 +315,54 @@ class Deck(utilities.AutoSize):
         else:
             return None
 
+    def GetReadingOrder(self):
+        """Get all the `Card`s in reading order: by rows from top to bottom,
+        and from left to right inside every row.
+
+        `returns: ` a list of `Card`s.
+        """
+        return self.reading.GetKeys()
+
+    def GetReadingNext(self, card, step=1, cls=None):
+        """Get the `Card` that is read `step` places after `card`.
+
+        * `card: ` a `Card` held by this object.
+        * `step: ` how many `Card`s to move. Use a negative number to go backwards.
+        * `cls: ` if not None, only `Card`s of this class are counted.
+
+        `returns: ` a `Card`, or None if there is none that far.
+        """
+        if not self.reading.Contains(card): return None
+        direc = 1 if step > 0 else -1
+        left = abs(step)
+        while left and card:
+            card = self.reading.GetNext(card, direc)
+            if card and (cls is None or isinstance(card, cls)):
+                left -= 1
+        return card
+
+    def GetModelRect(self, card):
+        """Get the rect of `card` relative to the start of the virtual area,
+        at a scale of 1.0, so that it doesn't change when zooming.
+
+        * `card: ` a `Card` held by this object.
+
+        `returns: ` a `(x, y, w, h)` tuple.
+        """
+        return tuple([int(round(i / self.scale)) for i in self.GetAbsoluteRect(card)])
+
+    def GetAbsoluteRect(self, card):
+        """Get the rect of `card` relative to the start of the virtual area,
+        instead of to the current view, as `Card.GetRect` does.
+
+        * `card: ` a `Card` held by this object.
+
+        `returns: ` a `(x, y, w, h)` tuple.
+        """
+        x, y, w, h = card.GetRect()
+        start = self.GetViewStartPixels()
+        return (x + start.x, y + start.y, w, h)
+
     def GetPadding(self):
         """Returns `self.CARD_PADDING`, fixed for scale.
 
@@ -176,64 +377,67 @@ class Deck(utilities.AutoSize):
         * `pos: ` the position where to put the new `Card`. If it is the default, use `below` to determine
         where to put it.
         * `below ` when `False`, creates the new `Card` to the right of the currently selected
-        `Card` in the `Deck`, if any; when `True` creates it below.
+        `Card` in the `Deck`, if any; when `True` creates it below. If that place is
+        already taken, keeps looking further right (or below) for a free one.
 
         `returns: ` the new `Card`.
         """
         if pos == wx.DefaultPosition:
-            pos = (0, 0)
             pad = self.GetPadding()
-            
-            # if there are no cards, place this one on the top left corner
-            if len(self.GetCards()) < 1:
-                pos = (pad, pad)
-    
-            # if there's a selection, place it next to it
-            elif self.GetSelection():
-                rect = self.GetSelection()[-1].GetRect()
-                if below:
-                    top = rect.bottom + pad
-                    left = rect.left
-                else:
-                    top = rect.top
-                    left = rect.right + pad
-                pos = (left, top)
 
+            # if there's a selection, place it next to it
             # if cursor is inside a card, place it next to it
+            # otherwise, place it next to the last one
+            anchor = None
+            if self.GetSelection():
+                anchor = self.GetSelection()[-1]
             elif utilities.GetCardAncestor(self.FindFocus()):
-                rect = utilities.GetCardAncestor(self.FindFocus()).GetRect()
+                anchor = utilities.GetCardAncestor(self.FindFocus())
+            elif self.cards:
+                anchor = self.cards[-1]
+
+            # if there are no cards, place this one on the top left corner
+            if not anchor:
+                pos = (pad, pad)
+            else:
+                left, top, w, h = self.GetAbsoluteRect(anchor)
                 if below:
-                    top = rect.bottom + pad
-                    left = rect.left
+                    top = top + h + pad
                 else:
-                    top = rect.top
-                    left = rect.right + pad
-                pos = (left, top)
-            
-            else: # otherwise, move it to the right of the last one
-                rects = [c.GetRect() for c in self.GetCards()]
-                rights = [r.right for r in rects]
-                top = min([r.top for r in rects])
-                left = max(rights) + pad
-                pos = (left, top)
+                    left = left + w + pad
+
+                # look for a free slot using the size the new card will have
+                w, h = [i * self.scale for i in getattr(card, subclass).DEFAULT_SZ]
+                left, top = layout.FindFreeSlot(self.spatial, (left, top, w, h), pad, below)
+
+                # NewCard expects coordinates relative to the view
+                start = self.GetViewStartPixels()
+                pos = (left - start.x, top - start.y)
     
         new = self.NewCard(subclass, pos=pos, scroll=True)
+        self.undo.Push(undo.CreateCards(self, [self.DumpCard(new)]))
         self.UnselectAll()
         new.SetFocus()
 
         return new
 
-    def NewCard(self, subclass, pos=wx.DefaultPosition, scroll=False):
+    def NewCard(self, subclass, pos=wx.DefaultPosition, scroll=False, label=None, batch=False):
         """
         Create a new `Card` of type `subclass` at `pos`.
 
         * `pos: ` the position where to create the `Card`.
         * `scroll: ` if True, scroll the `Deck` so that the new `Card` is in view.
+        * `label: ` the label to use. Only used when restoring a `Card` that
+        existed before; by default, and if it's already taken, `Deck` sets its own.
+        * `batch: ` if True, the caller is creating many `Card`s: don't resize,
+        scroll, focus or raise `Deck.EVT_NEW_CARD`. See `RestoreCards`.
 
         `returns: ` the new `Card`.
         """
-        # never use labels, always let Deck set its own
-        label = len(self.cards)
+        # labels are unique: they are used to find cards again after undoing
+        if label is None or label in self.labels:
+            label = self.next_label
+        self.next_label = max(self.next_label, label + 1)
 
         # create the new card with the unscaled position
         # so that we can just call new.Stretch() afterward
@@ -254,28 +458,45 @@ class Deck(utilities.AutoSize):
         new.Bind(card.Card.EVT_DELETE, self.OnCardDelete)
         new.Bind(card.Card.EVT_COLLAPSE, self.OnCardCollapse)
         new.Bind(card.Card.EVT_REQUEST_VIEW, self.OnCardRequest)
+        new.Bind(wx.EVT_MOVE, self.OnCardGeometry)
+        new.Bind(wx.EVT_SIZE, self.OnCardGeometry)
+        if isinstance(new, card.Image):
+            new.Bind(card.Image.EVT_IMAGE_RESIZE, self.OnImageResize)
+            new.Bind(card.Image.EVT_IMAGE_LOAD, self.OnImageLoad)
+        if isinstance(new, card.Content):
+            # bound on the card: it still reaches us while the card is being viewed
+            new.Bind(card.Content.EVT_CONT_KIND, self.OnContentKind)
+            self.IndexKind(new)
+        self.spatial.Insert(new, self.GetAbsoluteRect(new))
+        self.reading.Insert(new, self.GetModelRect(new))
+        self.stacking[new] = self.next_stack
+        self.next_stack += 1
         for ch in new.GetChildren():
             ch.Bind(wx.EVT_LEFT_DOWN, self.OnCardChildLeftDown)
 
-        # raise the appropriate event
-        event = self.NewCardEvent(id=wx.ID_ANY, subclass=subclass)
-        event.SetEventObject(new)
-        self.GetEventHandler().ProcessEvent(event)
+        if not batch:
+            # raise the appropriate event
+            event = self.NewCardEvent(id=wx.ID_ANY, subclass=subclass, number=1, cards=[new])
+            event.SetEventObject(new)
+            self.GetEventHandler().ProcessEvent(event)
 
-        # make enough space and breathing room for the new card
-        self.FitToChildren()
-        self.ExpandVirtualSize(self.GetPadding() * 2, self.GetPadding() * 2)
+            # make enough space and breathing room for the new card
+            self.FitToChildren()
+            self.ExpandVirtualSize(self.GetPadding() * 2, self.GetPadding() * 2)
         
-        # make sure the new card is visible
-        if scroll:
-            rect = new.GetRect()
-            deck = self.GetRect()
-            if rect.bottom > deck.bottom or rect.right > deck.right or rect.left < 0 or rect.top < 0:
-                self.ScrollToCard(new)
+            # make sure the new card is visible
+            if scroll:
+                rect = new.GetRect()
+                deck = self.GetRect()
+                if rect.bottom > deck.bottom or rect.right > deck.right or rect.left < 0 or rect.top < 0:
+                    self.ScrollToCard(new)
+
+            new.SetFocus()
 
         # finish up
-        new.SetFocus()
         self.cards.append(new)
+        self.classes.setdefault(new.__class__, OrderedDict())[new] = None
+        self.labels[label] = new
         return new
 
     def MoveCard(self, card, dx, dy):
@@ -286,6 +507,184 @@ class Deck(utilities.AutoSize):
         """
         card.MoveBy(dx, dy)
 
+    def MoveCards(self, cards, dx, dy):
+        """Move many `Card`s by the same amount, refreshing the screen only once.
+
+        `cards: ` a list of `Card`s.
+        `dx: ` the amount of pixels to move in the X direction.
+        `dy: ` the amount of pixels to move in the Y direction.
+        """
+        self.undo.Push(undo.MoveCards(self, [(c.GetLabel(), dx / self.scale, dy / self.scale) for c in cards]))
+        start = self.GetViewStartPixels()
+        self.Freeze()
+        for c in cards:
+            c.MoveBy(dx, dy, start)
+        self.Thaw()
+
+    def ResizeCard(self, label, size):
+        """Set the size of a `Card`. Used by `ResizeCard` to undo resizes.
+
+        * `label: ` the label of the `Card`.
+        * `size: ` a `(width, height)` tuple, at a scale of 1.0.
+        """
+        c = self.GetCard(label)
+        if c: c.SetSize(wx.Size(*[int(i * self.scale) for i in size]))
+
+    def MoveCardsBy(self, moves):
+        """Move many `Card`s, each by its own amount. Used by `MoveCards` to undo moves.
+
+        `moves: ` a list of `(label, dx, dy)` tuples, with the offsets at a scale of 1.0.
+        """
+        start = self.GetViewStartPixels()
+        self.Freeze()
+        for label, dx, dy in moves:
+            c = self.GetCard(label)
+            if c: c.MoveBy(dx * self.scale, dy * self.scale, start)
+        self.Thaw()
+
+    def DeleteCards(self, cards):
+        """Delete many `Card`s at once. Unlike `Card.Delete`, doesn't raise one
+        `Card.EVT_DELETE` for every `Card`: raises only one `Deck.EVT_DEL_CARD`
+        for all of them, and refreshes the screen only once.
+
+        * `cards: ` a list of `Card`s.
+        """
+        if not cards: return
+
+        self.Freeze()
+        self.RemoveCards(cards)
+        for c in cards:
+            c.Hide()
+            c.Destroy()
+        self.Thaw()
+
+    def RemoveCards(self, cards):
+        """Forget `cards`: remove them from every list, index, group and the
+        selection, in one pass. Raises `Deck.EVT_DEL_CARD`, while the `Card`s
+        still exist. Doesn't destroy the `Card`s.
+
+        * `cards: ` a list of `Card`s.
+        """
+        dead = set(cards)
+        rects = [self.spatial.GetRect(c) if self.spatial.Contains(c) else self.GetAbsoluteRect(c)
+                 for c in cards]
+
+        self.cards = [c for c in self.cards if c not in dead]
+        for c in cards:
+            self.spatial.Remove(c)
+            self.reading.Remove(c)
+            self.stacking.pop(c, None)
+            self.classes.get(c.__class__, {}).pop(c, None)
+            kind = self.card_kinds.pop(c, None)
+            if kind is not None: self.kinds[kind].discard(c)
+            self.labels.pop(c.GetLabel(), None)
+        for c in cards:
+            for g in self.card_groups.pop(c, ()):
+                g.Remove(c)
+            for dst in self.links.pop(c, ()):
+                self.RemoveLinkGeometry(c, dst)
+                if dst not in dead: self.backlinks[dst].discard(c)
+            for src in self.backlinks.pop(c, ()):
+                self.RemoveLinkGeometry(src, c)
+                if src not in dead: self.links[src].discard(c)
+        if self.edit_card in dead:
+            self.WatchEdits(None)
+        self.selec.ForgetCards(dead)
+
+        # rects are in absolute coordinates, see GetAbsoluteRect
+        event = self.DeleteEvent(id=wx.ID_ANY, number=len(cards), cards=cards, rects=rects)
+        event.SetEventObject(self)
+        self.GetEventHandler().ProcessEvent(event)
+
+    def DumpCard(self, crd):
+        """Dump a `Card`'s data, with its position relative to the start of
+        the virtual area, at a scale of 1.0.
+
+        * `crd: ` a `Card`.
+
+        `returns: ` a `dict`, as returned by `Card.Dump`.
+        """
+        d = crd.Dump()
+        d["pos"] = [i / self.scale for i in self.GetAbsoluteRect(crd)[:2]]
+        return d
+
+    def RestoreCard(self, d):
+        """Create again a `Card` dumped by `DumpCard`, with the same label.
+
+        * `d: ` a `dict` returned by `DumpCard`.
+
+        `returns: ` the new `Card`.
+        """
+        return self.RestoreCards([d])[0]
+
+    def RestoreCards(self, data, keep_labels=True):
+        """Create many `Card`s dumped by `DumpCard` in one batch: the `Deck`
+        is frozen during the whole operation, and resized only once.
+
+        * `data: ` a list of `dict`s returned by `DumpCard`.
+        * `keep_labels: ` if `True`, the `Card`s get their old labels back,
+        when they're free. Otherwise, they get new ones.
+
+        `returns: ` the list of new `Card`s.
+        """
+        start = self.GetViewStartPixels()
+        new_cards = []
+
+        self.Freeze()
+        for d in data:
+            pos = (d["pos"][0] * self.scale - start.x, d["pos"][1] * self.scale - start.y)
+            label = d.get("label") if keep_labels else None
+            new = self.NewCard(d["class"], pos=pos, label=label, batch=True)
+            # the label was already set by NewCard
+            new.Load(dict([(k, v) for k, v in d.iteritems() if k not in ("label", "pos", "width", "height")]))
+            new_cards.append(new)
+
+        self.FitToChildren()
+        self.ExpandVirtualSize(self.GetPadding() * 2, self.GetPadding() * 2)
+        self.Thaw()
+
+        # raise only one event for the whole batch
+        if new_cards:
+            subclasses = set([d["class"] for d in data])
+            subclass = subclasses.pop() if len(subclasses) == 1 else None
+            event = self.NewCardEvent(id=wx.ID_ANY, subclass=subclass, number=len(new_cards), cards=new_cards)
+            event.SetEventObject(self)
+            self.GetEventHandler().ProcessEvent(event)
+
+        return new_cards
+
+    def WatchEdits(self, crd):
+        """Remember the current data of `crd`, so that `CheckEdits` can
+        find out what changed.
+
+        * `crd: ` a `Card`, or `None`.
+        """
+        self.edit_card = crd
+        self.edit_data = self.GetEditData(crd) if crd else {}
+
+    def CheckEdits(self):
+        """Record the changes made to the `Card` watched by `WatchEdits`, if any."""
+        crd = self.edit_card
+        if not crd or self.GetCard(crd.GetLabel()) != crd: return
+
+        new = self.GetEditData(crd)
+        changed = [k for k in new.keys() if new[k] != self.edit_data.get(k)]
+        if changed:
+            self.undo.Push(undo.EditCard(self, crd.GetLabel(),
+                                         dict([(k, self.edit_data.get(k)) for k in changed]),
+                                         dict([(k, new[k]) for k in changed])))
+        self.edit_data = new
+
+    def GetEditData(self, crd):
+        """Get the fields of a `Card` that the user edits directly.
+
+        * `crd: ` a `Card`.
+
+        `returns: ` a `dict` with the keys in `EDIT_FIELDS` that `crd` has.
+        """
+        d = crd.Dump()
+        return dict([(k, d[k]) for k in self.EDIT_FIELDS if k in d])
+
     def GetSelection(self):
         """Return the current selected `Card`s.
 
@@ -315,29 +714,50 @@ class Deck(utilities.AutoSize):
         self.selec.Deactivate()
 
     def SelectGroup(self, group, new_sel=True):
-        """Select every `Card` in `group`.
+        """Select every `Card` in `group`, including the members of its descendants.
 
         * `group: ` a `CardGroup` to select.
         * `new_sel: ` if `True`, unselects all other `Card`s before selecting.
         """
         self.selec.SelectGroup(group, new_sel)
 
+    def SelectEnclosingGroup(self):
+        """Select the innermost `CardGroup` that contains the whole selection.
+        If the selection already is a whole `CardGroup`, select its parent instead,
+        so that repeated calls walk up the nesting.
+
+        `returns: ` the selected `CardGroup`, or None.
+        """
+        sel = self.GetSelection()
+        group = self.FindEnclosingGroup(sel)
+        if group and len(group.GetAllMembers()) == len(sel):
+            group = group.GetParent()
+        if group:
+            self.SelectGroup(group, new_sel=True)
+        return group
+
+    def SelectMany(self, cards, new_sel=False):
+        """Select all of `cards` at once.
+
+        * `cards: ` a list of `Card`s.
+        * `new_sel: ` if `True`, unselects all other `Card`s before selecting.
+        """
+        self.selec.SelectMany(cards, new_sel)
+
     def DeleteSelected(self):
         """Deletes every `Card` currently selected.
         """
         self.selec.DeleteSelected()
 
     def CopySelected(self):
-        """Copies every `Card` currently selected to `wx.TheClipboard`.
+        """Copies every `Card` currently selected to `wx.TheClipboard`, along
+        with the groups and links among them, and the images they show.
         """
-        # get the data
-        data = []
-        for c in self.GetSelection():
-            data.append(c.Dump())
+        sel = self.GetSelection()
+        if not sel: return
 
-        # create our own custom data object
-        obj = wx.CustomDataObject("CardList")
-        obj.SetData(str([json.dumps(d) for d in data]))
+        obj = wx.CustomDataObject(self.CLIPBOARD_FORMAT)
+        obj.SetData(self.DumpSelection(sel))
 
         # write the data to the clipboard
         if wx.TheClipboard.Open():
@@ -345,32 +765,85 @@ class Deck(utilities.AutoSize):
             wx.TheClipboard.Close()
 
     def PasteFromClipboard(self, pos=wx.DefaultPosition):
-        """Pastes every `Card` currently in `wx.TheClipboard`.
+        """Pastes every `Card` currently in `wx.TheClipboard`, keeping their
+        layout, groups and links.
+
+        * `pos: ` where to put the top left corner of the pasted `Card`s. By
+        default, they are placed a step away from the originals.
         """
         if wx.TheClipboard.Open():
-            # get data
-            obj = wx.CustomDataObject("CardList")
-            wx.TheClipboard.GetData(obj)
-
-            # don't use eval()! Use ast.literal_eval() instead
-            data = [json.loads(d) for d in ast.literal_eval(obj.GetData())]
-
-            # create new cards with the data
-            for d in data:
-                # copy all info and set focus to it
-                card = self.NewCard(d["class"])
-                card.Load(d)
-                card.SetFocus()
-
-                # default position: a step away from the original
-                if pos == wx.DefaultPosition:
-                    new_pos = [i + self.GetPadding() for i in d["pos"]]
-                else:
-                    new_pos = pos
-                    
-                card.SetPosition(new_pos)
-
+            obj = wx.CustomDataObject(self.CLIPBOARD_FORMAT)
+            found = wx.TheClipboard.GetData(obj)
             wx.TheClipboard.Close()
+            if found:
+                self.PasteSelection(obj.GetData(), pos)
+
+    def DumpSelection(self, cards):
+        """Serialize `cards` for the clipboard in a single pass.
+
+        * `cards: ` a list of `Card`s.
+
+        `returns: ` a zlib-compressed JSON string of the form
+        `{"cards": [...], "groups": [[lbl, ...], ...], "links": [[src, dst], ...], "images": {...}}`,
+        where cards are dumped by `DumpCard`, and images are base64 encoded.
+        """
+        copied = set(cards)
+        groups = set()
+        links = []
+        for c in cards:
+            groups.update(self.card_groups.get(c, ()))
+            links.extend([[c.GetLabel(), dst.GetLabel()] for dst in self.links.get(c, ()) if dst in copied])
+
+        keys = [c.GetImageKey() for c in cards if isinstance(c, card.Image)]
+        images = card.Image.store.Dump([k for k in keys if k])
+
+        d = {"cards": [self.DumpCard(c) for c in cards],
+             "groups": [[c.GetLabel() for c in g.GetMembers() if c in copied] for g in groups],
+             "links": links,
+             "images": dict([(k, base64.b64encode(v)) for k, v in images.iteritems()])}
+        return zlib.compress(json.dumps(d))
+
+    def PasteSelection(self, payload, pos=wx.DefaultPosition):
+        """Create the `Card`s serialized by `DumpSelection` in one batch, and
+        group and link them as the originals were.
+
+        * `payload: ` a string returned by `DumpSelection`.
+        * `pos: ` where to put the top left corner of the `Card`s. See `PasteFromClipboard`.
+
+        `returns: ` the list of new `Card`s.
+        """
+        d = json.loads(zlib.decompress(payload))
+        data = d["cards"]
+        if not data: return []
+        card.Image.store.Load(dict([(str(k), base64.b64decode(v)) for k, v in d["images"].iteritems()]))
+
+        # move them all by the same amount, to keep their relative layout
+        if pos == wx.DefaultPosition:
+            dx = dy = self.GetPadding() / self.scale
+        else:
+            start = self.GetViewStartPixels()
+            dx = (pos[0] + start.x) / self.scale - min([c["pos"][0] for c in data])
+            dy = (pos[1] + start.y) / self.scale - min([c["pos"][1] for c in data])
+        for c in data:
+            c["pos"] = [c["pos"][0] + dx, c["pos"][1] + dy]
+
+        new_cards = self.RestoreCards(data, keep_labels=False)
+        new = dict([(c["label"], n) for c, n in zip(data, new_cards)])
+
+        groups = []
+        for members in d["groups"]:
+            cards = [new[l] for l in members if l in new]
+            if len(cards) > 1:
+                groups.append(self.NewGroup(cards))
+        links = [(new[s], new[t]) for s, t in d["links"] if s in new and t in new]
+        for src, dst in links:
+            self.AddLink(src, dst)
+
+        self.undo.Push(undo.CreateCards(self, [self.DumpCard(c) for c in new_cards],
+                                        groups=[(g.GetLabel(), [c.GetLabel() for c in g.GetMembers()]) for g in groups],
+                                        links=[(s.GetLabel(), t.GetLabel()) for s, t in links]))
+        self.SelectMany(new_cards, new_sel=True)
+        return new_cards
 
     def GetGroups(self):
         """Get the list of `CardGroup`s defined for this `Deck`.
@@ -379,6 +852,15 @@ class Deck(utilities.AutoSize):
         """
         return self.groups
 
+    def GetGroup(self, label):
+        """Get the `CardGroup` with the specified label.
+
+        * `label: ` the label of the `CardGroup`.
+
+        `returns: ` a `CardGroup`, or None.
+        """
+        return self.group_labels.get(label)
+
     def GetContainingGroups(self, card):
         """Get a list of every `CardGroup` that contains `card`.
 
@@ -386,20 +868,245 @@ class Deck(utilities.AutoSize):
 
         `returns: ` a list of `CardGroup`s.
         """
-        return [g for g in self.groups if card in g.GetMembers()]
+        return list(self.card_groups.get(card, ()))
+
+    def GetRootGroups(self):
+        """Get the `CardGroup`s that are not nested in any other.
+
+        `returns: ` a list of `CardGroup`s.
+        """
+        return [g for g in self.groups if not g.GetParent()]
+
+    def FindEnclosingGroup(self, cards):
+        """Find the innermost `CardGroup` whose subtree contains all of `cards`.
 
-    def NewGroup(self, cards=[]):
+        * `cards: ` a list of `Card`s.
+
+        `returns: ` a `CardGroup`, or None.
+        """
+        if not cards: return None
+
+        # only the groups holding the first card, and their ancestors, can contain all
+        candidates = set()
+        for g in self.card_groups.get(cards[0], ()):
+            candidates.add(g)
+            candidates.update(g.GetAncestors())
+
+        found = None
+        for g in sorted(candidates, key=lambda g: g.GetDepth(), reverse=True):
+            if all([g.ContainsDeep(c) for c in cards]):
+                found = g
+                break
+        return found
+
+    def NewGroup(self, cards=[], label=None, parent=None):
         """Create a new `CardGroup` with `cards` as members.
 
         * `cards: ` a list of `Card`s.
+        * `label: ` the label of the new `CardGroup`. If it's None or already taken, a new one is used.
+        * `parent: ` the `CardGroup` to nest the new one in, or None.
+
+        `returns: ` the new `CardGroup`.
+        """
+        if label is None or label in self.group_labels:
+            label = self.next_group
+        self.next_group = max(self.next_group, label + 1)
+
+        group = card.CardGroup(label=label, members=cards)
+        group.SetParent(parent)
+        self.groups.append(group)
+        self.group_labels[label] = group
+        for c in group.GetMembers():
+            self.card_groups.setdefault(c, set()).add(group)
+        return group
+
+    def DeleteGroup(self, group):
+        """Delete a `CardGroup`. Its members are not deleted, and its children
+        are nested in its parent.
+
+        * `group: ` a `CardGroup`.
+        """
+        parent = group.GetParent()
+        for ch in group.GetChildren()[:]:
+            ch.SetParent(parent)
+        group.SetParent(None)
+
+        self.groups.remove(group)
+        del self.group_labels[group.GetLabel()]
+        for c in group.GetMembers():
+            groups = self.card_groups.get(c)
+            if groups:
+                groups.discard(group)
+                if not groups: del self.card_groups[c]
+
+    def AddToGroup(self, group, crd):
+        """Add a `Card` to a `CardGroup`. Use this instead of `CardGroup.Add`,
+        so that `GetContainingGroups` stays up to date.
+
+        * `group: ` a `CardGroup`.
+        * `crd: ` a `Card`.
         """
-        self.groups.append(card.CardGroup(label=len(self.groups), members=cards))
+        group.Add(crd)
+        self.card_groups.setdefault(crd, set()).add(group)
 
     def GroupSelected(self):
         """Creates a new `CardGroup` with the selected `Card`s as members.
+        The new group is nested in the innermost group that contains the
+        whole selection, and the groups that are entirely selected are
+        nested in the new one.
         """
         sel = self.GetSelection()
-        if sel: self.NewGroup(sel)
+        if not sel: return
+
+        parent = self.FindEnclosingGroup(sel)
+        siblings = parent.GetChildren() if parent else self.GetRootGroups()
+        selected = set(sel)
+        children = [g for g in siblings
+                    if g.GetAllMembers() and all([c in selected for c in g.GetAllMembers()])]
+
+        # cards already held by the new children don't need to be direct members
+        taken = set()
+        for g in children: taken.update(g.GetAllMembers())
+        group = self.NewGroup([c for c in sel if c not in taken], parent=parent)
+        for g in children: g.SetParent(group)
+
+        self.undo.Push(undo.NewGroup(self, group))
+
+    def MoveGroup(self, group, dx, dy):
+        """Move every `Card` in `group` and its descendants by the same amount.
+
+        * `group: ` a `CardGroup`.
+        * `dx: ` the amount of pixels to move in the X direction.
+        * `dy: ` the amount of pixels to move in the Y direction.
+        """
+        self.MoveCards(group.GetAllMembers(), dx, dy)
+
+    def CollapseGroup(self, group, collapse=True):
+        """Collapse or uncollapse every `Content` in `group` and its descendants,
+        refreshing the screen only once.
+
+        * `group: ` a `CardGroup`.
+        * `collapse: ` if `True`, collapse. Otherwise, uncollapse.
+        """
+        self.CollapseCards(group.GetAllMembers(), lambda c: collapse)
+
+    def ToggleCollapseCards(self, cards):
+        """Toggle the collapsed state of every `Content` in `cards`, refreshing
+        the screen only once. Recorded as a single undoable action.
+
+        * `cards: ` a list of `Card`s.
+        """
+        self.CollapseCards(cards, lambda c: not c.IsCollapsed())
+
+    def CollapseCards(self, cards, collapse):
+        """Collapse or uncollapse many `Content`s at once, and record the
+        change as a single undoable action.
+
+        * `cards: ` a list of `Card`s. Those that are not `Content`s are ignored.
+        * `collapse: ` a function that takes a `Content` and returns `True`
+        if it should be collapsed, or `False` if it should be uncollapsed.
+        """
+        # record whatever was typed before, so that it's not mixed with this
+        self.CheckEdits()
+
+        changes = []
+        self.Freeze()
+        for c in [c for c in cards if isinstance(c, card.Content)]:
+            old = c.IsCollapsed()
+            if collapse(c): c.Collapse()
+            else:           c.Uncollapse()
+            if c.IsCollapsed() != old:
+                changes.append((c.GetLabel(), old))
+        self.Thaw()
+
+        # the collapsed state of the edited card is recorded here, not by CheckEdits
+        if self.edit_card:
+            self.WatchEdits(self.edit_card)
+        if changes:
+            self.undo.Push(undo.CollapseCards(self, changes))
+
+    def AddLink(self, src, dst):
+        """Add a cross-reference from one `Card` to another.
+
+        * `src: ` the `Card` that refers to `dst`.
+        * `dst: ` the `Card` referred to.
+
+        `returns: ` `True` if the link is new.
+        """
+        if src is dst or dst in self.links.get(src, ()):
+            return False
+        self.links.setdefault(src, set()).add(dst)
+        self.backlinks.setdefault(dst, set()).add(src)
+        self.UpdateLinkGeometry(src, dst)
+        return True
+
+    def RemoveLink(self, src, dst):
+        """Remove the cross-reference from `src` to `dst`, if there is one.
+
+        * `src: ` the `Card` that refers to `dst`.
+        * `dst: ` the `Card` referred to.
+        """
+        self.links.get(src, set()).discard(dst)
+        self.backlinks.get(dst, set()).discard(src)
+        self.RemoveLinkGeometry(src, dst)
+
+    def GetLinks(self, crd):
+        """Get the `Card`s that `crd` refers to.
+
+        * `crd: ` a `Card`.
+
+        `returns: ` a list of `Card`s.
+        """
+        return list(self.links.get(crd, ()))
+
+    def GetBacklinks(self, crd):
+        """Get the `Card`s that refer to `crd`.
+
+        * `crd: ` a `Card`.
+
+        `returns: ` a list of `Card`s.
+        """
+        return list(self.backlinks.get(crd, ()))
+
+    def GetAllLinks(self):
+        """Get every cross-reference in this `Deck`.
+
+        `returns: ` a list of `(src, dst)` tuples of `Card`s.
+        """
+        return [(src, dst) for src, dsts in self.links.iteritems() for dst in dsts]
+
+    def GetLinksWithin(self, crd, hops, backlinks=True):
+        """Find every `Card` that can be reached from `crd` following at most `hops` links.
+
+        * `crd: ` the `Card` to start from.
+        * `hops: ` the maximum number of links to follow.
+        * `backlinks: ` if `True`, links are followed in both directions.
+
+        `returns: ` a list of `(card, distance)` tuples, closest first, not including `crd`.
+        """
+        seen = set([crd])
+        found = []
+        frontier = [crd]
+        for dist in range(1, hops + 1):
+            nxt = []
+            for c in frontier:
+                near = self.links.get(c, set())
+                if backlinks: near = near | self.backlinks.get(c, set())
+                for n in near:
+                    if n not in seen:
+                        seen.add(n)
+                        nxt.append(n)
+                        found.append((n, dist))
+            if not nxt: break
+            frontier = nxt
+        return found
+
+    def LinkSelected(self):
+        """Link the selected `Card`s one after the other, in the order they were selected."""
+        sel = self.GetSelection()
+        pairs = [(a.GetLabel(), b.GetLabel()) for a, b in zip(sel, sel[1:]) if self.AddLink(a, b)]
+        if pairs:
+            self.undo.Push(undo.LinkCards(self, pairs))
 
     def ScrollToCard(self, card):
         """Scroll in both direction so that `card` is fully in view.
@@ -466,12 +1173,75 @@ class Deck(utilities.AutoSize):
     def ArrangeSelection(self, orient):
         """Arranges the selected cards according to `orient`.
 
-        * `orient: ` must be one of `Deck.HORIZONTAL` or `Deck.VERTICAL`.
+        * `orient: ` must be one of `Deck.HORIZONTAL`, `Deck.VERTICAL`, `Deck.GRID`,
+        `Deck.SHELF` or `Deck.GROUPED`.
         """
         if   orient == Deck.HORIZONTAL:
             self.HArrangeSelectedCards()
         elif orient == Deck.VERTICAL:
             self.VArrangeSelectedCards()
+        else:
+            self.ArrangeCards(self.GetSelection()[:], orient)
+
+    def ArrangeAll(self, orient):
+        """Arranges every `Card` in this `Deck`.
+
+        * `orient: ` must be one of `Deck.GRID`, `Deck.SHELF` or `Deck.GROUPED`.
+        """
+        self.ArrangeCards(self.GetCards()[:], orient)
+
+    def ArrangeCards(self, cards, orient):
+        """Arranges `cards` with one of the algorithms in `layout`. All the new
+        positions are computed in one pass, and then applied all at once.
+
+        * `cards: ` a list of `Card`s.
+        * `orient: ` `Deck.GRID` places the cards on a grid, `Deck.SHELF` packs
+        cards of different sizes in rows, and `Deck.GROUPED` moves the members
+        of each `CardGroup` together.
+        """
+        if len(cards) < 1: return
+
+        # we unselect first so that we erase the selection rectangles correctly
+        self.UnselectAll()
+
+        # read the rects only once, in reading order
+        rects = [tuple(c.GetRect()) for c in cards]
+        order = sorted(range(len(cards)), key=lambda i: (rects[i][1], rects[i][0]))
+        cards = [cards[i] for i in order]
+        rects = [rects[i] for i in order]
+        origin = (min([r[0] for r in rects]), min([r[1] for r in rects]))
+        pad = self.GetPadding()
+
+        if   orient == Deck.GRID:
+            pos = layout.GridLayout(rects, origin, pad)
+        elif orient == Deck.SHELF:
+            pos = layout.ShelfLayout(rects, origin, pad)
+        elif orient == Deck.GROUPED:
+            index = dict([(c, i) for i, c in enumerate(cards)])
+            # nested groups move along with their top level group
+            groups = [[index[c] for c in g.GetAllMembers() if c in index] for g in self.GetRootGroups()]
+            pos = layout.ForceLayout(rects, groups, origin, pad)
+        else:
+            return
+
+        self.SetCardPositions(cards, pos)
+        self.FitToChildren()
+        self.selec.SetFocus()
+
+    def SetCardPositions(self, cards, positions):
+        """Moves many `Card`s at once, refreshing the screen only once.
+
+        * `cards: ` a list of `Card`s.
+        * `positions: ` a list of `(x, y)` positions, one for each `Card`.
+        """
+        moves = []
+        self.Freeze()
+        for c, pos in zip(cards, positions):
+            old = c.GetPosition()
+            moves.append((c.GetLabel(), (pos[0] - old.x) / self.scale, (pos[1] - old.y) / self.scale))
+            c.SetPosition(wx.Point(*pos))
+        self.Thaw()
+        self.undo.Push(undo.MoveCards(self, moves))
 
     def HArrangeSelectedCards(self):
         """Same as `Deck.ArrangeSelection(Deck.HORIZONTAL)`. Arranges `Card`s
@@ -489,10 +1259,12 @@ class Deck(utilities.AutoSize):
         top = card.GetRect().top
         arrange.sort(key=lambda x: x.GetRect().left)
 
+        positions = []
         for c in arrange:
-            c.SetPosition(wx.Point(left, top))
-            left = c.GetRect().right + self.GetPadding()
+            positions.append((left, top))
+            left += c.GetSize().width + self.GetPadding()
 
+        self.SetCardPositions(arrange, positions)
         self.FitToChildren()
         self.selec.SetFocus()
 
@@ -513,10 +1285,12 @@ class Deck(utilities.AutoSize):
         arrange.sort(key=lambda x: x.GetRect().top)
 
         # and align all to the pivot
+        positions = []
         for c in arrange:
-            c.SetPosition(wx.Point(left, top))
-            top = c.GetRect().bottom + self.GetPadding()
+            positions.append((left, top))
+            top += c.GetSize().height + self.GetPadding()
 
+        self.SetCardPositions(arrange, positions)
         self.FitToChildren()
         self.selec.SetFocus()
 
@@ -529,24 +1303,52 @@ class Deck(utilities.AutoSize):
         card.SetSize([i*self.scale for i in card.GetSize()])
         
     def OnCardDelete(self, ev):
-        """Listens to every `Card.EVT_DELETE`."""
+        """Listens to every `Card.EVT_DELETE`, raised when a single `Card` is
+        deleted by calling `Card.Delete`. See `DeleteCards`."""
+        crd = ev.GetEventObject()
+        self.undo.Push(undo.DeleteCards(self, [crd]))
+        self.RemoveCards([crd])
+
+    def OnImageResize(self, ev):
+        """Listens to `Image.EVT_IMAGE_RESIZE` from every `Image`."""
+        old = [i / self.scale for i in ev.old]
+        new = [i / self.scale for i in ev.new]
+        self.undo.Push(undo.ResizeCard(self, ev.GetEventObject().GetLabel(), old, new))
+
+    def OnImageLoad(self, ev):
+        """Listens to `Image.EVT_IMAGE_LOAD` from every `Image`."""
+        self.undo.Push(undo.EditCard(self, ev.GetEventObject().GetLabel(), ev.old, ev.new))
+
+    def OnContentKind(self, ev):
+        """Listens to `Content.EVT_CONT_KIND` from every `Content`."""
+        self.IndexKind(ev.GetEventObject())
+        ev.Skip()
+
+    def OnCardGeometry(self, ev):
+        """Listens to `wx.EVT_MOVE` and `wx.EVT_SIZE` from every `Card`, to keep
+        `self.spatial` up to date. Raises `Deck.EVT_CARD_GEOMETRY` when the rect
+        actually changed."""
         card = ev.GetEventObject()
-        self.cards.remove(card)
-        self.UnselectCard(card)
+        # cards being viewed are not on this Deck
+        if card.GetParent() == self and self.spatial.Contains(card):
+            rect = tuple(self.GetAbsoluteRect(card))
+            old = self.spatial.GetRect(card)
+            if rect != old:
+                self.spatial.Update(card, rect)
+                self.reading.Update(card, self.GetModelRect(card))
+                self.UpdateCardLinks(card)
+                event = self.GeometryEvent(id=wx.ID_ANY, old=old, rect=rect)
+                event.SetEventObject(card)
+                self.GetEventHandler().ProcessEvent(event)
+        ev.Skip()
 
     def OnMgrDelete(self, ev):
         """Listens to `SelectionManager.EVT_MGR_DELETE`, which is raised
-        on every delete action. `Deck.DeleteSelected` calls every selected
-        `Card`'s `Delete` method, which raises many `Card.EVT_DELETE`,
-        and then raises only one `SelectionManager.EVT_MGR_DELETE` event.
+        after `SelectionManager.DeleteSelected` calls `DeleteCards`. By then,
+        `Deck.EVT_DEL_CARD` was already raised.
         """
         self.selec.Deactivate()
 
-        # raise the event again, with event object = self
-        event = self.DeleteEvent(id=wx.ID_ANY, number=ev.number)
-        event.SetEventObject(self)
-        self.GetEventHandler().ProcessEvent(event)
-
     def OnCardRequest(self, ev):
         """Listens to `Card.EVT_REQUEST_VIEW` and raises `Deck.EVT_REQUEST_VIEW`
         with the same card as event object. The difference is that now a
@@ -562,6 +1364,20 @@ class Deck(utilities.AutoSize):
         # important to avoid automatically scrolling to focused child
         pass 
 
+    def OnPaint(self, ev):
+        """Listens to `wx.EVT_PAINT`. Paints the background and, in a single pass,
+        only the links that cross the region being repainted."""
+        dc = wx.AutoBufferedPaintDC(self)
+        dc.SetBackground(wx.Brush(self.GetBackgroundColour()))
+        dc.Clear()
+
+        start = self.GetViewStartPixels()
+        box = self.GetUpdateRegion().GetBox()
+        region = (box.x + start.x, box.y + start.y, box.width, box.height)
+        segs = [self.link_segs[k] for k in self.link_index.Query(region)]
+        lines, arrows = self.GetLinkShapes(segs, start)
+        self.DrawLinks(dc, lines, arrows)
+
     def OnCardChildLeftDown(self, ev):
         """Listens to `wx.EVT_LEFT_DOWN` events on every `Card`'s child window."""
         self.UnselectAll()
@@ -572,7 +1388,7 @@ class Deck(utilities.AutoSize):
         card = ev.GetEventObject()
 
         # bring to front and select
-        card.Raise()
+        self.RaiseCard(card)
         self.selec.SelectCard(card)
 
         # initiate moving
@@ -590,35 +1406,45 @@ class Deck(utilities.AutoSize):
     def OnCardChildFocus(self, ev):
         """Listens to `wx.EVT_CHILD_FOCUS` from every `Card`."""
         self.UnselectAll()
+
+        # record the edits made to the previous card
+        crd = ev.GetEventObject()
+        if crd != self.edit_card:
+            self.CheckEdits()
+            self.WatchEdits(crd)
         ev.Skip()
 
     def OnMovingCard(self, ev):
         """Listens to `wx.EVT_MOTION` events from `Card`s only while a `Card` is being click-dragged."""
         if ev.Dragging() and self.moving_cards_pos:
-            # draw a rectangle while moving
-            # order is important
+            # only remember the last position: the rectangles are
+            # painted at most once every DRAG_REFRESH_MS, no matter
+            # how many motion events we get in between
             self.on_motion = True
-            for c, orig, pos in self.moving_cards_pos:
-                self.EraseCardRect(c, pos, refresh = False)
-                pos = ev.GetPosition() + orig
-                self.PaintCardRect(c, pos)
+            self.drag_pos = ev.GetPosition()
+            if not self.drag_pending:
+                self.drag_pending = True
+                wx.CallLater(self.DRAG_REFRESH_MS, self.PaintMovingRects)
 
     def OnCardLeftUp(self, ev):
         """Listens to `wx.EVT_LEFT_UP` events from `Card`s only while a `Card` is being click-dragged."""
         # terminate moving
         if self.on_motion:
             self.on_motion = False
-            for c, orig, pos in self.moving_cards_pos:
-                self.EraseCardRect(c, pos)
+            self.ClearMovingRects()
                 
             if self.moving_cards_pos:
+                moves = []
                 for c, orig, pos in self.moving_cards_pos:
-                    final_pos = ev.GetPosition() + orig - (Content.BORDER_WIDTH, Content.BORDER_WIDTH)
+                    final_pos = ev.GetPosition() + orig - (card.Card.BORDER_WIDTH, card.Card.BORDER_WIDTH)
+                    moves.append((c.GetLabel(), (final_pos.x - pos.x) / self.scale, (final_pos.y - pos.y) / self.scale))
                     # since we need to set absolute final position, we use
                     # Card.Move instead of Card.MoveBy
                     c.Move(final_pos)
+                self.undo.Push(undo.MoveCards(self, moves))
                     
         self.moving_cards_pos = []
+        self.drag_pos = None
         self.ReleaseMouse()
         self.Unbind(wx.EVT_LEFT_UP)
         self.Unbind(wx.EVT_MOTION)
@@ -676,7 +1502,8 @@ class Deck(utilities.AutoSize):
 
     def OnLeftDClick(self, ev):
         """Listens to `wx.EVT_LEFT_DCLICK` events from this object."""
-        self.NewCard("Content", pos=ev.GetPosition())
+        new = self.NewCard("Content", pos=ev.GetPosition())
+        self.undo.Push(undo.CreateCards(self, [self.DumpCard(new)]))
         
     def OnCtrlRet(self, ev):
         """Listens to CTRL+RET."""
@@ -723,6 +1550,105 @@ class Deck(utilities.AutoSize):
             
     ### Auxiliary functions
 
+    def GetShortKind(self, kind):
+        """Get the short label of a kind.
+
+        * `kind: ` a `Content.*_LBL` or `Content.*_LBL_LONG` constant.
+
+        `returns: ` a `Content.*_LBL` constant.
+        """
+        for short, lng in card.KindButton.LONG_LABELS.iteritems():
+            if kind == lng: return short
+        return kind
+
+    def IndexKind(self, crd):
+        """Move `crd` to the right place in `self.kinds`, after its kind changed.
+
+        * `crd: ` a `Content`.
+        """
+        old = self.card_kinds.get(crd)
+        kind = crd.GetKind()
+        if old == kind: return
+        if old is not None: self.kinds[old].discard(crd)
+        self.card_kinds[crd] = kind
+        self.kinds.setdefault(kind, set()).add(crd)
+
+    def UpdateLinkGeometry(self, src, dst):
+        """Recompute the segment of the link from `src` to `dst` and store
+        it in `self.link_index`, repainting where it was and where it is now.
+
+        * `src: ` a `Card`.
+        * `dst: ` a `Card`.
+        """
+        if not self.spatial.Contains(src) or not self.spatial.Contains(dst):
+            return
+        key = (src, dst)
+        seg = layout.LinkSegment(self.spatial.GetRect(src), self.spatial.GetRect(dst))
+        if self.link_segs.get(key) == seg:
+            return
+
+        self.RemoveLinkGeometry(src, dst)
+        self.link_segs[key] = seg
+        rect = layout.SegmentRect(seg, self.LINK_ARROW)
+        self.link_index.Insert(key, rect)
+        self.RefreshAbsolute(rect)
+
+    def RemoveLinkGeometry(self, src, dst):
+        """Forget the segment of the link from `src` to `dst`, and repaint where it was.
+
+        * `src: ` a `Card`.
+        * `dst: ` a `Card`.
+        """
+        key = (src, dst)
+        if self.link_segs.pop(key, None) is not None:
+            self.RefreshAbsolute(self.link_index.GetRect(key))
+            self.link_index.Remove(key)
+
+    def UpdateCardLinks(self, crd):
+        """Recompute the segments of every link to or from `crd`.
+
+        * `crd: ` a `Card`.
+        """
+        for dst in self.links.get(crd, ()):
+            self.UpdateLinkGeometry(crd, dst)
+        for src in self.backlinks.get(crd, ()):
+            self.UpdateLinkGeometry(src, crd)
+
+    def RefreshAbsolute(self, rect):
+        """Repaint a region of the virtual area.
+
+        * `rect: ` a `(x, y, w, h)` tuple, in absolute coordinates. See `GetAbsoluteRect`.
+        """
+        start = self.GetViewStartPixels()
+        self.RefreshRect(wx.Rect(rect[0] - start.x, rect[1] - start.y, rect[2], rect[3]), eraseBackground=False)
+
+    def GetLinkShapes(self, segs, offset):
+        """Convert link segments to the lines and arrow heads to draw.
+
+        * `segs: ` a list of `(x1, y1, x2, y2)` tuples.
+        * `offset: ` the `(x, y)` amount to subtract from every point.
+
+        `returns: ` a tuple `(lines, arrows)`, ready for `wx.DC.DrawLineList` and `wx.DC.DrawPolygonList`.
+        """
+        ox, oy = offset
+        lines = [(x1 - ox, y1 - oy, x2 - ox, y2 - oy) for x1, y1, x2, y2 in segs]
+        arrows = [layout.ArrowHead(l, self.LINK_ARROW) for l in lines]
+        return lines, [a for a in arrows if a]
+
+    def DrawLinks(self, dc, lines, arrows):
+        """Draw all links in one go.
+
+        * `dc: ` a `wx.DC`.
+        * `lines: ` a list of `(x1, y1, x2, y2)` tuples.
+        * `arrows: ` a list of lists of points.
+        """
+        if not lines: return
+        dc.SetPen(self.link_pen)
+        dc.SetBrush(self.link_brush)
+        dc.DrawLineList(lines)
+        dc.DrawPolygonList(arrows)
+
+
     def InitMenu(self):
         """Initializes the `wx.Menu` to display on right click."""
         # make menu
@@ -809,6 +1735,55 @@ class Deck(utilities.AutoSize):
         rect = rect.Inflate(2 * thick, 2 * thick)
         self.PaintRect(rect, thick=thick, style=style, refresh=refresh)
 
+    def PaintMovingRects(self):
+        """Paints the rectangles around all the `Card`s being click-dragged, in a single
+        pass over `self.overlay`. The overlay takes care of erasing the previous ones.
+        """
+        self.drag_pending = False
+        if not self.moving_cards_pos or not self.drag_pos:
+            return
+
+        thick = self.MOVING_RECT_THICKNESS
+        rects = []
+        moving = {}
+        for c, orig, pos in self.moving_cards_pos:
+            x, y = self.drag_pos + orig
+            w, h = c.GetSize()
+            rects.append((x - 2 * thick, y - 2 * thick, w + 4 * thick, h + 4 * thick))
+            moving[c] = (x, y, w, h)
+
+        # only the links to or from the moving cards follow them
+        start = self.GetViewStartPixels()
+        def ClientRect(c):
+            if c in moving: return moving[c]
+            x, y, w, h = self.spatial.GetRect(c)
+            return (x - start.x, y - start.y, w, h)
+
+        pairs = set()
+        for c in moving:
+            pairs.update([(c, dst) for dst in self.links.get(c, ())])
+            pairs.update([(src, c) for src in self.backlinks.get(c, ())])
+        segs = [layout.LinkSegment(ClientRect(src), ClientRect(dst)) for src, dst in pairs
+                if self.spatial.Contains(src) and self.spatial.Contains(dst)]
+        lines, arrows = self.GetLinkShapes(segs, (0, 0))
+
+        dc = wx.ClientDC(self)
+        odc = wx.DCOverlay(self.overlay, dc)
+        odc.Clear()
+        self.DrawLinks(dc, lines, arrows)
+        dc.SetBrush(wx.TRANSPARENT_BRUSH)
+        dc.SetPen(self.moving_pen)
+        dc.DrawRectangleList(rects)
+        del odc # the overlay is only updated when odc is destroyed
+
+    def ClearMovingRects(self):
+        """Erases the rectangles painted by `PaintMovingRects`."""
+        dc = wx.ClientDC(self)
+        odc = wx.DCOverlay(self.overlay, dc)
+        odc.Clear()
+        del odc
+        self.overlay.Reset()
+
     def EraseCardRect(self, card, pos, thick=MOVING_RECT_THICKNESS, refresh=True):
         """Erases a rectangle drawn by PaintCardRect().
 
@@ -848,7 +1823,7 @@ class Deck(utilities.AutoSize):
         return carddict
 
     def DumpGroups(self):
-        """Dumps all the `CardGroup`s' info in a `dict`.
+        """Dumps all the `CardGroup`s' info in a `dict`. See `CardGroup.Dump`.
 
         `returns: ` a `dict` of the form {label1: data1, label2: data2, ...}.
         """
@@ -856,32 +1831,76 @@ class Deck(utilities.AutoSize):
         for g in self.groups: d[g.GetLabel()] = g.Dump()
         return d
 
+    def DumpImages(self):
+        """Dumps the data of every image shown by an `Image` `Card`. Every image
+        is dumped only once, even if many `Card`s show it.
+
+        `returns: ` a `dict` of the form {key1: data1, key2: data2, ...}. See `ImageStore.Dump`.
+        """
+        keys = [c.GetImageKey() for c in self.IterImages()]
+        return card.Image.store.Dump([k for k in keys if k])
+
+    def DumpLinks(self):
+        """Dumps all the cross-references between `Card`s.
+
+        `returns: ` a list of `[src, dst]` pairs of `Card` labels.
+        """
+        return [[src.GetLabel(), dst.GetLabel()] for src, dst in self.GetAllLinks()]
+
     def Dump(self):
         """Returns a `dict` with all the info contained in this `Deck`.
 
-        `returns: ` a `dict` of the form {"cards": self.DumpCards(), "groups": self.DumpGroups()}.
+        `returns: ` a `dict` of the form {"cards": self.DumpCards(), "groups": self.DumpGroups(), "links": self.DumpLinks(), "images": self.DumpImages()}.
         """
-        return {"cards": self.DumpCards(), "groups": self.DumpGroups()}
+        return {"cards": self.DumpCards(), "groups": self.DumpGroups(),
+                "links": self.DumpLinks(), "images": self.DumpImages()}
 
     def Load(self, d):
         """Read a `dict` and load all its data.
 
         * `d: ` a `dict` in the format returned by `Dump`.
         """
+        # images go first, so that Image cards find their data
+        if "images" in d.keys():
+            card.Image.store.Load(d["images"])
+
         if "cards" in d.keys():
             # note we are not loading the wx id of the windows
             # instead, as identifier, we use label, which should
             # be a value of the dict values
             for id, values in d["cards"].iteritems():
-                new = self.NewCard(values["class"])
+                new = self.NewCard(values["class"], label=values.get("label"))
+                label = new.GetLabel()
                 new.Load(values)
+                # keep the label NewCard gave us, in case the saved one was taken
+                new.label = label
                     
         if "groups" in d.keys():
             # here again we use the label as identifier
             # but this time the label is the key in the dictionary
-            for label, members in d["groups"].iteritems():
+            # old files hold only a list of member labels, without nesting
+            parents = {}
+            for label, data in d["groups"].iteritems():
+                if isinstance(data, dict):
+                    members = data["members"]
+                    if data.get("parent") is not None:
+                        parents[int(label)] = int(data["parent"])
+                else:
+                    members = data
                 cards = [self.GetCard(l) for l in members]
-                self.NewGroup(cards)
+                self.NewGroup([c for c in cards if c], label=int(label))
+
+            # now that every group exists, nest them
+            for label, parent in parents.iteritems():
+                group, parent = self.GetGroup(label), self.GetGroup(parent)
+                if group and parent:
+                    group.SetParent(parent)
+
+        if "links" in d.keys():
+            for src, dst in d["links"]:
+                src, dst = self.GetCard(src), self.GetCard(dst)
+                if src and dst:
+                    self.AddLink(src, dst)
 
 
                 
@@ -899,6 +1918,7 @@ class SelectionManager(wx.Window):
     """
     SIZE = (1,1)
     POS  = (0,0)
+    MOVE_COALESCE_MS = 15
 
     DeleteEvent, EVT_MGR_DELETE = ne.NewCommandEvent()
 
@@ -908,9 +1928,12 @@ class SelectionManager(wx.Window):
         * `parent: ` the parent `wx.Window`, usually a `Deck`.
         """
         super(SelectionManager, self).__init__(parent, size=self.SIZE, pos=self.POS)
-        self.cards = []
+        # an ordered set: the keys are the cards, in selection order
+        self.cards = OrderedDict()
         self.last = None
         self.active = False
+        self.pending_move = (0, 0)
+        self.move_pending = False
         self.SetBackgroundColour(self.GetParent().GetBackgroundColour())
 
 
@@ -949,9 +1972,9 @@ class SelectionManager(wx.Window):
     def GetSelection(self):
         """Get the selected `Card`s.
 
-        `returns: ` a list of `Card`s.
+        `returns: ` a list of `Card`s, in the order they were selected.
         """
-        return self.cards
+        return self.cards.keys()
 
     def SelectCard(self, card, new_sel=False):
         """Selects `card`.
@@ -962,7 +1985,7 @@ class SelectionManager(wx.Window):
         if new_sel:
             self.Activate()
             self.UnselectAll()
-            self.cards = [card]
+            self.cards[card] = None
             card.Select()
             self.last = card
             
@@ -970,11 +1993,30 @@ class SelectionManager(wx.Window):
         elif card not in self.cards:
             if not self.IsActive():
                 self.Activate()
-            self.cards.append(card)                        
-            
-            for c in self.cards:
+            self.cards[card] = None
+            card.Select()
+            self.last = card
+
+    def SelectMany(self, cards, new_sel=False):
+        """Selects all of `cards` at once. Every `Card`'s border is
+        repainted at most once.
+
+        * `cards: ` a list of `Card`s.
+        * `new_sel: ` if `True`, unselects all other `Card`s before selecting.
+        """
+        deck = self.GetParent()
+        deck.Freeze()
+        if new_sel:
+            self.UnselectAll()
+        if not self.IsActive():
+            self.Activate()
+
+        for c in cards:
+            if c not in self.cards:
+                self.cards[c] = None
                 c.Select()
-                self.last = card
+                self.last = c
+        deck.Thaw()
 
     def UnselectCard(self, card):
         """Removes `card` from the current selection.
@@ -982,16 +2024,28 @@ class SelectionManager(wx.Window):
         * `card: ` a `Card`.
         """
         if card in self.cards:
-            self.cards.remove(card)
+            del self.cards[card]
             card.Unselect()
 
     def UnselectAll(self):
         """Unselects all cards. Be sure to call this method instead of
         `Unselect` on every card for proper cleanup.
         """
-        while len(self.cards) > 0:
-            c = self.cards[0]
-            self.UnselectCard(c)
+        cards = self.cards
+        self.cards = OrderedDict()
+        for c in cards:
+            c.Unselect()
+
+    def ForgetCards(self, cards):
+        """Remove `Card`s that are about to be destroyed from the selection,
+        without repainting them.
+
+        * `cards: ` a `set` of `Card`s.
+        """
+        for c in cards:
+            self.cards.pop(c, None)
+        if self.last in cards:
+            self.last = None
 
     def SelectGroup(self, group, new_sel=True):
         """Select every `Card` in `group`.
@@ -1002,11 +2056,11 @@ class SelectionManager(wx.Window):
         # in case we are coming from a card that's inside the group,
         # we may want to return to that card after selection ends
         # so we select the group but restore the last card after
-        if self.last and self.last in group.GetMembers():
+        crd = None
+        if self.last and group.ContainsDeep(self.last):
             crd = self.last
 
-        if new_sel: self.UnselectAll()
-        for c in group.GetMembers(): self.SelectCard(c)
+        self.SelectMany(group.GetAllMembers(), new_sel)
 
         if crd:
             self.last = crd
@@ -1015,19 +2069,15 @@ class SelectionManager(wx.Window):
         """Deletes every `Card` currently selected."""
         # store the number of cards we're deleting to raise the event
         number = len(self.cards)
+        deck = self.GetParent()
+        cards = self.GetSelection()
+        if cards:
+            deck.undo.Push(undo.DeleteCards(deck, cards))
         
-        # remember to use while instead of for, since in every
-        # iteration self.cards is growing shorter
-        while len(self.cards) > 0:
-            c = self.cards[-1]
-            c.Delete()
-            if c in self.cards:
-                self.cards.remove(c)
-
-        # raise the event; it differs from Card.DeleteEvent in that
-        # we raise only one event for every delete action
-        # e.g., if we delete five cards, there will be five Card.DeleteEvent's
-        # raised, but only one SelectionManager.DeleteEvent
+        # deleting the cards also unselects them
+        deck.DeleteCards(cards)
+
+        # raise the event, so that the Deck can clean up after us
         event = self.DeleteEvent(id=wx.ID_ANY, number=number)
         event.SetEventObject(self)
         self.GetEventHandler().ProcessEvent(event)
@@ -1049,8 +2099,31 @@ class SelectionManager(wx.Window):
         `dx: ` the amount of pixels to move in the X direction.
         `dy: ` the amount of pixels to move in the Y direction.
         """
-        for c in self.GetSelection():
-            self.GetParent().MoveCard(c, dx, dy)
+        self.GetParent().MoveCards(self.GetSelection(), dx, dy)
+
+    def QueueMove(self, dx, dy):
+        """Like `MoveSelected`, but waits `MOVE_COALESCE_MS` before moving, and
+        adds up all the moves requested in the meantime. Used for keyboard moves,
+        so that key auto-repeat doesn't pile up one move for every key event.
+
+        `dx: ` the amount of pixels to move in the X direction.
+        `dy: ` the amount of pixels to move in the Y direction.
+        """
+        self.pending_move = (self.pending_move[0] + dx, self.pending_move[1] + dy)
+        if not self.move_pending:
+            self.move_pending = True
+            wx.CallLater(self.MOVE_COALESCE_MS, self.FlushMove)
+
+    def FlushMove(self):
+        """Apply the moves accumulated by `QueueMove`."""
+        # we may have been destroyed while waiting
+        if not self: return
+
+        dx, dy = self.pending_move
+        self.pending_move = (0, 0)
+        self.move_pending = False
+        if dx or dy:
+            self.MoveSelected(dx, dy)
 
 
     ### callbacks
@@ -1082,13 +2155,13 @@ class SelectionManager(wx.Window):
         # alt + arrow: move selection
         if ev.AltDown():
             if   key == wx.WXK_LEFT:
-                self.MoveSelected(-bd.SCROLL_STEP, 0)
+                self.QueueMove(-bd.SCROLL_STEP, 0)
             elif key == wx.WXK_RIGHT:
-                self.MoveSelected(bd.SCROLL_STEP, 0)
+                self.QueueMove(bd.SCROLL_STEP, 0)
             elif key == wx.WXK_UP:
-                self.MoveSelected(0, -bd.SCROLL_STEP)
+                self.QueueMove(0, -bd.SCROLL_STEP)
             elif key == wx.WXK_DOWN:
-                self.MoveSelected(0, bd.SCROLL_STEP)
+                self.QueueMove(0, bd.SCROLL_STEP)
             else:
                 ev.Skip()
 
@@ -1099,9 +2172,7 @@ class SelectionManager(wx.Window):
                 cards = self.GetSelection()[:]
 
                 # for the same reason, don't iterate over self.GetSelection
-                for c in cards:
-                    if isinstance(c, card.Content):
-                        c.ToggleCollapse()
+                self.GetParent().ToggleCollapseCards(cards)
 
                 # restore selection
                 self.SelectGroup(card.CardGroup(members=cards), True)
@@ -0,0 +1,529 @@
+# -*- coding: utf-8 -*-
+"""
+Geometry helpers used to place and arrange `Card`s. They don't know
+anything about `wx` or `Card`s: they work on rects of the form
+`(x, y, width, height)`. `SpatialIndex` finds the rects near a region
+without looking at all of them, and `ReadingOrder` sorts them the
+way they are read. The layout functions take a list of rects
+and return the list of new `(x, y)` positions, in the same order, so that
+the `Deck` can apply them all in one go. The link functions compute the
+segments and arrow heads used to draw the links between `Card`s.
+"""
+
+from math import sqrt, ceil, hypot, cos, sin, pi
+
+
+FORCE_ITERATIONS = 20
+GOLDEN_ANGLE = pi * (3 - sqrt(5))
+
+
+######################
+# SpatialIndex Class
+######################
+
+class SpatialIndex(object):
+    """Stores rects in the cells of a uniform grid, so that finding the rects
+    that intersect a region only looks at the rects near that region, instead
+    of at all of them.
+    """
+
+    DEFAULT_CELL = 256
+
+    def __init__(self, cell=DEFAULT_CELL):
+        """Constructor.
+
+        * `cell: ` the side of the grid cells, in pixels.
+        """
+        self.cell = cell
+        self.cells = {}
+        self.rects = {}
+
+    def Insert(self, key, rect):
+        """Add a rect to the index.
+
+        * `key: ` any hashable object identifying the rect, eg a `Card`.
+        * `rect: ` a `(x, y, w, h)` tuple.
+        """
+        if key in self.rects:
+            self.Remove(key)
+        rect = tuple(rect)
+        self.rects[key] = rect
+        for c in self.GetCells(rect):
+            self.cells.setdefault(c, set()).add(key)
+
+    def Remove(self, key):
+        """Remove a rect from the index. Does nothing if `key` is not in it.
+
+        * `key: ` the object passed to `Insert`.
+        """
+        rect = self.rects.pop(key, None)
+        if rect is None: return
+        for c in self.GetCells(rect):
+            keys = self.cells.get(c)
+            if keys:
+                keys.discard(key)
+                if not keys: del self.cells[c]
+
+    def Update(self, key, rect):
+        """Change the rect stored for `key`.
+
+        * `key: ` the object passed to `Insert`.
+        * `rect: ` a `(x, y, w, h)` tuple.
+        """
+        if self.rects.get(key) != tuple(rect):
+            self.Insert(key, rect)
+
+    def Contains(self, key):
+        """Check if `key` is in the index.
+
+        `returns: ` `True` or `False`.
+        """
+        return key in self.rects
+
+    def GetRect(self, key):
+        """Get the rect stored for `key`.
+
+        `returns: ` a `(x, y, w, h)` tuple.
+        """
+        return self.rects[key]
+
+    def Query(self, rect):
+        """Find all the rects that intersect `rect`.
+
+        * `rect: ` a `(x, y, w, h)` tuple.
+
+        `returns: ` a `set` of keys.
+        """
+        x, y, w, h = rect
+        found = set()
+        for c in self.GetCells(rect):
+            for key in self.cells.get(c, ()):
+                if key in found: continue
+                r = self.rects[key]
+                if r[0] < x + w and x < r[0] + r[2] and r[1] < y + h and y < r[1] + r[3]:
+                    found.add(key)
+        return found
+
+    def GetCells(self, rect):
+        """Get the cells covered by `rect`.
+
+        * `rect: ` a `(x, y, w, h)` tuple.
+
+        `returns: ` a list of `(column, row)` tuples.
+        """
+        x, y, w, h = rect
+        c = self.cell
+        return [(i, j) for i in range(int(x // c), int((x + max(w, 1) - 1) // c) + 1)
+                       for j in range(int(y // c), int((y + max(h, 1) - 1) // c) + 1)]
+
+
+
+######################
+# ReadingOrder Class
+######################
+
+class ReadingOrder(object):
+    """Keeps rects sorted in reading order: by rows from top to bottom, and
+    from left to right inside every row. Rows are not fixed bands: a row
+    starts at its top-most rect, and every rect whose top falls within the
+    first `tolerance` of that rect's height belongs to the same row. Thus two
+    cards side by side are read left to right even if their tops differ a bit.
+    The order is computed again only when it's asked for after a change, so
+    that moving many rects doesn't sort everything many times.
+    """
+
+    DEFAULT_TOLERANCE = 0.5
+
+    def __init__(self, tolerance=DEFAULT_TOLERANCE):
+        """Constructor.
+
+        * `tolerance: ` the fraction of the height of the first rect in a row
+        within which other tops still belong to that row.
+        """
+        self.tolerance = tolerance
+        self.rects = {}
+        self.seqs = {}
+        self.count = 0
+        self.order = []
+        self.index = {}
+        self.dirty = False
+
+    def Insert(self, key, rect):
+        """Add a rect to the order.
+
+        * `key: ` any hashable object identifying the rect, eg a `Card`.
+        * `rect: ` a `(x, y, w, h)` tuple.
+        """
+        # the counter breaks ties, so that keys themselves are never compared
+        if key not in self.seqs:
+            self.count += 1
+            self.seqs[key] = self.count
+        self.rects[key] = tuple(rect)
+        self.dirty = True
+
+    def Remove(self, key):
+        """Remove a rect from the order. Does nothing if `key` is not in it.
+
+        * `key: ` the object passed to `Insert`.
+        """
+        if key not in self.rects: return
+        del self.rects[key]
+        del self.seqs[key]
+        self.dirty = True
+
+    def Update(self, key, rect):
+        """Change the rect stored for `key`. Does nothing if it didn't change.
+
+        * `key: ` the object passed to `Insert`.
+        * `rect: ` a `(x, y, w, h)` tuple.
+        """
+        if self.rects.get(key) != tuple(rect):
+            self.Insert(key, rect)
+
+    def Contains(self, key):
+        """Check if `key` is in the order.
+
+        `returns: ` `True` or `False`.
+        """
+        return key in self.rects
+
+    def GetIndex(self, key):
+        """Get the position of `key` in the order.
+
+        * `key: ` the object passed to `Insert`.
+
+        `returns: ` an `int`.
+        """
+        self.Sort()
+        return self.index[key]
+
+    def GetNext(self, key, step=1):
+        """Get the key that comes `step` places after `key`.
+
+        * `key: ` the object passed to `Insert`.
+        * `step: ` how many places to move. Use a negative number to go backwards.
+
+        `returns: ` a key, or None if there is none that far.
+        """
+        i = self.GetIndex(key) + step
+        if 0 <= i < len(self.order):
+            return self.order[i]
+        return None
+
+    def GetKeys(self, start=0, stop=None):
+        """Get the keys in reading order.
+
+        * `start: ` the index of the first key to return.
+        * `stop: ` the index after the last key to return. By default, the end.
+
+        `returns: ` a list of keys.
+        """
+        self.Sort()
+        return self.order[start:stop]
+
+    def GetRows(self):
+        """Split the rects into rows.
+
+        `returns: ` a list of rows from top to bottom, each a list of keys
+        in no particular order.
+        """
+        keys = sorted(self.rects, key=lambda k: (self.rects[k][1], self.rects[k][0], self.seqs[k]))
+        rows = []
+        limit = None
+        for k in keys:
+            x, y, w, h = self.rects[k]
+            if limit is None or y > limit:
+                rows.append([])
+                limit = y + h * self.tolerance
+            rows[-1].append(k)
+        return rows
+
+    def Sort(self):
+        """Compute the order again, if anything changed since the last time."""
+        if not self.dirty: return
+        self.order = []
+        for row in self.GetRows():
+            row.sort(key=lambda k: (self.rects[k][0], self.rects[k][1], self.seqs[k]))
+            self.order.extend(row)
+        self.index = dict([(k, i) for i, k in enumerate(self.order)])
+        self.dirty = False
+
+    def __len__(self):
+        """The number of keys in the order."""
+        return len(self.rects)
+
+
+
+######################
+# Layout functions
+######################
+
+def GridLayout(rects, origin, pad, cols=None):
+    """Places the rects in a grid, in the same order they are given. Every
+    cell of the grid is as big as the biggest rect.
+
+    * `rects: ` a list of `(x, y, w, h)` tuples.
+    * `origin: ` the `(x, y)` position of the top left cell.
+    * `pad: ` the space left between cells.
+    * `cols: ` the number of columns. By default, the grid is roughly square.
+
+    `returns: ` a list of `(x, y)` positions.
+    """
+    if not rects: return []
+    if not cols:
+        cols = int(ceil(sqrt(len(rects))))
+
+    cell_w = max([r[2] for r in rects]) + pad
+    cell_h = max([r[3] for r in rects]) + pad
+    left, top = origin
+
+    return [(int(left + (i % cols) * cell_w), int(top + (i // cols) * cell_h))
+            for i in range(len(rects))]
+
+def ShelfLayout(rects, origin, pad, width=None):
+    """Packs rects of different sizes in "shelves": rows that are filled from
+    left to right, tallest rects first, until they reach `width`. Every shelf
+    is as tall as its tallest rect.
+
+    * `rects: ` a list of `(x, y, w, h)` tuples.
+    * `origin: ` the `(x, y)` position of the top left corner.
+    * `pad: ` the space left between rects.
+    * `width: ` the maximum width of a shelf. By default, the result is roughly square.
+
+    `returns: ` a list of `(x, y)` positions.
+    """
+    if not rects: return []
+    if not width:
+        area = sum([(r[2] + pad) * (r[3] + pad) for r in rects])
+        width = max(sqrt(area), max([r[2] for r in rects]))
+
+    order = sorted(range(len(rects)), key=lambda i: rects[i][3], reverse=True)
+    left, top = origin
+    x, y = left, top
+    shelf_h = 0
+    pos = [None] * len(rects)
+
+    for i in order:
+        w, h = rects[i][2], rects[i][3]
+        # start a new shelf, unless this one is still empty
+        if x > left and x + w > left + width:
+            x = left
+            y += shelf_h + pad
+            shelf_h = 0
+        pos[i] = (int(x), int(y))
+        x += w + pad
+        shelf_h = max(shelf_h, h)
+
+    return pos
+
+def ForceLayout(rects, groups, origin, pad, iterations=FORCE_ITERATIONS):
+    """Arranges the rects so that members of the same group end up together,
+    while keeping the overall arrangement as close as possible to the current
+    one. Every group is first packed into a block (see `ShelfLayout`) centered
+    on the group's current center. Then the blocks, along with the ungrouped
+    rects, push each other apart for at most `iterations` steps. Any block that
+    still overlaps another one is then moved to the nearest free slot.
+
+    * `rects: ` a list of `(x, y, w, h)` tuples.
+    * `groups: ` a list of lists of indices into `rects`. A rect belongs only to the first group it appears in.
+    * `origin: ` the final `(x, y)` position of the top left corner of the layout.
+    * `pad: ` the minimum space left between rects.
+    * `iterations: ` the maximum number of separation steps.
+
+    `returns: ` a list of `(x, y)` positions.
+    """
+    if not rects: return []
+
+    # build the blocks: one per group, one per ungrouped rect
+    # every block is a list of (index, x offset, y offset)
+    taken = set()
+    blocks = []
+    for g in groups:
+        members = [i for i in g if i not in taken]
+        if not members: continue
+        taken.update(members)
+        offsets = ShelfLayout([rects[i] for i in members], (0, 0), pad)
+        blocks.append([(i, x, y) for i, (x, y) in zip(members, offsets)])
+    for i in range(len(rects)):
+        if i not in taken:
+            blocks.append([(i, 0, 0)])
+
+    # each block starts centered on its members' current center
+    xs, ys, ws, hs = [], [], [], []
+    for b in blocks:
+        w = max([x + rects[i][2] for i, x, y in b])
+        h = max([y + rects[i][3] for i, x, y in b])
+        cx = sum([rects[i][0] + rects[i][2] / 2.0 for i, x, y in b]) / len(b)
+        cy = sum([rects[i][1] + rects[i][3] / 2.0 for i, x, y in b]) / len(b)
+        xs.append(cx - w / 2.0)
+        ys.append(cy - h / 2.0)
+        ws.append(w)
+        hs.append(h)
+
+    # blocks that start on the same center would always be pushed the same
+    # way: fan them out on a spiral around that center first
+    n = len(blocks)
+    cell = sqrt(sum([(w + pad) * (h + pad) for w, h in zip(ws, hs)]) / n)
+    stacks = {}
+    for k in range(n):
+        key = (int(round(xs[k] + ws[k] / 2.0)), int(round(ys[k] + hs[k] / 2.0)))
+        stacks.setdefault(key, []).append(k)
+    for stack in stacks.values():
+        for m, k in enumerate(stack[1:], 1):
+            r = cell * sqrt(m / pi)
+            xs[k] += r * cos(m * GOLDEN_ANGLE)
+            ys[k] += r * sin(m * GOLDEN_ANGLE)
+
+    # if the blocks can't possibly fit in the current bounding box,
+    # spread them out from their common center first, so that
+    # separating them takes only a few steps
+    needed = sum([(w + pad) * (h + pad) for w, h in zip(ws, hs)])
+    left, top = min(xs), min(ys)
+    span_w = max([x + w for x, w in zip(xs, ws)]) - left
+    span_h = max([y + h for y, h in zip(ys, hs)]) - top
+    spread = sqrt(2.0 * needed / max(1.0, span_w * span_h))
+    if spread > 1.0:
+        cx, cy = left + span_w / 2.0, top + span_h / 2.0
+        xs = [cx + (x + w / 2.0 - cx) * spread - w / 2.0 for x, w in zip(xs, ws)]
+        ys = [cy + (y + h / 2.0 - cy) * spread - h / 2.0 for y, h in zip(ys, hs)]
+
+    # repulsion: push overlapping blocks apart along the shortest axis
+    # sweeping along the X axis, we only compare blocks that overlap in X
+    # every pass reads the positions as they were at its start, so the order stays valid
+    for step in range(iterations):
+        moves_x = [0.0] * n
+        moves_y = [0.0] * n
+        moved = False
+        order = sorted(range(n), key=lambda k: xs[k])
+        for a in range(n):
+            i = order[a]
+            right = xs[i] + ws[i] + pad
+            for b in range(a + 1, n):
+                j = order[b]
+                if xs[j] >= right: break
+                oy = min(ys[i] + hs[i], ys[j] + hs[j]) + pad - max(ys[i], ys[j])
+                if oy <= 0: continue
+                ox = min(xs[i] + ws[i], xs[j] + ws[j]) + pad - max(xs[i], xs[j])
+                if ox <= 0: continue
+
+                moved = True
+                dcx = (xs[j] + ws[j] / 2.0) - (xs[i] + ws[i] / 2.0)
+                dcy = (ys[j] + hs[j] / 2.0) - (ys[i] + hs[i] / 2.0)
+                if ox < oy:
+                    # on a tie, the one that comes later goes right
+                    d = ox / 2.0 if dcx > 0 or (dcx == 0 and i < j) else -ox / 2.0
+                    moves_x[i] -= d
+                    moves_x[j] += d
+                else:
+                    d = oy / 2.0 if dcy > 0 or (dcy == 0 and i < j) else -oy / 2.0
+                    moves_y[i] -= d
+                    moves_y[j] += d
+        if not moved:
+            break
+        xs = [x + m for x, m in zip(xs, moves_x)]
+        ys = [y + m for y, m in zip(ys, moves_y)]
+
+    # whatever still overlaps after the last step is moved to the nearest free
+    # slot, placing the blocks closest to the center first
+    cx = sum([x + w / 2.0 for x, w in zip(xs, ws)]) / n
+    cy = sum([y + h / 2.0 for y, h in zip(ys, hs)]) / n
+    index = SpatialIndex(max(1, int(cell)))
+    for k in sorted(range(n), key=lambda k: (xs[k] + ws[k] / 2.0 - cx) ** 2 + (ys[k] + hs[k] / 2.0 - cy) ** 2):
+        x, y = FindFreeSlot(index, (int(round(xs[k])), int(round(ys[k])), ws[k], hs[k]), pad)
+        xs[k], ys[k] = x, y
+        index.Insert(k, (x, y, ws[k], hs[k]))
+
+    # translate everything to the origin and unpack the blocks
+    dx = origin[0] - min(xs)
+    dy = origin[1] - min(ys)
+    pos = [None] * len(rects)
+    for k, b in enumerate(blocks):
+        for i, x, y in b:
+            pos[i] = (int(xs[k] + dx + x), int(ys[k] + dy + y))
+    return pos
+
+def FindFreeSlot(index, rect, pad, below=False):
+    """Finds the nearest place for `rect` that doesn't overlap any of the rects
+    in `index`, moving only to the right (or only downwards).
+
+    * `index: ` a `SpatialIndex`.
+    * `rect: ` a `(x, y, w, h)` tuple, the first place to try.
+    * `pad: ` the minimum space to leave between `rect` and the others.
+    * `below: ` if `True`, move downwards instead of to the right.
+
+    `returns: ` the `(x, y)` position of the free slot.
+    """
+    x, y, w, h = rect
+    while True:
+        hits = index.Query((x - pad, y - pad, w + 2 * pad, h + 2 * pad))
+        if not hits:
+            return (x, y)
+
+        # jump past every rect in the way
+        rects = [index.GetRect(k) for k in hits]
+        if below:
+            y = max([r[1] + r[3] for r in rects]) + pad
+        else:
+            x = max([r[0] + r[2] for r in rects]) + pad
+
+
+
+######################
+# Link functions
+######################
+
+def LinkSegment(src, dst):
+    """Finds the segment that joins the centers of two rects, cut where it
+    leaves them, so that it goes from the border of `src` to the border of `dst`.
+
+    * `src: ` a `(x, y, w, h)` tuple.
+    * `dst: ` a `(x, y, w, h)` tuple.
+
+    `returns: ` a `(x1, y1, x2, y2)` tuple.
+    """
+    cx1, cy1 = src[0] + src[2] / 2.0, src[1] + src[3] / 2.0
+    cx2, cy2 = dst[0] + dst[2] / 2.0, dst[1] + dst[3] / 2.0
+    dx, dy = cx2 - cx1, cy2 - cy1
+
+    def Exit(w, h):
+        # fraction of the way to the other center where we reach the border
+        t = 1.0
+        if dx: t = min(t, w / 2.0 / abs(dx))
+        if dy: t = min(t, h / 2.0 / abs(dy))
+        return t
+
+    t1 = Exit(src[2], src[3])
+    t2 = 1.0 - Exit(dst[2], dst[3])
+    return (int(round(cx1 + dx * t1)), int(round(cy1 + dy * t1)),
+            int(round(cx1 + dx * t2)), int(round(cy1 + dy * t2)))
+
+def ArrowHead(seg, size):
+    """Finds the triangle that points at the end of a segment.
+
+    * `seg: ` a `(x1, y1, x2, y2)` tuple.
+    * `size: ` the length of the arrow head.
+
+    `returns: ` a list of three `(x, y)` points, or an empty list if the segment has no length.
+    """
+    x1, y1, x2, y2 = seg
+    length = hypot(x2 - x1, y2 - y1)
+    if not length: return []
+
+    ux, uy = (x2 - x1) / length, (y2 - y1) / length
+    bx, by = x2 - ux * size, y2 - uy * size
+    half = size / 2.0
+    return [(x2, y2),
+            (int(round(bx - uy * half)), int(round(by + ux * half))),
+            (int(round(bx + uy * half)), int(round(by - ux * half)))]
+
+def SegmentRect(seg, pad=0):
+    """Finds the bounding rect of a segment.
+
+    * `seg: ` a `(x1, y1, x2, y2)` tuple.
+    * `pad: ` how much to grow the rect on every side.
+
+    `returns: ` a `(x, y, w, h)` tuple.
+    """
+    x1, y1, x2, y2 = seg
+    x, y = min(x1, x2) - pad, min(y1, y2) - pad
+    return (x, y, abs(x2 - x1) + 2 * pad + 1, abs(y2 - y1) + 2 * pad + 1)
@@ -93,22 +93,24 @@ class ThreePyFiveFrame(wx.Frame):
             return
                 
         # where are we searching?
-        cards = []
+        contents, headers = [], []
         content = self.GetCurrentBox().GetCurrentContent()
         if content == Deck:
-            cards = self.GetCurrentDeck().GetCards()
+            contents = self.GetCurrentDeck().IterContents()
+            headers = self.GetCurrentDeck().IterHeaders()
         elif content == CardView:
             cards = self.GetCurrentBox().view_card.GetCards()
+            contents = [c for c in cards if isinstance(c, Content)]
+            headers = [c for c in cards if isinstance(c, Header)]
 
         # gather all (lower case) values in which to search
         # including the control they appear in
         txt_ctrls = []
-        for c in cards:
-            if isinstance(c, Content):
-                txt_ctrls.append((c.GetTitle().lower(),   c.title))
-                txt_ctrls.append((c.GetContent().lower(), c.content))
-            if isinstance(c, Header):
-                txt_ctrls.append((c.GetHeader().lower(),  c.header))
+        for c in contents:
+            txt_ctrls.append((c.GetTitle().lower(),   c.title))
+            txt_ctrls.append((c.GetContent().lower(), c.content))
+        for c in headers:
+            txt_ctrls.append((c.GetHeader().lower(),  c.header))
 
         # do the actual searching
         finds = []
@@ -241,10 +243,15 @@ class ThreePyFiveFrame(wx.Frame):
 
         ## edit menu
         edit_menu = wx.Menu()
+        undo_it = wx.MenuItem(edit_menu, wx.ID_UNDO, "Undo")
+        redo_it = wx.MenuItem(edit_menu, wx.ID_REDO, "Redo")
         copy_it = wx.MenuItem(edit_menu, wx.ID_COPY, "Copy")
         past_it = wx.MenuItem(edit_menu, wx.ID_PASTE, "Paste")
         delt_it = wx.MenuItem(edit_menu, wx.ID_DELETE, "Delete")
 
+        edit_menu.AppendItem(undo_it)
+        edit_menu.AppendItem(redo_it)
+        edit_menu.AppendSeparator()
         edit_menu.AppendItem(copy_it)
         edit_menu.AppendItem(past_it)
         edit_menu.AppendItem(delt_it)
@@ -270,20 +277,33 @@ class ThreePyFiveFrame(wx.Frame):
         seln_it = wx.MenuItem(selection_menu, wx.ID_ANY, "Select None")
         harr_it = wx.MenuItem(selection_menu, wx.ID_ANY, "Arrange &Horizontally")
         varr_it = wx.MenuItem(selection_menu, wx.ID_ANY, "Arrange &Vertically")
+        garr_it = wx.MenuItem(selection_menu, wx.ID_ANY, "Arrange in G&rid")
+        sarr_it = wx.MenuItem(selection_menu, wx.ID_ANY, "Arrange &Packed")
+        farr_it = wx.MenuItem(selection_menu, wx.ID_ANY, "Arrange by Gr&oups")
         group_it = wx.MenuItem(selection_menu, wx.ID_ANY, "Group selection")
+        selg_it  = wx.MenuItem(selection_menu, wx.ID_ANY, "Select enclosing group")
+        link_it  = wx.MenuItem(selection_menu, wx.ID_ANY, "Link selection")
                 
         selection_menu.AppendItem(sela_it)
         selection_menu.AppendItem(selc_it)
         selection_menu.AppendItem(seln_it)
         selection_menu.AppendItem(harr_it)
         selection_menu.AppendItem(varr_it)
+        selection_menu.AppendItem(garr_it)
+        selection_menu.AppendItem(sarr_it)
+        selection_menu.AppendItem(farr_it)
         selection_menu.AppendSeparator()
         selection_menu.AppendItem(group_it)
+        selection_menu.AppendItem(selg_it)
+        selection_menu.AppendItem(link_it)
 
         ## view menu
         view_menu = wx.Menu()
         collp_it = wx.MenuItem(view_menu, wx.ID_ANY, "Toggle collapse")
         inspc_it = wx.MenuItem(view_menu, wx.ID_ANY, "View card")
+        readn_it = wx.MenuItem(view_menu, wx.ID_ANY, "Read next card")
+        readp_it = wx.MenuItem(view_menu, wx.ID_ANY, "Read previous card")
+        prsnt_it = wx.MenuItem(view_menu, wx.ID_ANY, "Present")
         tgmap_it = wx.MenuItem(view_menu, wx.ID_ANY, "Show map")
         zoomi_it = wx.MenuItem(view_menu, wx.ID_ANY, "Zoom in")
         zoomo_it = wx.MenuItem(view_menu, wx.ID_ANY, "Zoom out")
@@ -291,6 +311,9 @@ class ThreePyFiveFrame(wx.Frame):
 
         view_menu.AppendItem(collp_it)
         view_menu.AppendItem(inspc_it)
+        view_menu.AppendItem(readn_it)
+        view_menu.AppendItem(readp_it)
+        view_menu.AppendItem(prsnt_it)
         view_menu.AppendItem(tgmap_it)
         view_menu.AppendItem(zoomi_it)
         view_menu.AppendItem(zoomo_it)
@@ -312,6 +335,8 @@ class ThreePyFiveFrame(wx.Frame):
 
         ## bindings
         self.Bind(wx.EVT_MENU, self.OnQuit       , quit_it)
+        self.Bind(wx.EVT_MENU, self.OnUndo       , undo_it)
+        self.Bind(wx.EVT_MENU, self.OnRedo       , redo_it)
         self.Bind(wx.EVT_MENU, self.OnCopy       , copy_it)
         self.Bind(wx.EVT_MENU, self.OnPaste      , past_it)
         self.Bind(wx.EVT_MENU, self.OnDelete     , delt_it)
@@ -320,6 +345,8 @@ class ThreePyFiveFrame(wx.Frame):
         self.Bind(wx.EVT_MENU, self.OnSelectCurrent , selc_it)
         self.Bind(wx.EVT_MENU, self.OnSelectNone    , seln_it)
         self.Bind(wx.EVT_MENU, self.OnGroupSelection, group_it)
+        self.Bind(wx.EVT_MENU, self.OnSelectGroup   , selg_it)
+        self.Bind(wx.EVT_MENU, self.OnLinkSelection , link_it)
 
         self.Bind(wx.EVT_MENU, self.OnSave       , save_it)
         self.Bind(wx.EVT_MENU, self.OnOpen       , open_it)
@@ -331,6 +358,9 @@ class ThreePyFiveFrame(wx.Frame):
 
         self.Bind(wx.EVT_MENU, self.OnToggleCollapse  , collp_it)
         self.Bind(wx.EVT_MENU, self.OnMenuViewCard , inspc_it)
+        self.Bind(wx.EVT_MENU, self.OnReadNext     , readn_it)
+        self.Bind(wx.EVT_MENU, self.OnReadPrev     , readp_it)
+        self.Bind(wx.EVT_MENU, self.OnPresent      , prsnt_it)
         self.Bind(wx.EVT_MENU, self.OnToggleMinimap   , tgmap_it)
 
         self.Bind(wx.EVT_MENU, self.OnInsertContentRight , contr_it)
@@ -345,11 +375,16 @@ class ThreePyFiveFrame(wx.Frame):
 
         self.Bind(wx.EVT_MENU, self.OnHArrange   , harr_it)
         self.Bind(wx.EVT_MENU, self.OnVArrange   , varr_it)
+        self.Bind(wx.EVT_MENU, self.OnGridArrange   , garr_it)
+        self.Bind(wx.EVT_MENU, self.OnShelfArrange  , sarr_it)
+        self.Bind(wx.EVT_MENU, self.OnGroupsArrange , farr_it)
         self.Bind(wx.EVT_MENU, self.OnDebug      , debug_it)
         
         ## shortcuts
         accels = [] # will hold keyboard shortcuts aka accelerators
         
+        accels.append(wx.AcceleratorEntry(wx.ACCEL_CTRL, ord("Z"), undo_it.GetId()))
+        accels.append(wx.AcceleratorEntry(wx.ACCEL_CTRL, ord("Y"), redo_it.GetId()))
         accels.append(wx.AcceleratorEntry(wx.ACCEL_CTRL, ord("M"), tgmap_it.GetId()))
         accels.append(wx.AcceleratorEntry(wx.ACCEL_CTRL, ord("A"), sela_it.GetId()))
         accels.append(wx.AcceleratorEntry(wx.ACCEL_CTRL, ord("D"), debug_it.GetId()))
@@ -358,6 +393,9 @@ class ThreePyFiveFrame(wx.Frame):
         accels.append(wx.AcceleratorEntry(wx.ACCEL_CTRL, ord("+"), zoomo_it.GetId()))
 
         accels.append(wx.AcceleratorEntry(wx.ACCEL_CTRL, ord("F"), search_it.GetId()))
+        accels.append(wx.AcceleratorEntry(wx.ACCEL_NORMAL, wx.WXK_F6, readn_it.GetId()))
+        accels.append(wx.AcceleratorEntry(wx.ACCEL_SHIFT, wx.WXK_F6, readp_it.GetId()))
+        accels.append(wx.AcceleratorEntry(wx.ACCEL_NORMAL, wx.WXK_F5, prsnt_it.GetId()))
         accels.append(wx.AcceleratorEntry(wx.ACCEL_SHIFT|wx.ACCEL_CTRL , ord("G"), prev_it.GetId()))        
         
         # finish up        
@@ -538,6 +576,8 @@ class ThreePyFiveFrame(wx.Frame):
         """
         with open(path, 'r') as f: d = pickle.load(f)
         self.boxset.Load(d)
+        # forget the images of notebooks loaded before
+        Image.store.Prune()
         self.boxset.SetFocus()
                 
         
@@ -562,6 +602,14 @@ class ThreePyFiveFrame(wx.Frame):
         """Listens to `wx.EVT_MENU` from "Group selection" in the "selection" menu."""
         self.GetCurrentDeck().GroupSelected()
 
+    def OnSelectGroup(self, ev):
+        """Listens to `wx.EVT_MENU` from "Select enclosing group" in the "selection" menu."""
+        self.GetCurrentDeck().SelectEnclosingGroup()
+
+    def OnLinkSelection(self, ev):
+        """Listens to `wx.EVT_MENU` from "Link selection" in the "selection" menu."""
+        self.GetCurrentDeck().LinkSelected()
+
     def OnToggleMinimap(self, ev):
         """Listens to `wx.EVT_MENU` from "Show map" in the "view" menu."""
         self.GetCurrentBox().ToggleMinimap()
@@ -569,8 +617,8 @@ class ThreePyFiveFrame(wx.Frame):
     def OnToggleCollapse(self, ev):
         """Listens to `wx.EVT_MENU` from "Toggle collapse" in the "view" menu and to
         "Toggle collapse" tool in the tool bar.."""
-        for c in [t for t in self.GetCurrentDeck().GetSelection() if isinstance(t, Content)]:
-            c.ToggleCollapse()
+        deck = self.GetCurrentDeck()
+        deck.ToggleCollapseCards(deck.GetSelection()[:])
 
     def OnViewBoxBar(self, ev):
         """Listens to `wx.EVT_MENU` from "Show Box button bar" in the "view" menu."""
@@ -596,6 +644,22 @@ class ThreePyFiveFrame(wx.Frame):
             pg.CancelView()
             self.Log("Done viewing.")
 
+    def OnReadNext(self, ev):
+        """Listens to `wx.EVT_MENU` from "Read next card" in the "view" menu."""
+        self.GetCurrentBox().ReadNext(1)
+
+    def OnReadPrev(self, ev):
+        """Listens to `wx.EVT_MENU` from "Read previous card" in the "view" menu."""
+        self.GetCurrentBox().ReadNext(-1)
+
+    def OnPresent(self, ev):
+        """Listens to `wx.EVT_MENU` from "Present" in the "view" menu."""
+        pg = self.GetCurrentBox()
+        if pg.GetCurrentContent() == PresentationView:
+            pg.StopPresentation()
+        else:
+            pg.Present()
+
     def OnView(self, ev):
         """Listens to `Box.EVT_VIEW` from every `Box` in the `BoxSet`."""
         if ev.number == 1:
@@ -610,9 +674,7 @@ class ThreePyFiveFrame(wx.Frame):
     def OnSelectAll(self, ev):
         """Listens to `wx.EVT_MENU` from "Select All" in the "selection" menu."""
         deck = self.GetCurrentDeck()
-        deck.UnselectAll()
-        for c in deck.GetCards():
-            deck.SelectCard(c)
+        deck.SelectMany(deck.GetCards(), new_sel=True)
 
     def OnSelectCurrent(self, ev):
         """Listens to `wx.EVT_MENU` from "Select Current" in the "selection" menu."""
@@ -644,6 +706,9 @@ class ThreePyFiveFrame(wx.Frame):
             content = pg.GetCurrentContent()
             if content and content == CardView:
                 return
+            if content and content == PresentationView:
+                pg.StopPresentation()
+                return
 
         # if on deck: cycle selection
         # none (cursor inside a card) -> card -> group -> box title label -> none (cursor inside the same card)
@@ -700,6 +765,42 @@ class ThreePyFiveFrame(wx.Frame):
         self.GetCurrentDeck().ArrangeSelection(Deck.VERTICAL)
         self.Log("Vertical arrange.")
 
+    def Arrange(self, orient):
+        """Arranges the current selection or, if nothing is selected, the whole `Deck`.
+
+        * `orient: ` one of `Deck.GRID`, `Deck.SHELF` or `Deck.GROUPED`.
+        """
+        bd = self.GetCurrentDeck()
+        if bd.GetSelection():
+            bd.ArrangeSelection(orient)
+        else:
+            bd.ArrangeAll(orient)
+
+    def OnGridArrange(self, ev):
+        """Listens to `wx.EVT_MENU` from "Arrange in Grid" in the "selection" menu."""
+        self.Arrange(Deck.GRID)
+        self.Log("Grid arrange.")
+
+    def OnShelfArrange(self, ev):
+        """Listens to `wx.EVT_MENU` from "Arrange Packed" in the "selection" menu."""
+        self.Arrange(Deck.SHELF)
+        self.Log("Packed arrange.")
+
+    def OnGroupsArrange(self, ev):
+        """Listens to `wx.EVT_MENU` from "Arrange by Groups" in the "selection" menu."""
+        self.Arrange(Deck.GROUPED)
+        self.Log("Arrange by groups.")
+
+    def OnUndo(self, ev):
+        """Listens to `wx.EVT_MENU` from "Undo" in the "edit" menu."""
+        self.GetCurrentBox().Undo()
+        self.Log("Undo.")
+
+    def OnRedo(self, ev):
+        """Listens to `wx.EVT_MENU` from "Redo" in the "edit" menu."""
+        self.GetCurrentBox().Redo()
+        self.Log("Redo.")
+
     def OnCopy(self, ev):
         """Listens to `wx.EVT_MENU` from "Copy" in the "selection" menu and to
         `wx.EVT_TOOL` from "Copy" in the toolbar.
@@ -725,6 +826,7 @@ class ThreePyFiveFrame(wx.Frame):
     def AfterDelete(self, ev):
         """Listens to `Deck.EVT_DEL_CARD`."""
         self.Log("Delete " + str(ev.number) + " Cards.")
+        ev.Skip()
 
     def OnCtrlF(self, ev):
         """Listens to CTRL+F."""
@@ -776,7 +878,11 @@ class ThreePyFiveFrame(wx.Frame):
 
     def AfterCardCreated(self, ev):
         """Listens to `Deck.EVT_NEW_CARD` from the `Deck` of every `Box`."""
-        self.Log("Created new " + ev.subclass + " card.")
+        if ev.number == 1:
+            self.Log("Created new " + ev.subclass + " card.")
+        else:
+            self.Log("Created " + str(ev.number) + " cards.")
+        ev.Skip()
 
     def OnNew(self, ev):
         """Listens to `wx.EVT_TOOL` from "New" in the toolbar."""
@@ -0,0 +1,471 @@
+# -*- coding: utf-8 -*-
+"""
+Undo and redo. Every action the user can take back is recorded as a
+`Command` that holds only what is needed to revert it and apply it again,
+instead of a copy of the whole `Deck` or `Canvas`. Commands are kept in an
+`UndoStack`, which forgets the oldest ones when they take too much memory.
+`Card`s are always referred to by their label, since undoing a delete
+creates a new `Card` object with the same label.
+"""
+
+import json
+import time
+from collections import deque
+
+
+######################
+# UndoStack Class
+######################
+
+class UndoStack(object):
+    """Holds the `Command`s that can be undone and redone. When the
+    commands held take more than `limit` bytes, the oldest ones are
+    forgotten.
+    """
+
+    DEFAULT_LIMIT = 4 * 1024 * 1024
+
+    def __init__(self, limit=DEFAULT_LIMIT):
+        """Constructor.
+
+        * `limit: ` the approximate maximum memory, in bytes, used by the commands.
+        """
+        self.limit = limit
+        self.undo = deque()
+        self.redo = []
+        self.size = 0
+        self.applying = False
+
+    def Push(self, cmd):
+        """Record a `Command` that was just done. Discards all redos.
+        Does nothing while undoing or redoing, so that the methods called
+        by a `Command` don't record themselves again.
+
+        * `cmd: ` a `Command`.
+        """
+        if self.applying: return
+        self.redo = []
+
+        # consecutive commands of the same kind may be merged into one
+        if self.undo and self.undo[-1].Merge(cmd):
+            return
+
+        self.undo.append(cmd)
+        self.size += cmd.GetSize()
+        self.Evict()
+
+    def Undo(self):
+        """Revert the last `Command`.
+
+        `returns: ` `True` if there was something to undo.
+        """
+        if not self.undo: return False
+        cmd = self.undo.pop()
+        self.size -= cmd.GetSize()
+        self.Apply(cmd.Undo)
+        self.redo.append(cmd)
+        return True
+
+    def Redo(self):
+        """Do again the last undone `Command`.
+
+        `returns: ` `True` if there was something to redo.
+        """
+        if not self.redo: return False
+        cmd = self.redo.pop()
+        self.Apply(cmd.Redo)
+        self.undo.append(cmd)
+        self.size += cmd.GetSize()
+        self.Evict()
+        return True
+
+    def CanUndo(self):
+        """Check if there is something to undo.
+
+        `returns: ` `True` or `False`.
+        """
+        return len(self.undo) > 0
+
+    def CanRedo(self):
+        """Check if there is something to redo.
+
+        `returns: ` `True` or `False`.
+        """
+        return len(self.redo) > 0
+
+    def Clear(self):
+        """Forget all `Command`s."""
+        self.undo.clear()
+        self.redo = []
+        self.size = 0
+
+    def SetLimit(self, limit):
+        """Set the approximate maximum memory used by the commands.
+
+        * `limit: ` in bytes.
+        """
+        self.limit = limit
+        self.Evict()
+
+    def GetLimit(self):
+        """Get the approximate maximum memory used by the commands.
+
+        `returns: ` an `int`, in bytes.
+        """
+        return self.limit
+
+
+    ### Auxiliary functions
+
+    def Apply(self, func):
+        """Call one of a `Command`'s methods without recording anything."""
+        self.applying = True
+        try:
+            func()
+        finally:
+            self.applying = False
+
+    def Evict(self):
+        """Forget the oldest `Command`s until we're under the limit. The last one is always kept."""
+        while self.size > self.limit and len(self.undo) > 1:
+            self.size -= self.undo.popleft().GetSize()
+
+
+
+######################
+# Command Classes
+######################
+
+class Command(object):
+    """An action that can be undone and redone. Must override `Undo` and `Redo`."""
+
+    def Undo(self):
+        """Revert this action."""
+        pass
+
+    def Redo(self):
+        """Apply this action again."""
+        pass
+
+    def Merge(self, cmd):
+        """Try to absorb the `Command` done right after this one.
+
+        * `cmd: ` a `Command`.
+
+        `returns: ` `True` if `cmd` was merged into this one.
+        """
+        return False
+
+    def GetSize(self):
+        """Get the approximate memory used by this `Command`.
+
+        `returns: ` an `int`, in bytes.
+        """
+        return 64
+
+
+class CreateCards(Command):
+    """The creation of one or more `Card`s, and of the groups and links
+    between them, eg, when pasting."""
+
+    def __init__(self, deck, data, groups=[], links=[]):
+        """Constructor.
+
+        * `deck: ` the `Deck`.
+        * `data: ` a list of `dict`s, as returned by `Deck.DumpCard`.
+        * `groups: ` a list of `(label, members)` tuples, for the `CardGroup`s
+        created along with the `Card`s, where members is a list of `Card` labels.
+        * `links: ` a list of `(src, dst)` tuples of `Card` labels.
+        """
+        self.deck = deck
+        self.data = data
+        self.groups = groups
+        self.links = links
+        self.size = len(json.dumps(data)) + len(json.dumps(groups)) + len(json.dumps(links))
+
+    def Undo(self):
+        """Delete the `Card`s and their groups again."""
+        for label, members in self.groups:
+            g = self.deck.GetGroup(label)
+            if g: self.deck.DeleteGroup(g)
+        cards = [self.deck.GetCard(d["label"]) for d in self.data]
+        self.deck.DeleteCards([c for c in cards if c])
+
+    def Redo(self):
+        """Create the `Card`s again, with the same labels, and their groups and links."""
+        self.deck.RestoreCards(self.data)
+        for label, members in self.groups:
+            cards = [self.deck.GetCard(l) for l in members]
+            self.deck.NewGroup([c for c in cards if c], label=label)
+        for src, dst in self.links:
+            src, dst = self.deck.GetCard(src), self.deck.GetCard(dst)
+            if src and dst: self.deck.AddLink(src, dst)
+
+    def GetSize(self):
+        """See `Command.GetSize`."""
+        return self.size
+
+
+class DeleteCards(Command):
+    """The deletion of one or more `Card`s. Also remembers the
+    `CardGroup`s they belonged to and their links."""
+
+    def __init__(self, deck, cards):
+        """Constructor. Call before deleting.
+
+        * `deck: ` the `Deck`.
+        * `cards: ` a list of `Card`s about to be deleted.
+        """
+        self.deck = deck
+        self.data = [deck.DumpCard(c) for c in cards]
+        self.groups = [[g.GetLabel() for g in deck.GetContainingGroups(c)] for c in cards]
+        links = set()
+        for c in cards:
+            links.update([(c, dst) for dst in deck.GetLinks(c)])
+            links.update([(src, c) for src in deck.GetBacklinks(c)])
+        self.links = [(src.GetLabel(), dst.GetLabel()) for src, dst in links]
+        self.size = (len(json.dumps(self.data)) + 8 * sum([len(g) for g in self.groups])
+                     + 16 * len(self.links))
+
+    def Undo(self):
+        """Create the `Card`s again, and put them back in their groups and links."""
+        restored = self.deck.RestoreCards(self.data)
+        for new, groups in zip(restored, self.groups):
+            for l in groups:
+                g = self.deck.GetGroup(l)
+                if g: self.deck.AddToGroup(g, new)
+
+        # only now that all of them exist can we link them to each other
+        for src, dst in self.links:
+            src, dst = self.deck.GetCard(src), self.deck.GetCard(dst)
+            if src and dst: self.deck.AddLink(src, dst)
+
+    def Redo(self):
+        """Delete the `Card`s again."""
+        cards = [self.deck.GetCard(d["label"]) for d in self.data]
+        self.deck.DeleteCards([c for c in cards if c])
+
+    def GetSize(self):
+        """See `Command.GetSize`."""
+        return self.size
+
+
+class MoveCards(Command):
+    """The movement of one or more `Card`s."""
+
+    MERGE_SECONDS = 1.0
+
+    def __init__(self, deck, moves):
+        """Constructor.
+
+        * `deck: ` the `Deck`.
+        * `moves: ` a list of `(label, dx, dy)` tuples, with the offsets at a scale of 1.0.
+        """
+        self.deck = deck
+        self.moves = moves
+        self.time = time.time()
+
+    def Undo(self):
+        """Move the `Card`s back."""
+        self.deck.MoveCardsBy([(l, -dx, -dy) for l, dx, dy in self.moves])
+
+    def Redo(self):
+        """Move the `Card`s again."""
+        self.deck.MoveCardsBy(self.moves)
+
+    def Merge(self, cmd):
+        """Moves of the same `Card`s less than `MERGE_SECONDS` apart become one,
+        eg, when holding down a key."""
+        if not isinstance(cmd, MoveCards) or cmd.deck != self.deck: return False
+        if cmd.time - self.time > self.MERGE_SECONDS: return False
+        if [m[0] for m in cmd.moves] != [m[0] for m in self.moves]: return False
+        self.moves = [(l, dx1 + dx2, dy1 + dy2) for (l, dx1, dy1), (_, dx2, dy2)
+                      in zip(self.moves, cmd.moves)]
+        self.time = cmd.time
+        return True
+
+    def GetSize(self):
+        """See `Command.GetSize`."""
+        return 32 * len(self.moves)
+
+
+class ResizeCard(Command):
+    """The resizing of a `Card` by dragging its border."""
+
+    def __init__(self, deck, label, old, new):
+        """Constructor.
+
+        * `deck: ` the `Deck`.
+        * `label: ` the label of the `Card`.
+        * `old: ` the previous `(width, height)`, at a scale of 1.0.
+        * `new: ` the current `(width, height)`, at a scale of 1.0.
+        """
+        self.deck = deck
+        self.label = label
+        self.old = old
+        self.new = new
+
+    def Undo(self):
+        """Restore the previous size."""
+        self.deck.ResizeCard(self.label, self.old)
+
+    def Redo(self):
+        """Set the new size again."""
+        self.deck.ResizeCard(self.label, self.new)
+
+
+class CollapseCards(Command):
+    """Collapsing or uncollapsing many `Content`s at once."""
+
+    def __init__(self, deck, changes):
+        """Constructor.
+
+        * `deck: ` the `Deck`.
+        * `changes: ` a list of `(label, collapsed)` tuples, with the state of each `Content` before the change.
+        """
+        self.deck = deck
+        self.changes = changes
+
+    def Undo(self):
+        """Restore the previous states."""
+        self.deck.CollapseCards([self.deck.GetCard(l) for l, old in self.changes if self.deck.GetCard(l)],
+                                self.GetState(True))
+
+    def Redo(self):
+        """Set the new states again."""
+        self.deck.CollapseCards([self.deck.GetCard(l) for l, old in self.changes if self.deck.GetCard(l)],
+                                self.GetState(False))
+
+    def GetState(self, before):
+        """Get a function telling whether a `Content` should be collapsed, for `Deck.CollapseCards`.
+
+        * `before: ` if `True`, the state before the change. Otherwise, after it.
+
+        `returns: ` a function.
+        """
+        states = dict([(l, old if before else not old) for l, old in self.changes])
+        return lambda c: states[c.GetLabel()]
+
+    def GetSize(self):
+        """See `Command.GetSize`."""
+        return 64 + 16 * len(self.changes)
+
+
+class EditCard(Command):
+    """A change in the data of a `Card`: text, kind, rating, collapsed state, image."""
+
+    def __init__(self, deck, label, old, new):
+        """Constructor.
+
+        * `deck: ` the `Deck`.
+        * `label: ` the label of the `Card`.
+        * `old: ` a `dict` with only the fields that changed, and their previous values.
+        * `new: ` a `dict` with the same fields, and their current values.
+        """
+        self.deck = deck
+        self.label = label
+        self.old = old
+        self.new = new
+        self.size = len(json.dumps(old)) + len(json.dumps(new))
+
+    def Undo(self):
+        """Restore the previous values."""
+        crd = self.deck.GetCard(self.label)
+        if crd: crd.Load(self.old)
+
+    def Redo(self):
+        """Set the new values again."""
+        crd = self.deck.GetCard(self.label)
+        if crd: crd.Load(self.new)
+
+    def GetSize(self):
+        """See `Command.GetSize`."""
+        return self.size
+
+
+class NewGroup(Command):
+    """The creation of a `CardGroup`, along with its nesting."""
+
+    def __init__(self, deck, group):
+        """Constructor.
+
+        * `deck: ` the `Deck`.
+        * `group: ` the new `CardGroup`.
+        """
+        self.deck = deck
+        self.label = group.GetLabel()
+        self.members = [c.GetLabel() for c in group.GetMembers()]
+        self.parent = group.GetParent().GetLabel() if group.GetParent() else None
+        self.children = [g.GetLabel() for g in group.GetChildren()]
+
+    def Undo(self):
+        """Delete the `CardGroup`."""
+        g = self.deck.GetGroup(self.label)
+        if g: self.deck.DeleteGroup(g)
+
+    def Redo(self):
+        """Create the `CardGroup` again, with the same label."""
+        cards = [self.deck.GetCard(l) for l in self.members]
+        parent = self.deck.GetGroup(self.parent) if self.parent is not None else None
+        group = self.deck.NewGroup([c for c in cards if c], label=self.label, parent=parent)
+        for l in self.children:
+            ch = self.deck.GetGroup(l)
+            if ch: ch.SetParent(group)
+
+    def GetSize(self):
+        """See `Command.GetSize`."""
+        return 64 + 8 * (len(self.members) + len(self.children))
+
+
+class LinkCards(Command):
+    """The creation of links between `Card`s."""
+
+    def __init__(self, deck, pairs):
+        """Constructor.
+
+        * `deck: ` the `Deck`.
+        * `pairs: ` a list of `(src, dst)` tuples of `Card` labels.
+        """
+        self.deck = deck
+        self.pairs = pairs
+
+    def Undo(self):
+        """Remove the links."""
+        for src, dst in self.pairs:
+            src, dst = self.deck.GetCard(src), self.deck.GetCard(dst)
+            if src and dst: self.deck.RemoveLink(src, dst)
+
+    def Redo(self):
+        """Add the links again."""
+        for src, dst in self.pairs:
+            src, dst = self.deck.GetCard(src), self.deck.GetCard(dst)
+            if src and dst: self.deck.AddLink(src, dst)
+
+    def GetSize(self):
+        """See `Command.GetSize`."""
+        return 64 + 16 * len(self.pairs)
+
+
+class AddStroke(Command):
+    """A stroke drawn on a `Canvas`."""
+
+    def __init__(self, canvas):
+        """Constructor. Call right after the stroke was stored.
+
+        * `canvas: ` the `CanvasBase`.
+        """
+        self.canvas = canvas
+        style, self.points = canvas.strokes[-1]
+        self.colour, self.thickness = canvas.styles[style]
+
+    def Undo(self):
+        """Erase the stroke."""
+        self.canvas.PopStroke()
+
+    def Redo(self):
+        """Draw the stroke again."""
+        self.canvas.AddStroke(self.colour, self.thickness, self.points)
+
+    def GetSize(self):
+        """See `Command.GetSize`."""
+        return 64 + self.points.itemsize * len(self.points)
@@ -378,6 +378,35 @@ def MakeEncirclingRect(p1, p2):
     h = abs(p1[1] - p2[1])
     return wx.Rect(l, t, w, h)
 
+def UnionRects(rects):
+    """Returns the smallest rectangle that contains all of `rects`.
+
+    * `rects: ` a non-empty list of `(x, y, w, h)` tuples or `wx.Rect`s.
+
+    `returns: ` a `(x, y, w, h)` tuple.
+    """
+    left = min([r[0] for r in rects])
+    top = min([r[1] for r in rects])
+    right = max([r[0] + r[2] for r in rects])
+    bottom = max([r[1] + r[3] for r in rects])
+    return (left, top, right - left, bottom - top)
+
+def TouchCache(cache, key, limit):
+    """Mark an entry of a cache as the most recently used one, and forget
+    the least recently used entries when there are more than `limit`.
+
+    * `cache: ` an `OrderedDict`, whose order is the order of use.
+    * `key: ` a key in `cache`.
+    * `limit: ` the maximum number of entries.
+
+    `returns: ` the list of keys that were forgotten.
+    """
+    cache[key] = cache.pop(key)
+    dropped = []
+    while len(cache) > limit:
+        dropped.append(cache.popitem(last=False)[0])
+    return dropped
+
 def isnumber(s):
     """Return True of the argument is a string representing a number.
     
@@ -411,6 +440,57 @@ def dist(p1, p2):
     """
     return float(sqrt(dist2(p1, p2)))
 
+def SimplifyPolyline(points, tolerance):
+    """Simplify a polyline with the Ramer-Douglas-Peucker algorithm: drop
+    every point that is closer than `tolerance` to the line that the points
+    kept around it would draw instead.
+
+    * `points: ` a flat sequence of the form [x1, y1, x2, y2, ...].
+    * `tolerance: ` the maximum distance, in pixels, between the original
+    polyline and the simplified one.
+
+    `returns: ` a flat `list` of the form [x1, y1, x2, y2, ...]. The first
+    and last points are always kept.
+    """
+    n = len(points) / 2
+    if n < 3: return list(points)
+
+    tol2 = tolerance * tolerance
+    keep = [False] * n
+    keep[0] = keep[n-1] = True
+
+    # explicit stack instead of recursion: strokes can be very long
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        x1, y1 = points[2*first], points[2*first+1]
+        dx, dy = points[2*last] - x1, points[2*last+1] - y1
+        norm2 = float(dx * dx + dy * dy)
+
+        # find the point farthest from the segment first-last
+        far, far_d2 = -1, tol2
+        for i in xrange(first + 1, last):
+            px, py = points[2*i] - x1, points[2*i+1] - y1
+            if norm2:
+                cross = px * dy - py * dx
+                d2 = cross * cross / norm2
+            else:
+                d2 = px * px + py * py
+            if d2 > far_d2:
+                far, far_d2 = i, d2
+
+        if far >= 0:
+            keep[far] = True
+            stack.append((first, far))
+            stack.append((far, last))
+
+    result = []
+    for i in xrange(n):
+        if keep[i]:
+            result.append(points[2*i])
+            result.append(points[2*i+1])
+    return result
+
 def IsFunctionKey(key):
     """Check if `key` is a function key.
 
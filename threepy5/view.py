@@ -6,8 +6,11 @@
 import wx
 import re
 import card
+import layout
 from deck import Deck
+from card import Card, Content
 import utilities
+import wx.lib.newevent as ne
 
 
 ######################
@@ -15,11 +18,17 @@ import utilities
 ######################
 
 class DeckView(utilities.AutoSize):
-    """Displays a "minimap" of the current `Deck`. Uses `MiniCard` to represent a `Card` on the `Deck`."""
+    """Displays a "minimap" of the current `Deck`. All the `Card`s are drawn as
+    coloured rectangles over a single cached bitmap, which is only redrawn
+    where `Card`s change. The part of the `Deck` currently in view is drawn
+    as a rectangle on top of it.
+    """
 
     DEFAULT_FACTOR  = 5
     BACKGROUND_CL   = (255, 255, 255, 255)
     DEFAULT_MINI_CL = (220, 218, 213, 255)
+    VIEWPORT_CL     = (0, 0, 0, 255)
+    SCROLL_MS       = 16
     
     def __init__(self, parent, deck=None, pos=wx.DefaultPosition, size=wx.DefaultSize):
         """Constructor.
@@ -33,28 +42,40 @@ class DeckView(utilities.AutoSize):
 
         # members        
         self.factor = DeckView.DEFAULT_FACTOR
-        self.cards = {}
+        self.colours = {}
+        self.index = layout.SpatialIndex(layout.SpatialIndex.DEFAULT_CELL / self.factor)
+        self.buffer = wx.EmptyBitmap(1, 1)
+        self.viewport = wx.Rect(0, 0, 0, 0)
+        self.scroll_target = None
         self.SetBackgroundColour(self.BACKGROUND_CL)
         self.SetDeck(deck)
 
         # bindings
         self.Bind(wx.EVT_SHOW, self.OnShow)
+        self.Bind(wx.EVT_PAINT, self.OnPaint)
+        self.Bind(wx.EVT_ERASE_BACKGROUND, self.OnEraseBackground)
+        self.Bind(wx.EVT_LEFT_DOWN, self.OnLeftDown)
+        self.Bind(wx.EVT_MOTION, self.OnMotion)
+        self.Bind(wx.EVT_LEFT_UP, self.OnLeftUp)
+        self.Bind(wx.EVT_MOUSE_CAPTURE_LOST, self.OnCaptureLost)
 
 
     ## Behavior functions
 
     def Clear(self):
-        """Delete all `MiniCard`s from this view."""
-        self.cards = {}
+        """Forget all `Card`s."""
+        self.colours = {}
+        self.index = layout.SpatialIndex(self.index.cell)
 
     def SetDeck(self, deck):
         """Sets the `Deck` we are going to view.
         
         * `deck: ` a `Deck`.
         """
+        self.deck = deck
         self.Clear()
         for c in deck.GetCards():
-            self.AddCard(c)
+            self.AddCard(c, draw=False)
 
         # set size, fixed for scale/zoom
         sz = [i / self.factor for i in deck.GetSize()]
@@ -62,38 +83,173 @@ class DeckView(utilities.AutoSize):
         self.UpdateContentSize(deck.content_sz)
 
         step = deck.GetScrollPixelsPerUnit()
-        self.SetScrollRate(step[0] / self.factor, step[1] / self.factor)
+        self.SetScrollRate(max(1, step[0] / self.factor), max(1, step[1] / self.factor))
 
         deck.Bind(Deck.EVT_NEW_CARD, self.OnNewCard)
+        deck.Bind(Deck.EVT_CARD_GEOMETRY, self.OnCardGeometry)
+        deck.Bind(Deck.EVT_DEL_CARD, self.OnDeleteCards)
         deck.Bind(wx.EVT_SIZE, self.OnDeckSize)
         deck.Bind(wx.EVT_SCROLLWIN, self.OnDeckScroll)
-        
-        self.deck = deck
+
+        self.RedrawAll()
     
-    def AddCard(self, card):
-        """Adds a new `MiniCard`."""
-        r = wx.Rect(*[i / self.factor for i in card.GetRect()])
-        mini = MiniCard(self, pos=(r.left, r.top), size=(r.width, r.height))
+    def AddCard(self, card, draw=True):
+        """Adds a new `Card` to the minimap.
 
-        if isinstance(card, Content):
-            mini.SetBackgroundColour(card.GetBackgroundColour())
-        else:
-            mini.SetBackgroundColour(self.DEFAULT_MINI_CL)
+        * `card: ` a `Card` on the `Deck`.
+        * `draw: ` if `False`, don't draw it yet.
+        """
+        self.index.Insert(card, self.ScaleRect(self.deck.GetAbsoluteRect(card)))
+        self.colours[card] = self.GetCardColour(card)
 
-        card.Bind(Card.EVT_DELETE, self.OnDeleteCard)
         if isinstance(card, Content):
             card.Bind(Content.EVT_CONT_KIND, self.OnContentKind)
 
-        # retain a reference to the original, for deleting
-        self.cards[card] = mini
+        if draw:
+            self.RedrawRect(self.index.GetRect(card))
+
+    def AddCards(self, cards):
+        """Adds many new `Card`s to the minimap, and redraws once.
+
+        * `cards: ` a list of `Card`s on the `Deck`.
+        """
+        for c in cards:
+            self.AddCard(c, draw=False)
+        if cards:
+            self.RedrawRect(utilities.UnionRects([self.index.GetRect(c) for c in cards]))
+
+    def RemoveCards(self, cards):
+        """Removes many `Card`s from the minimap, and redraws once.
+
+        * `cards: ` a list of `Card`s.
+        """
+        rects = []
+        for c in cards:
+            if self.index.Contains(c):
+                rects.append(self.index.GetRect(c))
+                self.index.Remove(c)
+                del self.colours[c]
+        if rects:
+            self.RedrawRect(utilities.UnionRects(rects))
+
+    def MoveCard(self, card, rect):
+        """Updates the rectangle of a `Card` that was moved or resized.
+
+        * `card: ` a `Card` on the `Deck`.
+        * `rect: ` its new rect, in `Deck` coordinates. See `Deck.GetAbsoluteRect`.
+        """
+        if not self.index.Contains(card): return
+        old = self.index.GetRect(card)
+        new = self.ScaleRect(rect)
+        if old != new:
+            self.index.Update(card, new)
+            self.RedrawRect(old)
+            self.RedrawRect(new)
 
-    def RemoveCard(self, card):
-        """Remove a `MiniCard`."""
-        if card in self.cards.keys():
-            mini = self.cards[card]
-            mini.Hide()
-            mini.Destroy()
-            del self.cards[card]
+    def GetCardColour(self, card):
+        """Get the colour a `Card` is drawn with.
+
+        * `card: ` a `Card`.
+
+        `returns: ` a `wx.Colour` or a colour tuple.
+        """
+        if isinstance(card, Content):
+            return card.GetBackgroundColour()
+        else:
+            return self.DEFAULT_MINI_CL
+
+    def ScaleRect(self, rect):
+        """Converts a rect from `Deck` coordinates to minimap coordinates.
+
+        * `rect: ` a `(x, y, w, h)` tuple.
+
+        `returns: ` a `(x, y, w, h)` tuple.
+        """
+        return tuple([int(i / self.factor) for i in rect])
+
+    def RedrawAll(self):
+        """Redraws the whole cached bitmap. Only necessary when it has to grow."""
+        w, h = self.GetVirtualSize()
+        self.buffer = wx.EmptyBitmap(max(1, w), max(1, h))
+        self.RedrawRect((0, 0, w, h))
+
+    def RedrawRect(self, rect):
+        """Redraws only the `Card`s that intersect `rect` over the cached bitmap,
+        and refreshes that part of the screen.
+
+        * `rect: ` a `(x, y, w, h)` tuple, in minimap coordinates.
+        """
+        # grow the bitmap if a card fell outside of it
+        x, y, w, h = rect
+        bw, bh = self.buffer.GetSize()
+        if x + w > bw or y + h > bh:
+            self.UpdateContentSize(wx.Size((x + w) * self.factor, (y + h) * self.factor))
+            vw, vh = self.GetVirtualSize()
+            if vw > bw or vh > bh:
+                self.RedrawAll()
+                return
+
+        dc = wx.MemoryDC(self.buffer)
+        dc.SetClippingRegion(x, y, max(1, w), max(1, h))
+        dc.SetBackground(wx.Brush(self.BACKGROUND_CL))
+        dc.Clear()
+        dc.SetPen(wx.TRANSPARENT_PEN)
+        for card in self.index.Query(rect):
+            dc.SetBrush(wx.Brush(self.colours[card]))
+            dc.DrawRectangle(*self.index.GetRect(card))
+        dc.DestroyClippingRegion()
+        dc.SelectObject(wx.NullBitmap)
+
+        self.RefreshMinimapRect(rect)
+
+    def RefreshMinimapRect(self, rect):
+        """Refresh a region of the screen.
+
+        * `rect: ` a `(x, y, w, h)` tuple, in minimap coordinates.
+        """
+        x, y = self.CalcScrolledPosition(rect[0], rect[1])
+        self.RefreshRect(wx.Rect(x, y, rect[2] + 1, rect[3] + 1), eraseBackground=False)
+
+    def UpdateViewport(self):
+        """Scroll along with the `Deck` and move the viewport rectangle to
+        the part of the `Deck` currently in view."""
+        if not self: return
+
+        start = self.deck.GetViewStartPixels()
+        rate = self.GetScrollPixelsPerUnit()
+        self.Scroll(start.x / self.factor / max(1, rate[0]),
+                    start.y / self.factor / max(1, rate[1]))
+
+        w, h = self.deck.GetClientSize()
+        old = self.viewport
+        self.viewport = wx.Rect(*self.ScaleRect((start.x, start.y, w, h)))
+        self.RefreshMinimapRect(tuple(old))
+        self.RefreshMinimapRect(tuple(self.viewport))
+
+    def ScrollDeckTo(self, pos):
+        """Scroll the `Deck` so that the point under `pos` is at the center of
+        the view. The actual scrolling is done at most once every `SCROLL_MS`
+        milliseconds, no matter how many times this is called.
+
+        * `pos: ` a `(x, y)` point, in minimap client coordinates.
+        """
+        x, y = self.CalcUnscrolledPosition(pos[0], pos[1])
+        w, h = self.deck.GetClientSize()
+        pending = self.scroll_target is not None
+        self.scroll_target = (x * self.factor - w / 2, y * self.factor - h / 2)
+        if not pending:
+            wx.CallLater(self.SCROLL_MS, self.FlushScroll)
+
+    def FlushScroll(self):
+        """Apply the last scroll requested by `ScrollDeckTo`."""
+        if not self or self.scroll_target is None: return
+        x, y = self.scroll_target
+        self.scroll_target = None
+
+        rate = self.deck.GetScrollPixelsPerUnit()
+        self.deck.Scroll(max(0, x) / max(1, rate[0]), max(0, y) / max(1, rate[1]))
+        # Scroll() doesn't raise wx.EVT_SCROLLWIN
+        self.UpdateViewport()
 
     def SetPosition(self):
         """Calculates position relative to the `Deck`."""
@@ -108,31 +264,79 @@ class DeckView(utilities.AutoSize):
     def OnShow(self, ev):
         """Listens to `wx.EVT_SHOW`."""
         self.SetPosition()
+        self.UpdateViewport()
+
+    def OnPaint(self, ev):
+        """Listens to `wx.EVT_PAINT`. Copies the cached bitmap, and draws the viewport on top."""
+        dc = wx.PaintDC(self)
+        self.PrepareDC(dc)
+        dc.DrawBitmap(self.buffer, 0, 0)
+
+        dc.SetBrush(wx.TRANSPARENT_BRUSH)
+        dc.SetPen(wx.Pen(self.VIEWPORT_CL, 1, wx.SOLID))
+        dc.DrawRectangleRect(self.viewport)
+
+    def OnEraseBackground(self, ev):
+        """Listens to `wx.EVT_ERASE_BACKGROUND`. The cached bitmap covers everything."""
+        pass
+
+    def OnLeftDown(self, ev):
+        """Listens to `wx.EVT_LEFT_DOWN`."""
+        self.CaptureMouse()
+        self.ScrollDeckTo(ev.GetPosition())
+
+    def OnMotion(self, ev):
+        """Listens to `wx.EVT_MOTION`."""
+        if ev.Dragging() and ev.LeftIsDown() and self.HasCapture():
+            self.ScrollDeckTo(ev.GetPosition())
+
+    def OnLeftUp(self, ev):
+        """Listens to `wx.EVT_LEFT_UP`."""
+        if self.HasCapture():
+            self.ReleaseMouse()
+            self.ScrollDeckTo(ev.GetPosition())
+
+    def OnCaptureLost(self, ev):
+        """Listens to `wx.EVT_MOUSE_CAPTURE_LOST`."""
+        pass
 
     def OnDeckScroll(self, ev):
         """Listens to `wx.EVT_SCROLLWIN` from the underlying `Deck`."""
-        view = ev.GetEventObject().GetViewStart()
-        self.Scroll(view.x / self.factor, view.y / self.factor)
+        # the Deck hasn't scrolled yet: wait for it
+        wx.CallAfter(self.UpdateViewport)
+        ev.Skip()
 
     def OnDeckSize(self, ev):
         """Listens to `wx.EVT_SIZE` from the underlying `Deck`."""
         self.SetSize([i / self.factor + 30 for i in self.deck.GetSize()])
         self.SetPosition()
+        self.UpdateViewport()
+        ev.Skip()
 
     def OnNewCard(self, ev):
         """Listens to `Deck.EVT_NEW_CARD`."""
-        self.AddCard(ev.GetEventObject())
+        self.AddCards(ev.cards)
+        # don't consume it! others may also need it
+        ev.Skip()
 
-    def OnDeleteCard(self, ev):
-        """Listens to `Card.EVT_DELETE` from each `Card` on the `Deck`."""
-        self.RemoveCard(ev.GetEventObject())
-        # dont' consume it! Deck also needs it
+    def OnCardGeometry(self, ev):
+        """Listens to `Deck.EVT_CARD_GEOMETRY`."""
+        self.MoveCard(ev.GetEventObject(), ev.rect)
+        ev.Skip()
+
+    def OnDeleteCards(self, ev):
+        """Listens to `Deck.EVT_DEL_CARD`."""
+        self.RemoveCards(ev.cards)
+        # dont' consume it! Box also needs it
         ev.Skip()
 
     def OnContentKind(self, ev):
         """Listens to `Content.EVT_CONT_KIND` events from each `Content`."""
         card = ev.GetEventObject()
-        self.cards[card].SetBackgroundColour(card.GetBackgroundColour())
+        if self.index.Contains(card):
+            self.colours[card] = self.GetCardColour(card)
+            self.RedrawRect(self.index.GetRect(card))
+        ev.Skip()
             
 
 
@@ -235,22 +439,192 @@ class CardView(wx.Panel):
 
 
 ######################
-# MiniCard Class
+# PresentationView Class
 ######################        
 
-class MiniCard(wx.Window):
-    """The little cards shown in a `DeckView`"""
-    
+class PresentationView(wx.Panel):
+    """Shows `Content` `Card`s one at a time, as read-only pages, in the
+    `Deck`'s reading order (see `Deck.GetReadingOrder`). Pages are built from
+    the `Card`s' data (see `Card.Dump`), so the live `Card`s never leave the
+    `Deck`. The pages around the current one are built ahead of time and kept,
+    so that flipping through them only has to show and hide windows.
+    """
+
+    PREFETCH = 2
+    KEEP_BEHIND = 1
+    CARD_PADDING = CardView.CARD_PADDING
+    BACKGROUND_CL = CardView.BACKGROUND_CL
+    TITLE_FONT = CardView.TITLE_FONT
+    CONTENT_FONT = CardView.CONTENT_FONT
+
+    CancelEvent, EVT_CANCEL_PRESENT = ne.NewEvent()
+
     def __init__(self, parent, pos=wx.DefaultPosition, size=wx.DefaultSize):
         """Constructor.
 
-        * `parent: ` the parent `DeckView`.
+        * `parent: ` the parent `Box`.
         * `pos: ` by default, is `wx.DefaultSize`.
         * `size: ` by default, is `wx.DefaultSize`.
         """
-        super(MiniCard, self).__init__(parent, pos=pos, size=size)
-        
-        self.SetBackgroundColour("#FFFFFF")
+        super(PresentationView, self).__init__(parent, pos=pos, size=size)
+
+        # GUI
+        self.SetBackgroundColour(self.BACKGROUND_CL)
+        self.SetSizer(wx.BoxSizer(wx.HORIZONTAL))
+
+        # members
+        self.cards = []
+        self.pages = {}
+        self.current = -1
+        self.prefetch_pending = False
+
+        # bindings
+        self.Bind(wx.EVT_CHAR_HOOK, self.OnCharHook)
+
+
+    ### Behavior functions
+
+    def Start(self, deck, start=None):
+        """Start presenting the `Content`s in `deck`.
+
+        * `deck: ` a `Deck`.
+        * `start: ` the `Card` to show first. By default, the first one in reading order.
+        """
+        self.Clear()
+        self.cards = [c for c in deck.GetReadingOrder() if isinstance(c, card.Content)]
+        if not self.cards: return
+
+        i = self.cards.index(start) if start in self.cards else 0
+        self.ShowPage(i)
+
+    def GetCurrentCard(self):
+        """Get the `Card` whose page is being shown.
+
+        `returns: ` a `Card`, or None.
+        """
+        if 0 <= self.current < len(self.cards):
+            return self.cards[self.current]
+        return None
+
+    def Next(self, step=1):
+        """Show the page `step` places after the current one.
+
+        * `step: ` how many pages to move. Use a negative number to go backwards.
+        """
+        i = self.current + step
+        if 0 <= i < len(self.cards):
+            self.ShowPage(i)
+
+    def ShowPage(self, i):
+        """Show the page of the `i`th `Card`, building it only if it wasn't prefetched.
+
+        * `i: ` an index into the `Card`s being presented.
+        """
+        old = self.GetCurrentCard()
+        crd = self.cards[i]
+        page = self.GetPage(crd)
+
+        box = self.GetSizer()
+        box.Clear()
+        if old in self.pages and old != crd:
+            self.pages[old].Hide()
+        box.Add(page, proportion=1, flag=wx.ALL|wx.EXPAND, border=self.CARD_PADDING)
+        page.Show()
+        box.Layout()
+        self.current = i
+        self.SetFocus()
+
+        # build the next pages once this one is on screen
+        if not self.prefetch_pending:
+            self.prefetch_pending = True
+            wx.CallAfter(self.Prefetch)
+
+    def Prefetch(self):
+        """Build the pages of the next `PREFETCH` `Card`s, and forget those
+        that are too far away from the current one."""
+        self.prefetch_pending = False
+        if self.current < 0: return
+
+        first = max(0, self.current - self.KEEP_BEHIND)
+        last = min(len(self.cards), self.current + self.PREFETCH + 1)
+        keep = set(self.cards[first:last])
+        for c in self.pages.keys():
+            if c not in keep:
+                self.pages.pop(c).Destroy()
+        for c in self.cards[first:last]:
+            self.GetPage(c)
+
+    def Clear(self):
+        """Forget all pages and `Card`s."""
+        self.GetSizer().Clear()
+        for page in self.pages.values():
+            page.Destroy()
+        self.pages = {}
+        self.cards = []
+        self.current = -1
+
+
+    ### Auxiliary functions
+
+    def GetPage(self, crd):
+        """Get the page for `crd`, building it if needed.
+
+        * `crd: ` a `Content`.
+
+        `returns: ` a `wx.Panel`.
+        """
+        if crd not in self.pages:
+            self.pages[crd] = self.MakePage(crd.Dump())
+        return self.pages[crd]
+
+    def MakePage(self, data):
+        """Build a read-only page from a `Content`'s data. The page starts hidden.
+
+        * `data: ` a `dict` returned by `Content.Dump`.
+
+        `returns: ` a `wx.Panel`.
+        """
+        colours = Content.COLOURS.get(data.get("kind"), Content.COLOURS[card.KindButton.DEFAULT_LBL])
+
+        page = wx.Panel(self)
+        page.Hide()
+        page.SetBackgroundColour(colours["border"])
+        vbox = wx.BoxSizer(wx.VERTICAL)
+        page.SetSizer(vbox)
+
+        title = wx.StaticText(page, label=data.get("title", ""))
+        title.SetFont(wx.Font(*self.TITLE_FONT))
+
+        kind = card.KindButton.LONG_LABELS.get(data.get("kind"), "")
+        stars = "*" * data.get("rating", 0)
+        info = wx.StaticText(page, label=(kind + "  " + stars).strip())
+
+        content = wx.TextCtrl(page, value=data.get("content", ""),
+                              style=wx.TE_MULTILINE|wx.TE_READONLY|wx.BORDER_NONE)
+        content.SetFont(wx.Font(*self.CONTENT_FONT))
+        content.SetBackgroundColour(colours["bg"])
+
+        vbox.Add(title,   proportion=0, flag=wx.ALL|wx.EXPAND, border=self.CARD_PADDING)
+        vbox.Add(info,    proportion=0, flag=wx.LEFT|wx.RIGHT|wx.EXPAND, border=self.CARD_PADDING)
+        vbox.Add(content, proportion=1, flag=wx.ALL|wx.EXPAND, border=self.CARD_PADDING)
+        return page
+
+
+    ### Callbacks
+
+    def OnCharHook(self, ev):
+        """Listens to `wx.EVT_CHAR_HOOK`."""
+        key = ev.GetKeyCode()
+        if key in (wx.WXK_RIGHT, wx.WXK_DOWN, wx.WXK_PAGEDOWN, wx.WXK_SPACE):
+            self.Next(1)
+        elif key in (wx.WXK_LEFT, wx.WXK_UP, wx.WXK_PAGEUP, wx.WXK_BACK):
+            self.Next(-1)
+        elif key == wx.WXK_ESCAPE:
+            event = self.CancelEvent(id=wx.ID_ANY)
+            event.SetEventObject(self)
+            self.GetEventHandler().ProcessEvent(event)
+        else:
+            ev.Skip()
 
 
 
@@ -261,7 +635,7 @@ class MiniCard(wx.Window):
 class TagView(wx.Panel):
     """The sidebard that displays a `Content` `Card`'s tags."""
 
-    TAGS_REGEX = "^(\w+):(.*)$"
+    TAGS_REGEX = Content.TAGS_REGEX
     
     def __init__(self, parent, deck, pos=wx.DefaultPosition, size=wx.DefaultSize):
         """Constructor.
@@ -327,9 +701,10 @@ class TagView(wx.Panel):
 
     def OnNewCard(self, ev):
         """Listens to `Deck.EVT_NEW_CARD`."""
-        card = ev.GetEventObject()
-        for ch in card.GetChildren():
-            ch.Bind(wx.EVT_SET_FOCUS, self.OnCardChildFocus)
+        for card in ev.cards:
+            for ch in card.GetChildren():
+                ch.Bind(wx.EVT_SET_FOCUS, self.OnCardChildFocus)
+        ev.Skip()
 
     def OnCardChildFocus(self, ev):
         """Listens to `wx.EVT_SET_FOCUS` on every `Card`."""
@@ -357,8 +732,8 @@ for field in dir(utilities.AutoSize):
     __pdoc__['DeckView.%s' % field] = None
 for field in dir(wx.Panel):
     __pdoc__['CardView.%s' % field] = None
-for field in dir(wx.Window):
-    __pdoc__['MiniCard.%s' % field] = None
+for field in dir(wx.Panel):
+    __pdoc__['PresentationView.%s' % field] = None
 for field in dir(wx.Panel):
     __pdoc__['TagView.%s' % field] = None
 
@@ -370,9 +745,9 @@ for field in DeckView.__dict__.keys():
 for field in CardView.__dict__.keys():
     if 'CardView.%s' % field in __pdoc__.keys():
         del __pdoc__['CardView.%s' % field]
-for field in MiniCard.__dict__.keys():
-    if 'MiniCard.%s' % field in __pdoc__.keys():
-        del __pdoc__['MiniCard.%s' % field]
+for field in PresentationView.__dict__.keys():
+    if 'PresentationView.%s' % field in __pdoc__.keys():
+        del __pdoc__['PresentationView.%s' % field]
 for field in TagView.__dict__.keys():
     if 'TagView.%s' % field in __pdoc__.keys():
         del __pdoc__['TagView.%s' % field]